@@ -72,3 +72,67 @@ CREATE INDEX idx_equation_matches_status ON equation_matches(status);
 CREATE INDEX idx_equation_matches_cross_domain ON equation_matches(domain_1, domain_2)
     WHERE domain_1 != domain_2;
 CREATE INDEX idx_equation_matches_similarity ON equation_matches(similarity DESC);
+
+
+-- Normalizer provenance, so renormalize.py can skip rows a normalizer change
+-- doesn't affect. normalizer_version is NORMALIZER_VERSION from
+-- scripts/pipeline/normalize.py at the time the row was normalized (NULL =
+-- unknown / pre-dates tracking). preprocess_hash is the SHA-256 of the
+-- preprocessed LaTeX SymPy was given.
+ALTER TABLE equations ADD COLUMN IF NOT EXISTS normalizer_version INTEGER;
+ALTER TABLE equations ADD COLUMN IF NOT EXISTS preprocess_hash TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_equations_normalizer_version ON equations(normalizer_version);
+
+
+-- Subtree index for near-structural matching. One row per significant subtree
+-- of a parsed equation's canonical form (see _significant_subtrees in
+-- scripts/pipeline/normalize.py). subtree_hash ignores symbol names, so the
+-- same sub-expression hashes alike in any equation. nodes is the subtree's
+-- size and share its fraction of the whole equation.
+CREATE TABLE IF NOT EXISTS equation_subtrees (
+    subtree_hash    TEXT NOT NULL,
+    equation_id     INTEGER NOT NULL REFERENCES equations(id) ON DELETE CASCADE,
+    nodes           INTEGER NOT NULL,
+    share           REAL NOT NULL,
+    PRIMARY KEY (subtree_hash, equation_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_equation_subtrees_equation ON equation_subtrees(equation_id);
+
+
+-- Incremental matching. For each structural matcher (exact_structural,
+-- near_structural) the highest equation id it has already joined, see
+-- scripts/pipeline/match.py. A run only pairs equations above it.
+CREATE TABLE IF NOT EXISTS match_watermarks (
+    matcher             TEXT PRIMARY KEY,
+    last_equation_id    INTEGER NOT NULL,
+    updated_at          TIMESTAMP DEFAULT NOW()
+);
+
+
+-- Per-hash statistics for exact matching, refreshed for every hash an exact
+-- match run touches (see find_exact_matches in scripts/pipeline/match.py).
+-- A hash with more than MAX_EXACT_BUCKET equations is a hub and only gets
+-- representative pairs in equation_matches, and this row stands for the
+-- whole group.
+CREATE TABLE IF NOT EXISTS structure_buckets (
+    structure_hash  TEXT PRIMARY KEY,
+    equations       INTEGER NOT NULL,
+    papers          INTEGER NOT NULL,
+    domains         TEXT[] NOT NULL,
+    updated_at      TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_structure_buckets_equations ON structure_buckets(equations DESC);
+
+
+-- Shared embedding cache (see scripts/pipeline/embedcache.py). key is the
+-- SHA-256 of the model name and the normalized embedding input, so equations
+-- whose LaTeX normalizes alike are embedded once across the corpus.
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    key             TEXT PRIMARY KEY,
+    model           TEXT NOT NULL,
+    embedding       vector(384) NOT NULL,
+    created_at      TIMESTAMP DEFAULT NOW()
+);
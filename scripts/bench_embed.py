@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+bench_embed.py — Check an ONNX / int8 embedding backend against the fp32 model.
+
+Embeds a sample of equations with the default torch backend and with
+--backend (see pipeline/embed.py), and reports:
+  - load time and throughput of each, on the same distinct inputs;
+  - cosine agreement between the two vectors for each input (mean, 1st
+    percentile, min, and how many fall below --min-cosine);
+  - with --db, the effect on embedding matching: find_embedding_matches'
+    rule (each equation's 5 nearest cross-domain neighbours at or above
+    --threshold) is replayed in memory on both sets of vectors, and the pair
+    sets are compared.
+
+Nothing is written. Equations come from --file (no domains, so no match
+comparison), --db N (N random unparsed equations with their papers'
+domains), else the local source store.
+
+Usage:
+    python3 scripts/bench_embed.py [--backend onnx-int8] [--db 5000 | --file eqs.txt]
+                                   [--threshold 0.92] [--limit N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+
+from bench_preprocess import _from_file, _from_source_store
+from pipeline.ann import cross_domain_topk, unit_rows
+from pipeline.embed import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_EMBED_BACKEND,
+    EMBED_BACKENDS,
+    embed_equations,
+    embedder_available,
+    get_model,
+)
+from pipeline.match import EMBEDDING_NEIGHBOURS as NEIGHBOURS
+
+
+def _from_db(n: int) -> Tuple[List[str], List[str]]:
+    """(latex, domain) for n random equations of the kind that get embedded."""
+    from pipeline.config import get_connection
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT e.latex, p.domain FROM equations e
+            JOIN papers p ON e.paper_id = p.id
+            WHERE e.sympy_parsed = FALSE AND e.latex <> '' AND LENGTH(e.latex) >= 15
+                AND p.domain IS NOT NULL
+            ORDER BY random() LIMIT %s
+        """, (n,))
+        rows = cur.fetchall()
+    conn.close()
+    return [r[0] for r in rows], [r[1] for r in rows]
+
+
+def _embed(backend: str, texts: List[str], batch_size: int):
+    """(vectors, load seconds, encode seconds) for one backend."""
+    start = time.perf_counter()
+    get_model(backend)
+    loaded = time.perf_counter() - start
+    embed_equations(texts[:batch_size], batch_size, backend=backend)   # warm-up
+    start = time.perf_counter()
+    vectors = embed_equations(texts, batch_size, backend=backend)
+    elapsed = time.perf_counter() - start
+    return np.asarray(vectors, dtype=np.float32), loaded, elapsed
+
+
+def _match_pairs(vectors: np.ndarray, domains: List[str], threshold: float) -> Set[Tuple[int, int]]:
+    """find_embedding_matches' pairs, computed in memory: for each row, its
+    NEIGHBOURS most similar rows from other domains at or above threshold."""
+    labels = np.unique(np.asarray(domains), return_inverse=True)[1]
+    found = cross_domain_topk(unit_rows(vectors), labels, np.arange(len(vectors)),
+                              NEIGHBOURS, threshold)
+    return {(min(i, j), max(i, j)) for i, j, _ in found}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--backend', default='onnx-int8',
+                    choices=[b for b in EMBED_BACKENDS if b != DEFAULT_EMBED_BACKEND],
+                    help='Backend to compare with torch fp32 (default: onnx-int8)')
+    ap.add_argument('--file', type=str, default=None,
+                    help='Read equations from this file, one per line')
+    ap.add_argument('--db', type=int, default=None,
+                    help='Sample this many unparsed equations (with domains) from the DB')
+    ap.add_argument('--limit', type=int, default=None,
+                    help='Max equations to embed (default: all)')
+    ap.add_argument('--threshold', type=float, default=0.92,
+                    help='Similarity threshold for the match comparison (default: 0.92)')
+    ap.add_argument('--min-cosine', type=float, default=0.99,
+                    help='Count inputs whose two vectors agree less than this (default: 0.99)')
+    ap.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = ap.parse_args()
+
+    for backend in (DEFAULT_EMBED_BACKEND, args.backend):
+        if not embedder_available(backend):
+            print(f'Backend {backend} unavailable: pip install "sentence-transformers[onnx]>=3.2"')
+            sys.exit(1)
+
+    domains: Optional[List[str]] = None
+    if args.file:
+        equations = _from_file(args.file)
+    elif args.db:
+        equations, domains = _from_db(args.db)
+    else:
+        equations = _from_source_store()
+    if args.limit:
+        equations = equations[:args.limit]
+        domains = domains[:args.limit] if domains else None
+    if not equations:
+        print('No equations. Pass --file or --db, or run the pipeline to fill the source store.')
+        return
+
+    # Time both backends on the same distinct inputs, then map back to rows.
+    texts = list(dict.fromkeys(equations))
+    index = {latex: i for i, latex in enumerate(texts)}
+    rows = [index[latex] for latex in equations]
+    print(f'{len(equations)} equations, {len(texts)} distinct')
+
+    results = {}
+    seconds = {}
+    for backend in (DEFAULT_EMBED_BACKEND, args.backend):
+        results[backend], loaded, seconds[backend] = _embed(backend, texts, args.batch_size)
+        print(f'  {backend:10s} load {loaded:6.2f}s   encode {seconds[backend]:7.2f}s  '
+              f'({len(texts) / seconds[backend] if seconds[backend] else 0:.0f} eq/s)')
+    if seconds[args.backend]:
+        print(f'  Speed-up: {seconds[DEFAULT_EMBED_BACKEND] / seconds[args.backend]:.1f}x')
+
+    base = unit_rows(results[DEFAULT_EMBED_BACKEND])
+    cand = unit_rows(results[args.backend])
+    cos = np.sum(base * cand, axis=1)
+    print(f'\nCosine agreement with {DEFAULT_EMBED_BACKEND} fp32:')
+    print(f'  mean {cos.mean():.5f}   p1 {np.percentile(cos, 1):.5f}   min {cos.min():.5f}')
+    low = np.flatnonzero(cos < args.min_cosine)
+    print(f'  below {args.min_cosine}: {len(low)}/{len(texts)}')
+    for i in low[np.argsort(cos[low])][:5]:
+        print(f'    {cos[i]:.4f}  {texts[i][:90]!r}')
+
+    if domains is None:
+        print('\n(match comparison needs --db, for domains)')
+        return
+    ref = _match_pairs(results[DEFAULT_EMBED_BACKEND][rows], domains, args.threshold)
+    new = _match_pairs(results[args.backend][rows], domains, args.threshold)
+    both = len(ref & new)
+    union = len(ref | new)
+    print(f'\nEmbedding matches at {args.threshold} (top {NEIGHBOURS} cross-domain neighbours):')
+    print(f'  {DEFAULT_EMBED_BACKEND}: {len(ref)}   {args.backend}: {len(new)}   '
+          f'shared: {both}   lost: {len(ref - new)}   gained: {len(new - ref)}')
+    print(f'  Jaccard: {both / union if union else 1.0:.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+bench_extract.py — Compare the single-pass math scanner with the old regex path.
+
+Runs extract_equations_from_tex over every paper in the local source store
+(see pipeline/sources.py — nothing is downloaded) and, side by side, the
+previous implementation: a per-line comment strip and four finditer sweeps.
+Checks that both produce identical (latex, env) lists for every file and
+prints the time each took.
+
+--adversarial adds synthetic worst cases (thousands of unclosed \\[ or
+\\begin{equation}) where the lazy regexes go quadratic.
+
+Usage:
+    python3 scripts/bench_extract.py [--limit N] [--adversarial]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+import time
+from typing import List, Tuple
+
+from pipeline import extract as ext
+from pipeline.sources import get_source_store
+
+
+def _legacy_strip_comments(tex: str) -> str:
+    return '\n'.join(re.sub(r'(?<!\\)%.*$', '', line) for line in tex.split('\n'))
+
+
+def legacy_extract(tex: str) -> List[Tuple[str, str]]:
+    """extract_equations_from_tex as it was before scan_math_spans (no macros)."""
+    if not ext._looks_like_latex(tex):
+        return []
+    tex = ext._strip_embedded_postscript(tex)
+    tex = _legacy_strip_comments(tex)
+    tex = ext._strip_macro_definitions(tex)
+    results = []
+    for match in ext.DISPLAY_ENV_RE.finditer(tex):
+        env_name = match.group(1)
+        for eq in ext._split_align_rows(match.group(2), env_name):
+            eq = ext._clean_latex(eq)
+            if eq and not ext._is_trivial(eq):
+                results.append((eq, env_name))
+    for match in ext.DISPLAY_DOLLAR_RE.finditer(tex):
+        eq = ext._clean_latex(match.group(1))
+        if eq and not ext._is_trivial(eq):
+            results.append((eq, 'display_dollar'))
+    for match in ext.BRACKET_DISPLAY_RE.finditer(tex):
+        eq = ext._clean_latex(match.group(1))
+        if eq and not ext._is_trivial(eq):
+            results.append((eq, 'bracket_display'))
+    for match in ext.INLINE_MATH_RE.finditer(tex):
+        eq = ext._clean_latex(match.group(1))
+        if eq and not ext._is_trivial(eq) and re.search(
+            r'[=~]|\\sim|\\approx|\\propto|\\frac\{d|\\partial|\\nabla', eq
+        ):
+            results.append((eq, 'inline'))
+    return results
+
+
+def _cached_papers(limit=None):
+    """(label, [tex, ...]) for each object in the local source store."""
+    store = get_source_store()
+    if store is None:
+        print('Source store is disabled (ANALOG_QUEST_SOURCE_CACHE=off).')
+        return
+    names = sorted(n for n in os.listdir(store.objects_dir) if not n.startswith('.tmp-'))
+    for name in names[:limit]:
+        with open(os.path.join(store.objects_dir, name), 'rb') as f:
+            tex_files = ext._decode_source(f.read())
+        if tex_files:
+            yield name[:12], tex_files
+
+
+def _adversarial():
+    preamble = '\\documentclass{article}\n\\begin{document}\n'
+    yield 'unclosed-brackets', [preamble + '\\[ x ' * 4000]
+    yield 'unclosed-envs', [preamble + '\\begin{equation} x ' * 4000]
+    yield 'unclosed-mixed', [preamble + '\\begin{align} \\[ y ' * 4000 + '$a = b$']
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--limit', type=int, default=None,
+                    help='Max cached papers to read (default: all)')
+    ap.add_argument('--adversarial', action='store_true',
+                    help='Also time synthetic worst-case inputs')
+    args = ap.parse_args()
+
+    if ext.EXPAND_MACROS:
+        print('Unset ANALOG_QUEST_EXPAND_MACROS: the legacy path here does not expand.')
+        sys.exit(1)
+
+    papers = [(label, tex_files, False) for label, tex_files in _cached_papers(args.limit)]
+    if args.adversarial:
+        papers += [(label, tex_files, True) for label, tex_files in _adversarial()]
+    if not papers:
+        print('No cached papers. Run the pipeline (or measure_macro_impact.py) first.')
+        return
+
+    t_old = t_new = 0.0
+    files = equations = mismatches = 0
+    for label, tex_files, synthetic in papers:
+        paper_old = paper_new = 0.0
+        for tex in tex_files:
+            start = time.perf_counter()
+            old = legacy_extract(tex)
+            paper_old += time.perf_counter() - start
+
+            start = time.perf_counter()
+            new = ext.extract_equations_from_tex(tex)
+            paper_new += time.perf_counter() - start
+
+            files += 1
+            equations += len(new)
+            if old != new:
+                mismatches += 1
+                print(f'  MISMATCH in {label}: {len(old)} legacy vs {len(new)} scanner equations')
+        t_old += paper_old
+        t_new += paper_new
+        if synthetic:
+            print(f'  {label:18s} legacy {paper_old * 1000:8.1f} ms   '
+                  f'scanner {paper_new * 1000:8.1f} ms')
+
+    print(f'\n{len(papers)} papers, {files} files, {equations} equations')
+    print(f'  Legacy regex path:  {t_old:.2f}s')
+    print(f'  Single-pass scanner: {t_new:.2f}s  ({t_old / t_new if t_new else 0:.1f}x)')
+    print(f'  Identical output:   {"yes" if mismatches == 0 else f"NO — {mismatches} files differ"}')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+bench_parser.py — Compare SymPy's ANTLR and Lark LaTeX parsers on real equations.
+
+normalize_latex spends most of its time in step 3, parse_latex. SymPy ships
+a second, Lark-based LaTeX grammar; this runs the normalizer with each parser
+over a sample of equations and reports, per parser, how many parse and how
+long it took — plus, for equations both parse, whether the structure_hash
+agrees. The pipeline only ever uses parse_latex; this is how to judge whether
+another parser would be worth switching to.
+
+Equations come from the same places as bench_preprocess.py (--file, --db,
+else the local source store).
+
+Usage:
+    python3 scripts/bench_parser.py [--file eqs.txt | --db 5000] [--limit N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from bench_preprocess import _from_db, _from_file, _from_source_store
+from pipeline.normalize import _get_parser, _normalize_preprocessed, _preprocess_latex
+
+
+def _lark_parser():
+    """SymPy's Lark parser, adapted to behave as much like parse_latex as it can.
+
+    parse_latex builds unevaluated expressions (a x + b stays Add(a*x, b));
+    Lark's transformer uses the ordinary operators, so it runs under
+    evaluate(False) to get the same argument order. Where the grammar is
+    ambiguous (rN(1-N/K): product or function call?) it returns an '_ambig'
+    tree of alternatives; we take the first, which is usually the reading
+    the ANTLR parser picks (not for \\sin x + \\cos^2 x). Anything else it
+    can't turn into an expression is raised as a parse failure.
+
+    The result is close to, not identical with, parse_latex's: log carries no
+    explicit base, 1/x becomes Mul(1, Pow(x, -1)), sqrt a Rational power.
+    """
+    from lark import Tree
+    from sympy import Basic, evaluate
+    from sympy.parsing.latex.lark import LarkLaTeXParser
+
+    parser = LarkLaTeXParser()
+
+    def parse(side: str):
+        with evaluate(False):
+            expr = parser.doparse(side)
+        while isinstance(expr, Tree) and expr.data == '_ambig':
+            expr = expr.children[0]
+        if not isinstance(expr, Basic):
+            # e.g. ('derivative', t) for \frac{d}{dt} with nothing to apply it to
+            raise ValueError(f'Lark parser returned {type(expr).__name__}, not an expression')
+        return expr
+
+    return parse
+
+
+PARSERS = {'antlr': _get_parser, 'lark': _lark_parser}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--file', type=str, default=None,
+                    help='Read equations from this file, one per line')
+    ap.add_argument('--db', type=int, default=None,
+                    help='Sample this many equations from the equations table')
+    ap.add_argument('--limit', type=int, default=None,
+                    help='Max equations to normalize (default: all)')
+    args = ap.parse_args()
+
+    if args.file:
+        equations = _from_file(args.file)
+    elif args.db:
+        equations = _from_db(args.db)
+    else:
+        equations = _from_source_store()
+    equations = list(dict.fromkeys(equations))[:args.limit]
+    if not equations:
+        print('No equations. Pass --file or --db, or run the pipeline to fill the source store.')
+        return
+
+    # Preprocessing is the same for both; only step 3 differs.
+    preprocessed = [_preprocess_latex(eq) for eq in equations]
+
+    results = {}
+    print(f'{len(equations)} distinct equations')
+    for name, make_parser in PARSERS.items():
+        try:
+            start = time.perf_counter()
+            parse = make_parser()
+            _normalize_preprocessed(equations[0], preprocessed[0], parse)   # first-call imports
+            setup = time.perf_counter() - start
+        except ImportError as e:
+            print(f'  {name:6s} unavailable ({e})')
+            continue
+        start = time.perf_counter()
+        results[name] = [_normalize_preprocessed(eq, pre, parse)
+                         for eq, pre in zip(equations, preprocessed)]
+        elapsed = time.perf_counter() - start
+        parsed = sum(r.success for r in results[name])
+        print(f'  {name:6s} {elapsed:7.2f}s  ({1000 * elapsed / len(equations):.2f} ms/eq, '
+              f'setup {1000 * setup:.0f} ms)  parsed {parsed} '
+              f'({100 * parsed / len(equations):.1f}%)')
+
+    if len(results) < 2:
+        return
+    antlr, lark = results['antlr'], results['lark']
+    both = [i for i, (a, b) in enumerate(zip(antlr, lark)) if a.success and b.success]
+    differ = [i for i in both if antlr[i].structure_hash != lark[i].structure_hash]
+    only_lark = sum(1 for a, b in zip(antlr, lark) if b.success and not a.success)
+    print(f'\n  Parsed by both: {len(both)}, lark only: {only_lark}')
+    for i in differ[:5]:
+        print(f'  HASH DIFFERS: {equations[i][:100]!r}')
+    print(f'  Hashes agree:   {len(both) - len(differ)}/{len(both)}')
+
+
+if __name__ == '__main__':
+    main()
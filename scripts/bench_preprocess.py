@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+bench_preprocess.py — Time _preprocess_latex's rule table against the old chain.
+
+_preprocess_latex used to run ~45 re.sub / str.replace calls in sequence on
+every equation. It now walks a precompiled rule table, skipping rules whose
+trigger substrings are absent (and the whole table when none is). This runs
+both over a sample of real equations, checks they agree on every one, and
+prints the time each took and how many equations tripped no rule at all.
+
+Equations come from (first that applies):
+  --file PATH    one LaTeX string per line
+  --db N         N random rows of equations.latex
+  (default)      extracted from every paper in the local source store
+
+Usage:
+    python3 scripts/bench_preprocess.py [--file eqs.txt | --db 20000] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import time
+from typing import List
+
+from pipeline import normalize as norm
+
+
+def legacy_preprocess(latex: str) -> str:
+    """_preprocess_latex as it was before the rule table."""
+    s = latex
+    s = re.sub(r'\\leftarrow\b', '=', s)
+    s = re.sub(r'\\gets\b', '=', s)
+    s = re.sub(r':=', '=', s)
+    s = re.sub(r'\^\{\\top\}', '_Tp', s)
+    s = re.sub(r'\^\\top\b', '_Tp', s)
+    s = re.sub(r'\^\{T\}', '_Tp', s)
+    s = re.sub(r'\^T\b', '_Tp', s)
+    s = re.sub(r'\^\{[*]\}', '_Cj', s)
+    s = re.sub(r'\^[*]', '_Cj', s)
+    s = re.sub(r'\^\{\\dagger\}', '_Hm', s)
+    s = re.sub(r'\^\\dagger\b', '_Hm', s)
+    s = re.sub(r'\^\{H\}', '_Hm', s)
+    s = re.sub(r'\^H\b', '_Hm', s)
+    time_index = r'(?<![A-Za-z])([A-Za-z])\s*(?:_\{[^}]*\}|_[A-Za-z])?\s*\^\{\(([^)]*[A-Za-z][^)]*)\)\}'
+    s = re.sub(time_index, lambda m: f'{m.group(1)}_{{{m.group(2)}}}', s)
+    s = re.sub(
+        r'(?<![A-Za-z])\{([A-Za-z])\}\s*(?:_\{[^}]*\}|_[A-Za-z])?\s*\^\{\(([^)]*[A-Za-z][^)]*)\)\}',
+        lambda m: f'{m.group(1)}_{{{m.group(2)}}}',
+        s
+    )
+    s = re.sub(r'\\nabla_\{[^}]+\}', r'\\nabla', s)
+    s = re.sub(r'\\nabla_\\[A-Za-z]+', r'\\nabla', s)
+    s = re.sub(r'\\nabla_[A-Za-z]', r'\\nabla', s)
+    s = s.replace(r'\left', '').replace(r'\right', '')
+    s = s.replace(r'\bigl', '').replace(r'\bigr', '')
+    s = s.replace(r'\Bigl', '').replace(r'\Bigr', '')
+    s = s.replace(r'\biggl', '').replace(r'\biggr', '')
+    s = s.replace(r'\displaystyle', '')
+    s = s.replace(r'\textstyle', '')
+    s = s.replace(r'\scriptstyle', '')
+    s = norm._FONT_MACRO_RE.sub(r' \2 ', s)
+    s = re.sub(time_index, lambda m: f'{m.group(1)}_{{{m.group(2)}}}', s)
+    s = s.replace(r'\quad', ' ')
+    s = s.replace(r'\qquad', ' ')
+    s = s.replace(r'\,', ' ')
+    s = s.replace(r'\;', ' ')
+    s = s.replace(r'\!', '')
+    s = re.sub(r'\\dot\{([^}]+)\}', r'\\frac{d \1}{d t}', s)
+    s = re.sub(r'\\ddot\{([^}]+)\}', r'\\frac{d^2 \1}{d t^2}', s)
+    for cmd in ('hat', 'tilde', 'bar', 'vec', 'widehat', 'widetilde', 'overline', 'underline'):
+        s = re.sub(r'\\' + cmd + r'\{([^}]+)\}', r'\1', s)
+    if r'\partial' in s or r'\nabla' in s:
+        s = re.sub(r'\\Delta\s+([A-Za-z{\\])', r'\\nabla^2 \1', s)
+        s = re.sub(r'\\Delta\b(?!\s*[=<>])', r'\\nabla^2', s)
+    for _ in range(6):
+        new_s = re.sub(r'_\{\s*_\{([^{}]*)\}\s*\}', r'_{\1}', s)
+        new_s = re.sub(r'\^\{\s*\^\{([^{}]*)\}\s*\}', r'^{\1}', new_s)
+        new_s = re.sub(r'(_|\^)\{\{([^{}]*)\}\}', r'\1{\2}', new_s)
+        if new_s == s:
+            break
+        s = new_s
+    s = re.sub(r'(_\{[^}]+\})(_\{[A-Za-z]\}|_[A-Za-z])\b', r'\1', s)
+    s = s.replace(r'\limits', '')
+    s = re.sub(r'\s+', ' ', s).strip()
+    return s
+
+
+def _from_file(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+def _from_db(n: int) -> List[str]:
+    from pipeline.config import get_connection
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT latex FROM equations WHERE latex <> '' ORDER BY random() LIMIT %s", (n,))
+        rows = [r[0] for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+
+def _from_source_store() -> List[str]:
+    from bench_extract import _cached_papers
+    from pipeline.extract import extract_equations_from_tex
+    return [latex for _label, tex_files in _cached_papers()
+            for tex in tex_files for latex, _env in extract_equations_from_tex(tex)]
+
+
+def _time(fn, equations: List[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for eq in equations:
+            fn(eq)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--file', type=str, default=None,
+                    help='Read equations from this file, one per line')
+    ap.add_argument('--db', type=int, default=None,
+                    help='Sample this many equations from the equations table')
+    ap.add_argument('--repeat', type=int, default=3,
+                    help='Timing runs per implementation; the best is reported')
+    args = ap.parse_args()
+
+    if args.file:
+        equations = _from_file(args.file)
+    elif args.db:
+        equations = _from_db(args.db)
+    else:
+        equations = _from_source_store()
+    if not equations:
+        print('No equations. Pass --file or --db, or run the pipeline to fill the source store.')
+        return
+
+    mismatches = [eq for eq in equations if legacy_preprocess(eq) != norm._preprocess_latex(eq)]
+    for eq in mismatches[:5]:
+        print(f'  MISMATCH: {eq[:100]!r}')
+
+    untouched = sum(
+        1 for eq in equations
+        if norm._ANY_TRIGGER_RE.search(eq) is None and norm._NESTED_SCRIPT_RE.search(eq) is None
+    )
+    t_old = _time(legacy_preprocess, equations, args.repeat)
+    t_new = _time(norm._preprocess_latex, equations, args.repeat)
+
+    n = len(equations)
+    print(f'\n{n} equations, {untouched} ({100 * untouched / n:.1f}%) trip no rule')
+    print(f'  Legacy re.sub chain: {t_old:.3f}s  ({1e6 * t_old / n:.1f} µs/eq)')
+    print(f'  Rule table:          {t_new:.3f}s  ({1e6 * t_new / n:.1f} µs/eq, '
+          f'{t_old / t_new if t_new else 0:.1f}x)')
+    print(f'  Identical output:    {"yes" if not mismatches else f"NO — {len(mismatches)} differ"}')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
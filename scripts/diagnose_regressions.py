@@ -9,27 +9,15 @@ from __future__ import annotations
 
 import argparse
 import sys
-from typing import Dict, List
-
-from pipeline.extract import (
-    fetch_latex_source,
-    extract_equations_from_tex,
-    _strip_comments,
-    _strip_embedded_postscript,
-)
-from pipeline.macros import collect_macros, expand_macros, MacroDef
+from typing import List
+
+from pipeline.extract import collect_paper_macros, extract_from_source, fetch_latex_source
 from pipeline.normalize import normalize_latex
 
 
-def _extract_with_macros_list(tex_files: List[str]) -> List[str]:
-    paper_macros: Dict[str, MacroDef] = {}
-    for tex in tex_files:
-        clean = _strip_comments(_strip_embedded_postscript(tex))
-        paper_macros.update(collect_macros(clean))
-    eqs: List[str] = []
-    for tex in tex_files:
-        for eq, _env in extract_equations_from_tex(tex, extra_macros=paper_macros):
-            eqs.append(eq)
+def _extract_with_macros_list(tex_files: List[str]):
+    paper_macros = collect_paper_macros(tex_files)
+    eqs = [eq.latex for eq in extract_from_source('', tex_files).equations]
     return eqs, paper_macros
 
 
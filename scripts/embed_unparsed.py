@@ -5,19 +5,31 @@ embed_unparsed.py — Generate vector embeddings for equations SymPy couldn't pa
 Runs against existing equations in the DB where sympy_parsed = FALSE.
 Uses sentence-transformers all-MiniLM-L6-v2 (384-dim).
 
+Rows whose LaTeX normalizes to the same embedding input are embedded once.
+With --cache (or ANALOG_QUEST_EMBED_CACHE / ANALOG_QUEST_EMBED_CACHE_DB, see
+pipeline/embedcache.py) vectors are reused across runs too.
+
 After embedding, runs cross-domain embedding similarity matching.
 """
 
 from __future__ import annotations
 
+import argparse
 import sys
 import time
 
-from pipeline.config import get_connection
-from pipeline.embed import _normalize_latex_for_embedding
+from pipeline.config import ConnectionManager, get_connection
+from pipeline.embed import DEFAULT_BATCH_SIZE, embed_equations, model_id
+from pipeline.embedcache import get_embedding_cache
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Embed equations SymPy could not parse')
+    parser.add_argument('--cache', default=None,
+                        help='SQLite file for cross-run embedding caching '
+                             '(default: $ANALOG_QUEST_EMBED_CACHE, else memory only)')
+    args = parser.parse_args()
+
     conn = get_connection()
     print('Connected to database.\n')
 
@@ -40,21 +52,19 @@ def main():
         conn.close()
         return
 
-    # Load model
-    print('Loading sentence-transformers model (may download on first run)...')
-    from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    print('Model loaded.\n')
-
-    # Normalize latex for embedding
     ids = [r[0] for r in rows]
-    normalized = [_normalize_latex_for_embedding(r[1]) for r in rows]
+    cache_db = ConnectionManager(maxconn=1)
+    cache = get_embedding_cache(model_id(), args.cache, db=cache_db)
 
-    # Batch embed
-    print(f'Embedding {len(normalized)} strings...')
+    # Batch embed (the model loads on first miss, and may download on first run)
+    print(f'Embedding {len(rows)} strings...')
     t0 = time.time()
-    embeddings = model.encode(normalized, batch_size=64, show_progress_bar=True)
+    embeddings = embed_equations([r[1] for r in rows], DEFAULT_BATCH_SIZE,
+                                 cache=cache, progress=True)
     print(f'Done in {time.time() - t0:.1f}s')
+    print(f'  Cache: {cache.summary()}')
+    cache.close()
+    cache_db.close()
 
     # Batch UPDATE via execute_values
     print('\nWriting embeddings to DB (batched)...')
@@ -85,8 +85,7 @@ def main():
         aid = m['arxiv_id']
         if os.path.exists(bundle_path(aid)):
             continue
-        r = extract_paper(aid)
-        time.sleep(DELAY)
+        r = extract_paper(aid)   # rate-limited (and cached) inside fetch_latex_source
         if not r.source_available:
             fail += 1
             continue
@@ -2,7 +2,8 @@
 in ground_truth.json and distractors.json.
 
 Output: data/bundles/<arxiv_id with / -> _>.json
-Idempotent: existing bundles are skipped. arXiv rate limit respected (3s).
+Idempotent: existing bundles are skipped. arXiv rate limit respected (3s);
+sources already in the local source store are not re-downloaded.
 """
 
 import json
@@ -97,8 +98,7 @@ def main():
 
     failures = []
     for aid in todo:
-        result = extract_paper(aid)   # includes its own polite delay via urllib call pattern
-        time.sleep(DELAY)
+        result = extract_paper(aid)   # rate-limited (and cached) inside fetch_latex_source
         if not result.source_available:
             failures.append((aid, result.error))
             print('  FAIL %s: %s' % (aid, result.error))
@@ -3,7 +3,8 @@
 measure_macro_impact.py — Before/after impact measurement for macro expansion.
 
 Pulls a random sample of arxiv_ids from the papers table, re-fetches each
-paper's LaTeX source, runs two extractions in parallel:
+paper's LaTeX source (served from the local source store on re-runs, so
+repeated A/B measurements cost no network), runs two extractions in parallel:
 
   OLD: extract_equations without macro expansion
   NEW: extract_equations with macro expansion
@@ -32,30 +33,17 @@ from __future__ import annotations
 import argparse
 import random
 import sys
-import time
 from typing import Dict, List, Tuple
 
 from pipeline.config import get_connection
-from pipeline.extract import (
-    fetch_latex_source,
-    extract_equations_from_tex,
-    _strip_comments,
-    _strip_embedded_postscript,
-)
-from pipeline.macros import collect_macros, MacroDef
+from pipeline.extract import extract_from_source, fetch_latex_source
+from pipeline.macros import ExpansionStats
 from pipeline.normalize import normalize_latex
 
 
-def _extract_with_macros(tex_files: List[str]) -> List[str]:
-    paper_macros: Dict[str, MacroDef] = {}
-    for tex in tex_files:
-        clean = _strip_comments(_strip_embedded_postscript(tex))
-        paper_macros.update(collect_macros(clean))
-    eqs: List[str] = []
-    for tex in tex_files:
-        for eq, _env in extract_equations_from_tex(tex, extra_macros=paper_macros):
-            eqs.append(eq)
-    return eqs
+def _extract_with_macros(tex_files: List[str], expansion_stats: ExpansionStats) -> List[str]:
+    result = extract_from_source('', tex_files, expansion_stats=expansion_stats)
+    return [eq.latex for eq in result.equations]
 
 
 def _extract_without_macros(tex_files: List[str]) -> List[str]:
@@ -162,6 +150,7 @@ def main():
                'low_quality': 0, 'garbage_shape': 0}
     agg_new = dict(agg_old)
     fetch_failures = 0
+    expansion_stats = ExpansionStats()
 
     for i, aid in enumerate(ids):
         print(f'[{i+1}/{len(ids)}] {aid}... ', end='', flush=True)
@@ -169,11 +158,10 @@ def main():
         if not tex_files:
             print('FETCH FAILED')
             fetch_failures += 1
-            time.sleep(3)
             continue
 
         old_eqs = _extract_without_macros(tex_files)
-        new_eqs = _extract_with_macros(tex_files)
+        new_eqs = _extract_with_macros(tex_files, expansion_stats)
         s_old = _score_batch(old_eqs)
         s_new = _score_batch(new_eqs)
 
@@ -186,8 +174,6 @@ def main():
         d_garbage = s_new['garbage_shape'] - s_old['garbage_shape']
         print(f"parsed Δ{d_parsed:+d} | HQ Δ{d_hq:+d} | garbage Δ{d_garbage:+d}")
 
-        time.sleep(3)
-
     print('\n' + '=' * 72)
     print('AGGREGATE')
     print('=' * 72)
@@ -222,6 +208,7 @@ def main():
     print('Garbage-shape rate (of parsed): '
           f'OLD {_pct(agg_old["garbage_shape"], agg_old["parsed"]):>8}'
           f'    NEW {_pct(agg_new["garbage_shape"], agg_new["parsed"]):>8}')
+    print(f'Macro expansion memo: {expansion_stats.summary()}')
 
 
 if __name__ == '__main__':
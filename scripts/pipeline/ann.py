@@ -0,0 +1,142 @@
+"""
+ann.py — Cross-domain nearest neighbours over an in-memory embedding matrix.
+
+find_embedding_matches' SQL runs one LATERAL nearest-neighbour query per
+unparsed equation, and its similarity and domain filters keep pgvector's
+ivfflat index from being used, so each of those queries scans the table.
+This module does the same search in bulk once the embeddings are loaded
+into a float32 matrix:
+
+  numpy     exact. Blocked matrix products: a block of query rows against
+            every row, same-domain entries masked out, top-k taken with
+            argpartition. Block size is capped so one product stays around
+            BLOCK_FLOATS floats.
+  hnswlib   approximate. One HNSW graph per domain; each query searches
+  faiss     every other domain's graph and keeps the best k overall.
+            Same-domain neighbours never take a slot, so no over-fetching
+            is needed. Each needs its package installed (hnswlib,
+            faiss-cpu).
+
+All of them return, for each query row, up to k neighbours from other
+domains whose cosine similarity is at least the threshold.
+"""
+
+from __future__ import annotations
+
+from typing import Iterator, Tuple
+
+import numpy as np
+
+
+ANN_METHODS = ('numpy', 'hnswlib', 'faiss')
+
+# Floats per similarity block in the numpy search (64 MB at float32).
+BLOCK_FLOATS = 16_000_000
+
+# HNSW build / search parameters.
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+
+def unit_rows(vectors: np.ndarray) -> np.ndarray:
+    """float32 copy of `vectors` with every row scaled to length 1."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def cross_domain_topk(
+    unit: np.ndarray,
+    labels: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    threshold: float,
+    method: str = 'numpy',
+) -> Iterator[Tuple[int, int, float]]:
+    """Yield (query row, neighbour row, cosine) for each query's k nearest
+    rows with a different label, keeping those at or above threshold.
+
+    `unit` holds unit-length rows (see unit_rows), `labels` one integer
+    domain per row, `queries` the row indices to search for.
+    """
+    if method not in ANN_METHODS:
+        raise ValueError(f'unknown ANN method {method!r} (expected one of {", ".join(ANN_METHODS)})')
+    if k <= 0 or len(queries) == 0:
+        return iter(())
+    if method == 'numpy':
+        return _numpy_topk(unit, labels, queries, k, threshold)
+    return _index_topk(unit, labels, queries, k, threshold, method)
+
+
+def _numpy_topk(unit, labels, queries, k, threshold):
+    n = len(unit)
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+    block = max(1, BLOCK_FLOATS // n)
+    for start in range(0, len(queries), block):
+        q = queries[start:start + block]
+        sims = unit[q] @ unit.T
+        sims[labels[q][:, None] == labels[None, :]] = -np.inf
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        rows, cols = np.nonzero(top_sims >= threshold)
+        yield from zip(q[rows].tolist(), top[rows, cols].tolist(), top_sims[rows, cols].tolist())
+
+
+def _build_index(method: str, data: np.ndarray):
+    """A search(query_vectors, k) -> (row indices into data, cosines) for data."""
+    dim = data.shape[1]
+    if method == 'hnswlib':
+        import hnswlib
+        index = hnswlib.Index(space='ip', dim=dim)
+        index.init_index(max_elements=len(data), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        index.add_items(data, np.arange(len(data)))
+
+        def search(q, k):
+            index.set_ef(max(HNSW_EF_SEARCH, k))
+            idx, dist = index.knn_query(q, k=k)
+            return idx.astype(np.int64), 1.0 - dist     # 'ip' distance is 1 - dot
+
+        return search
+
+    import faiss
+    index = faiss.IndexHNSWFlat(dim, 2 * HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.add(np.ascontiguousarray(data))
+
+    def search(q, k):
+        index.hnsw.efSearch = max(HNSW_EF_SEARCH, k)
+        sims, idx = index.search(np.ascontiguousarray(q), k)
+        return idx, sims                                # idx is -1 where short
+
+    return search
+
+
+def _index_topk(unit, labels, queries, k, threshold, method):
+    found_q, found_j, found_s = [], [], []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        q = queries[labels[queries] != label]
+        if len(q) == 0:
+            continue
+        kk = min(k, len(members))
+        idx, sims = _build_index(method, unit[members])(unit[q], kk)
+        keep = (idx >= 0) & (sims >= threshold)
+        rows, cols = np.nonzero(keep)
+        found_q.append(q[rows])
+        found_j.append(members[idx[rows, cols]])
+        found_s.append(sims[rows, cols].astype(np.float32))
+    if not found_q:
+        return
+    q = np.concatenate(found_q)
+    j = np.concatenate(found_j)
+    s = np.concatenate(found_s)
+    # Best k per query across all domains: sort by query, then similarity desc.
+    order = np.lexsort((-s, q))
+    q, j, s = q[order], j[order], s[order]
+    first = np.searchsorted(q, q, side='left')
+    rank = np.arange(len(q)) - first
+    keep = rank < k
+    yield from zip(q[keep].tolist(), j[keep].tolist(), s[keep].tolist())
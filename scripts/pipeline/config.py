@@ -1,7 +1,29 @@
-"""Shared config and DB connection for the pipeline."""
+"""Shared config and DB connection for the pipeline.
+
+get_connection() hands out a single raw connection, which is all the short
+scripts need. Long runs (run_pipeline, renormalize) use ConnectionManager
+instead:
+
+    db = ConnectionManager(maxconn=4)
+    db.add_hook(StatementTimer(slow_ms=2000))
+    with db.connection() as conn:          # health-checked, returned on exit
+        ...
+    db.run(lambda conn: write_batch(conn, rows))   # commit, retry on reconnect
+
+Connections come from a psycopg2 ThreadedConnectionPool, so each writer
+thread can hold its own. A connection that has sat idle longer than
+health_check_interval is probed with SELECT 1 before being handed out, and
+dropped for a fresh one if Neon has closed it. db.run() retries the whole
+unit of work on a fresh connection when the connection dies under it —
+callers pass idempotent=False for work that must not be replayed.
+"""
 
 import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
 
 
 def load_env():
@@ -18,28 +40,234 @@ def load_env():
                 os.environ.setdefault(key.strip(), val)
 
 
-def get_db_url() -> str:
+def get_db_url(unpooled: bool = False) -> str:
+    """Connection string from the environment / .env.local.
+
+    unpooled=True prefers the direct (non-PgBouncer) URL, which DDL needs.
+    """
     load_env()
-    url = (
-        os.environ.get('POSTGRES_URL') or
-        os.environ.get('POSTGRES_URL_NON_POOLING') or
-        os.environ.get('DATABASE_URL')
-    )
+    if unpooled:
+        names = ('POSTGRES_URL_NON_POOLING', 'DATABASE_URL_UNPOOLED',
+                 'POSTGRES_URL', 'DATABASE_URL')
+    else:
+        names = ('POSTGRES_URL', 'POSTGRES_URL_NON_POOLING', 'DATABASE_URL')
+    url = next((os.environ[n] for n in names if os.environ.get(n)), None)
     if not url:
         print('Error: set POSTGRES_URL in .env.local or environment')
         sys.exit(1)
     return url
 
 
+# Keepalives help with Neon's idle disconnect behavior during long runs.
+_CONNECT_KWARGS = dict(
+    sslmode='require',
+    keepalives=1,
+    keepalives_idle=30,
+    keepalives_interval=10,
+    keepalives_count=5,
+    connect_timeout=30,
+)
+
+
 def get_connection():
     import psycopg2
-    # Keepalives help with Neon's idle disconnect behavior during long runs.
-    return psycopg2.connect(
-        get_db_url(),
-        sslmode='require',
-        keepalives=1,
-        keepalives_idle=30,
-        keepalives_interval=10,
-        keepalives_count=5,
-        connect_timeout=30,
-    )
+    return psycopg2.connect(get_db_url(), **_CONNECT_KWARGS)
+
+
+# ─── Statement timing ────────────────────────────────────────────────────────
+
+# hook(sql, seconds, rowcount) — called after every statement on a managed
+# connection, including the ones execute_values and copy_expert issue.
+StatementHook = Callable[[str, float, int], None]
+
+
+class StatementTimer:
+    """Statement hook that totals time per statement kind (INSERT, UPDATE, ...)
+    and optionally prints statements slower than slow_ms."""
+
+    def __init__(self, slow_ms: Optional[float] = None):
+        self.slow_ms = slow_ms
+        self.count: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, sql: str, seconds: float, rowcount: int) -> None:
+        kind = (sql.split(None, 1) or ['?'])[0].upper()
+        with self._lock:
+            self.count[kind] = self.count.get(kind, 0) + 1
+            self.seconds[kind] = self.seconds.get(kind, 0.0) + seconds
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            print(f'  ! Slow SQL ({seconds:.1f}s, {rowcount} rows): '
+                  f'{" ".join(sql.split())[:100]}')
+
+    def summary(self) -> str:
+        if not self.count:
+            return 'no statements'
+        total = sum(self.seconds.values())
+        parts = [f'{kind} {self.count[kind]}x {self.seconds[kind]:.1f}s'
+                 for kind in sorted(self.seconds, key=self.seconds.get, reverse=True)]
+        return f'{total:.1f}s in {sum(self.count.values())} statements ({", ".join(parts)})'
+
+
+def _timed_cursor_class(hooks: List[StatementHook]):
+    """A psycopg2 cursor subclass that reports every statement to `hooks`."""
+    import psycopg2.extensions
+
+    def emit(cur, sql, start):
+        if not hooks:
+            return
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', errors='replace')
+        elapsed = time.monotonic() - start
+        for hook in hooks:
+            hook(str(sql), elapsed, cur.rowcount)
+
+    class TimedCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            start = time.monotonic()
+            try:
+                return super().execute(query, vars)
+            finally:
+                emit(self, query, start)
+
+        def executemany(self, query, vars_list):
+            start = time.monotonic()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                emit(self, query, start)
+
+        def copy_expert(self, sql, file, size=8192):
+            start = time.monotonic()
+            try:
+                return super().copy_expert(sql, file, size)
+            finally:
+                emit(self, sql, start)
+
+    return TimedCursor
+
+
+# ─── Connection manager ──────────────────────────────────────────────────────
+
+class ConnectionManager:
+    """Pooled, health-checked connections with reconnect-and-retry."""
+
+    def __init__(
+        self,
+        minconn: int = 1,
+        maxconn: int = 4,
+        health_check_interval: float = 30.0,
+        retries: int = 2,
+        url: Optional[str] = None,
+    ):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.retries = retries
+        self.url = url
+        self.hooks: List[StatementHook] = []
+        self.reconnects = 0
+        self._pool = None
+        self._last_used: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: StatementHook) -> StatementHook:
+        self.hooks.append(hook)
+        return hook
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                self._pool = ThreadedConnectionPool(
+                    self.minconn, self.maxconn, self.url or get_db_url(),
+                    cursor_factory=_timed_cursor_class(self.hooks),
+                    **_CONNECT_KWARGS,
+                )
+            return self._pool
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        pool = self._get_pool()
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            if self._healthy(conn):
+                return conn
+            self._discard(conn)
+        raise RuntimeError('could not get a healthy database connection')
+
+    def _discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        self.reconnects += 1
+        try:
+            self._get_pool().putconn(conn, close=True)
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Check out a healthy connection; it goes back to the pool on exit.
+
+        Anything left uncommitted when the block exits is rolled back.
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            if conn.closed:
+                self._discard(conn)
+            else:
+                try:
+                    conn.rollback()
+                except Exception:
+                    self._discard(conn)
+                else:
+                    self._last_used[id(conn)] = time.monotonic()
+                    self._get_pool().putconn(conn)
+
+    def run(self, fn, idempotent: bool = True):
+        """Call fn(conn) and commit, returning fn's result.
+
+        If the connection dies under it (the error leaves conn.closed set),
+        the unit is retried on a fresh connection up to `retries` times when
+        idempotent. Other errors are rolled back and re-raised as-is.
+        """
+        for attempt in range(self.retries + 1):
+            with self.connection() as conn:
+                try:
+                    result = fn(conn)
+                    conn.commit()
+                    return result
+                except Exception as e:
+                    if not conn.closed or not idempotent or attempt == self.retries:
+                        raise
+                    print(f'  ! Connection lost ({str(e).strip()[:80]}), retrying...')
+
+    def execute(self, sql: str, params=None, fetch: bool = False, idempotent: bool = True):
+        """Run one statement in its own transaction. Returns fetched rows if
+        fetch, else the rowcount."""
+        def work(conn):
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall() if fetch else cur.rowcount
+        return self.run(work, idempotent=idempotent)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._last_used.clear()
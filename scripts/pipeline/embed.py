@@ -9,12 +9,56 @@ the equation.
 Why this works: equations with similar structure have similar LaTeX tokens.
 \\frac{dN}{dt} = rN(1 - N/K) and \\frac{dP}{dt} = sP(1 - P/C) will embed
 close together because the token sequences are nearly identical.
+
+The model is loaded once per process (get_model) and shared by every caller,
+so embedding a paper costs inference only, not a model load. Long runs can
+start an EmbeddingWorker: it loads the model on a background thread — while
+the first sources are still downloading — and folds requests queued from any
+thread into one encode call.
+
+Strings that normalize to the same token sequence are embedded once per
+call, and with an EmbeddingCache (pipeline/embedcache.py) once across the
+corpus and across runs.
+
+Inference runs on CPU. Set ANALOG_QUEST_EMBED_BACKEND to pick how:
+  torch       sentence-transformers' PyTorch model, fp32 (default)
+  onnx        the same weights exported to ONNX, run by ONNX Runtime
+  onnx-int8   the model repo's dynamically quantized int8 ONNX graph
+The ONNX backends need sentence-transformers[onnx] (>= 3.2). Their vectors
+are close to fp32's but not identical, so model_id() — the cache key's model
+part — names the backend. Run bench_embed.py against a corpus sample before
+switching a deployment.
+
+Usage:
+    vectors = embed_equations(latex_list)        # loads the model on first call
+
+    with EmbeddingWorker() as worker:
+        vectors = worker.embed(latex_list)       # or worker.submit(...) -> Future
 """
 
 from __future__ import annotations
 
+import os
+import queue
 import re
-from typing import List, Optional
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+DEFAULT_BATCH_SIZE = 64
+
+DEFAULT_EMBED_BACKEND = 'torch'
+EMBED_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+EMBED_BACKEND = os.environ.get('ANALOG_QUEST_EMBED_BACKEND', DEFAULT_EMBED_BACKEND).strip().lower()
+
+# Dynamically quantized graph published alongside the model. The AVX2
+# variant runs on any x86-64 server CPU from the last decade.
+ONNX_INT8_FILE = 'onnx/model_quint8_avx2.onnx'
+
+_models: Dict[str, object] = {}
+_model_lock = threading.Lock()
 
 
 def _normalize_latex_for_embedding(latex: str) -> str:
@@ -50,27 +94,208 @@ def _normalize_latex_for_embedding(latex: str) -> str:
     return s
 
 
-def embed_equations(latex_list: List[str], batch_size: int = 64) -> List[List[float]]:
+# ─── Backends ────────────────────────────────────────────────────────────────
+
+def _check_backend(backend: Optional[str]) -> str:
+    backend = backend or EMBED_BACKEND
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f'unknown embedding backend {backend!r} '
+                         f'(expected one of {", ".join(EMBED_BACKENDS)})')
+    return backend
+
+
+def model_id(backend: Optional[str] = None) -> str:
+    """Name of the vectors a backend produces: MODEL_NAME for torch, else
+    MODEL_NAME+backend. Caches key on this."""
+    backend = _check_backend(backend)
+    return MODEL_NAME if backend == DEFAULT_EMBED_BACKEND else f'{MODEL_NAME}+{backend}'
+
+
+def embedder_available(backend: Optional[str] = None) -> bool:
+    """True if the backend's libraries can be imported. Doesn't load the model."""
+    backend = _check_backend(backend)
+    try:
+        import sentence_transformers  # noqa: F401
+        if backend != 'torch':
+            import onnxruntime  # noqa: F401
+            import optimum.onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _load_model(backend: str):
+    from sentence_transformers import SentenceTransformer
+    if backend == 'torch':
+        return SentenceTransformer(MODEL_NAME)
+    model_kwargs = {'file_name': ONNX_INT8_FILE} if backend == 'onnx-int8' else {}
+    return SentenceTransformer(MODEL_NAME, device='cpu', backend='onnx',
+                               model_kwargs=model_kwargs)
+
+
+def get_model(backend: Optional[str] = None):
+    """The process-wide SentenceTransformer for a backend, loaded on first use.
+
+    Thread-safe: concurrent first callers wait for one load. Raises
+    ImportError if the backend's libraries aren't installed.
+    """
+    backend = _check_backend(backend)
+    model = _models.get(backend)
+    if model is None:
+        with _model_lock:
+            model = _models.get(backend)
+            if model is None:
+                model = _models[backend] = _load_model(backend)
+    return model
+
+
+# ─── Embedding ───────────────────────────────────────────────────────────────
+
+def embed_equations(latex_list: List[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                    cache=None, progress: bool = False,
+                    backend: Optional[str] = None) -> List[List[float]]:
     """Generate 384-dim embeddings for a list of LaTeX strings.
 
+    Each distinct normalized string is encoded once; with `cache` (an
+    EmbeddingCache keyed by model_id(backend)) strings it already holds
+    aren't encoded at all, and the model isn't even loaded if every string
+    hits.
+
     Returns a list of embedding vectors (list of floats).
     Requires: pip install sentence-transformers
     """
-    from sentence_transformers import SentenceTransformer
-
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    if not latex_list:
+        return []
 
     # Normalize before embedding
     normalized = [_normalize_latex_for_embedding(eq) for eq in latex_list]
 
-    embeddings = model.encode(normalized, batch_size=batch_size, show_progress_bar=False)
+    found = cache.get_many(normalized) if cache is not None else {}
+    missing = [text for text in dict.fromkeys(normalized) if text not in found]
+    if missing:
+        embeddings = get_model(backend).encode(missing, batch_size=batch_size,
+                                        show_progress_bar=progress)
+        fresh = {text: emb.tolist() for text, emb in zip(missing, embeddings)}
+        if cache is not None:
+            cache.put_many(fresh)
+        found.update(fresh)
 
-    return [emb.tolist() for emb in embeddings]
+    return [found[text] for text in normalized]
 
 
-def embed_equations_batch(latex_list: List[str], batch_size: int = 64) -> Optional[List[List[float]]]:
+def embed_equations_batch(latex_list: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> Optional[List[List[float]]]:
     """Wrapper that returns None if sentence-transformers isn't installed."""
     try:
         return embed_equations(latex_list, batch_size)
     except ImportError:
         return None
+
+
+# ─── Worker ──────────────────────────────────────────────────────────────────
+
+class EmbeddingWorker:
+    """A background thread that owns the warm model and serves embed requests.
+
+    Requests that queue up while a batch is encoding are merged — up to
+    `max_strings` strings — into the next encode call, so several small
+    per-paper requests fill one model batch. Each caller gets back exactly
+    its own vectors, in order. An EmbeddingCache passed as `cache` is only
+    touched from the worker thread.
+
+    A thread rather than a process: the model's forward pass releases the GIL,
+    and vectors don't have to be pickled back across a pipe.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, max_strings: int = 1024,
+                 cache=None, backend: Optional[str] = None):
+        self.batch_size = batch_size
+        self.cache = cache
+        self.backend = _check_backend(backend)
+        self.max_strings = max(1, max_strings)
+        self.requests = 0
+        self.calls = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'EmbeddingWorker':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve, name='embedder', daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, latex_list: List[str]) -> Future:
+        """Queue a request; the Future resolves to one vector per string."""
+        future: Future = Future()
+        if not latex_list:
+            future.set_result([])
+            return future
+        self.start()
+        self._queue.put((list(latex_list), future))
+        return future
+
+    def embed(self, latex_list: List[str]) -> List[List[float]]:
+        return self.submit(latex_list).result()
+
+    def _serve(self) -> None:
+        try:
+            get_model(self.backend)
+        except BaseException as e:
+            # Fail every request rather than leaving callers blocked.
+            self._drain(e)
+            return
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            size = len(item[0])
+            stop = False
+            while size < self.max_strings:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+                size += len(nxt[0])
+            self._encode(batch)
+            if stop:
+                return
+
+    def _encode(self, batch) -> None:
+        texts = [latex for latex_list, _ in batch for latex in latex_list]
+        try:
+            vectors = embed_equations(texts, self.batch_size, cache=self.cache,
+                                      backend=self.backend)
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.requests += len(batch)
+        self.calls += 1
+        start = 0
+        for latex_list, future in batch:
+            future.set_result(vectors[start:start + len(latex_list)])
+            start += len(latex_list)
+
+    def _drain(self, error: BaseException) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            item[1].set_exception(error)
+
+    def close(self) -> None:
+        """Finish queued requests and stop the thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'EmbeddingWorker':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
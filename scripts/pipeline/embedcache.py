@@ -0,0 +1,211 @@
+"""
+embedcache.py — Reuse equation embeddings across equations and runs.
+
+_normalize_latex_for_embedding maps many distinct LaTeX strings to the same
+token sequence (spacing, \\left/\\right, \\varepsilon vs \\epsilon, label
+subscripts), and the model is deterministic, so an embedding only depends on
+
+    sha256(model name + normalized string)
+
+Three tiers, looked up in order:
+  1. An in-process LRU (always on) for repeats within one run.
+  2. An optional SQLite file shared across runs on this machine.
+  3. An optional embedding_cache table in Postgres (see
+     database/equations_schema.sql), shared by every machine that writes
+     to the DB.
+The model name is part of the key, so switching models never serves stale
+vectors and needs no invalidation.
+
+Duplicates within one request are embedded once too; they're counted
+separately from cache hits.
+
+The cache is used from one thread at a time (the EmbeddingWorker's, or the
+caller's), so SQLite sees a single writer.
+
+Environment:
+    ANALOG_QUEST_EMBED_CACHE      path of the SQLite tier (unset = memory only)
+    ANALOG_QUEST_EMBED_CACHE_DB   1/true/yes = also use the embedding_cache table
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+
+DEFAULT_MAX_ENTRIES = 100_000
+
+Vector = List[float]
+
+
+def cache_key(model: str, text: str) -> str:
+    data = f'{model}\x00{text}'.encode('utf-8', errors='surrogatepass')
+    return hashlib.sha256(data).hexdigest()
+
+
+def _pack(vector: Vector) -> bytes:
+    return array('f', vector).tobytes()
+
+
+def _unpack(blob: bytes) -> Vector:
+    floats = array('f')
+    floats.frombytes(blob)
+    return floats.tolist()
+
+
+def _parse_vector(text: str) -> Vector:
+    """pgvector's text form, '[0.1,0.2,...]'."""
+    return [float(x) for x in text.strip('[]').split(',')]
+
+
+class EmbeddingCache:
+    """Three-tier (LRU + optional SQLite + optional Postgres) embedding cache.
+
+    Keys are normalized embedding inputs (see embed.py), not raw LaTeX.
+    `db` is a ConnectionManager; when given, the embedding_cache table is
+    used as the last tier.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        path: Optional[str] = None,
+        db=None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.model = model
+        self.max_entries = max_entries
+        self.db = db
+        self._lru: 'OrderedDict[str, Vector]' = OrderedDict()
+        self._sqlite: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Created here, used on the embedder thread — one thread at a time.
+            self._sqlite = sqlite3.connect(path, check_same_thread=False)
+            self._sqlite.execute('PRAGMA journal_mode=WAL')
+            self._sqlite.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key         TEXT PRIMARY KEY,
+                    embedding   BLOB NOT NULL
+                )
+            """)
+            self._sqlite.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    def _remember(self, key: str, vector: Vector) -> None:
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, Vector]:
+        """Look up many normalized strings at once. Returns {text: vector} for the hits."""
+        found: Dict[str, Vector] = {}
+        pending: Dict[str, str] = {}   # key -> text, for the slower tiers
+        seen = set()
+        for text in texts:
+            if text in seen:
+                self.duplicates += 1
+                continue
+            seen.add(text)
+            key = cache_key(self.model, text)
+            hit = self._lru.get(key)
+            if hit is not None:
+                self._lru.move_to_end(key)
+                found[text] = hit
+                self.memory_hits += 1
+            else:
+                pending[key] = text
+
+        if pending and self._sqlite is not None:
+            keys = list(pending)
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._sqlite.execute(
+                    f'SELECT key, embedding FROM embeddings WHERE key IN ({",".join("?" * len(chunk))})',
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = _unpack(blob)
+                    self._remember(key, vector)
+                    found[pending.pop(key)] = vector
+                    self.disk_hits += 1
+
+        if pending and self.db is not None:
+            rows = self.db.execute(
+                'SELECT key, embedding::text FROM embedding_cache WHERE key = ANY(%s)',
+                (list(pending),), fetch=True,
+            )
+            disk_rows = []
+            for key, text in rows:
+                vector = _parse_vector(text)
+                self._remember(key, vector)
+                disk_rows.append((key, _pack(vector)))
+                found[pending.pop(key)] = vector
+                self.db_hits += 1
+            self._put_sqlite(disk_rows)
+
+        self.misses += len(pending)
+        return found
+
+    def put_many(self, items: Dict[str, Vector]) -> None:
+        """Store {normalized text: vector} in every tier."""
+        if not items:
+            return
+        keyed = [(cache_key(self.model, text), vector) for text, vector in items.items()]
+        for key, vector in keyed:
+            self._remember(key, vector)
+        self._put_sqlite([(key, _pack(vector)) for key, vector in keyed])
+        if self.db is not None:
+            rows = [(key, self.model, '[' + ','.join(repr(float(x)) for x in vector) + ']')
+                    for key, vector in keyed]
+            self.db.run(lambda conn: _insert_db_rows(conn, rows))
+
+    def _put_sqlite(self, rows) -> None:
+        if rows and self._sqlite is not None:
+            self._sqlite.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)', rows)
+            self._sqlite.commit()
+
+    def summary(self) -> str:
+        hits = self.memory_hits + self.disk_hits + self.db_hits
+        lookups = hits + self.misses
+        rate = f'{100 * hits / lookups:.1f}%' if lookups else 'n/a'
+        return (f'{rate} hit rate ({self.memory_hits} memory, {self.disk_hits} disk, '
+                f'{self.db_hits} db, {self.misses} misses; '
+                f'{self.duplicates} in-batch duplicates)')
+
+    def close(self) -> None:
+        if self._sqlite is not None:
+            self._sqlite.close()
+            self._sqlite = None
+
+
+def _insert_db_rows(conn, rows) -> None:
+    from psycopg2.extras import execute_values
+    with conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO embedding_cache (key, model, embedding)
+            VALUES %s
+            ON CONFLICT (key) DO NOTHING
+        """, rows, template='(%s, %s, %s::vector)', page_size=500)
+
+
+def get_embedding_cache(model: str, path: Optional[str] = None, db=None) -> EmbeddingCache:
+    """A cache with the SQLite tier at `path`, else ANALOG_QUEST_EMBED_CACHE,
+    else memory only. The Postgres tier is used only if `db` is given and
+    ANALOG_QUEST_EMBED_CACHE_DB is set."""
+    use_db = os.environ.get('ANALOG_QUEST_EMBED_CACHE_DB', '').lower() in ('1', 'true', 'yes')
+    return EmbeddingCache(
+        model,
+        path or os.environ.get('ANALOG_QUEST_EMBED_CACHE') or None,
+        db=db if use_db else None,
+    )
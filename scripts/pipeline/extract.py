@@ -11,14 +11,18 @@ from __future__ import annotations
 import gzip
 import io
 import os
+import queue
 import re
 import tarfile
+import tempfile
+import threading
 import time
 import urllib.request
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .macros import collect_macros, expand_macros, MacroDef
+from .macros import collect_macros, compile_macros, ExpansionStats, MacroDef, MacroExpander
+from .sources import OFFLINE as SOURCES_OFFLINE, get_source_store
 
 
 # Feature flag for macro expansion.
@@ -43,6 +47,15 @@ EXPAND_MACROS = os.environ.get('ANALOG_QUEST_EXPAND_MACROS', '').lower() in ('1'
 ARXIV_SOURCE_URL = 'https://export.arxiv.org/e-print/{arxiv_id}'
 ARXIV_DELAY = 3  # seconds between requests (arXiv policy)
 
+# Source tarballs are streamed, never held whole in memory: downloads spool to
+# a temp file (in RAM up to SOURCE_SPOOL_BYTES) and tar members are read one
+# at a time. Figure-heavy submissions run to hundreds of MB, almost none of it
+# .tex, so the caps below only bound what we actually decode.
+SOURCE_SPOOL_BYTES = 8 * 1024 * 1024
+MAX_SOURCE_BYTES = 1024 * 1024 * 1024      # give up on downloads larger than this
+MAX_TEX_MEMBER_BYTES = 16 * 1024 * 1024    # skip any single .tex larger than this
+MAX_PAPER_TEX_BYTES = 64 * 1024 * 1024     # stop collecting .tex beyond this per paper
+
 # Equation environments we extract (display math)
 DISPLAY_ENVS = [
     'equation', 'equation*',
@@ -79,6 +92,18 @@ BRACKET_DISPLAY_RE = re.compile(
     re.DOTALL
 )
 
+# The four patterns above describe what counts as math. extract_equations_from_tex
+# no longer runs them; it uses scan_math_spans, which finds every delimiter in
+# one regex sweep and pairs them up itself with exactly the same results
+# (tests/test_extract.py checks this, scripts/bench_extract.py measures it on
+# the cached corpus). The lazy `.+?` patterns rescan to the end of the text
+# from every unclosed opener — quadratic on a paper full of stray $ signs —
+# while the scanner is linear.
+_MATH_TOKEN_RE = re.compile(rf'\$|\\\[|\\\]|\\(begin|end)\{{({_env_names})\}}')
+
+# Inline math is only kept if it has an operator suggesting a relationship.
+_INLINE_RELATION_RE = re.compile(r'[=~]|\\sim|\\approx|\\propto|\\frac\{d|\\partial|\\nabla')
+
 
 @dataclass
 class ExtractedEquation:
@@ -87,6 +112,16 @@ class ExtractedEquation:
     position: int         # ordinal in the paper
 
 
+@dataclass
+class MathSpan:
+    kind: str             # 'env', 'display_dollar', 'bracket_display' or 'inline'
+    env: str              # environment name for 'env', else same as kind
+    start: int            # character offsets into the scanned text:
+    end: int              #   tex[start:end] is the whole match including delimiters,
+    content_start: int    #   tex[content_start:content_end] the math inside them
+    content_end: int
+
+
 @dataclass
 class ExtractionResult:
     arxiv_id: str
@@ -133,69 +168,262 @@ def _split_align_rows(latex: str, env: str) -> list[str]:
     return results
 
 
-def fetch_latex_source(arxiv_id: str) -> Optional[List[str]]:
-    """Fetch LaTeX source files for an arXiv paper. Returns list of .tex contents, or None."""
+# Rate limiting lives here rather than in the callers so that every request to
+# arXiv — from any thread — is spaced at least ARXIV_DELAY seconds apart,
+# measured start-to-start. Callers no longer need to sleep between papers, and
+# work done between two fetches (extraction, SymPy) overlaps the wait instead
+# of adding to it.
+_fetch_lock = threading.Lock()
+_last_fetch_at = 0.0
+
+
+def _throttle() -> None:
+    """Block until ARXIV_DELAY seconds have passed since the previous request started."""
+    global _last_fetch_at
+    with _fetch_lock:
+        wait = _last_fetch_at + ARXIV_DELAY - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _last_fetch_at = time.monotonic()
+
+
+def _download_source(arxiv_id: str) -> Optional[BinaryIO]:
+    """Download the raw e-print for one paper (rate-limited) into a spooled
+    temp file, positioned at the start. None on failure or if it exceeds
+    MAX_SOURCE_BYTES."""
     url = ARXIV_SOURCE_URL.format(arxiv_id=arxiv_id)
     req = urllib.request.Request(url, headers={
         'User-Agent': 'analog-quest/1.0 (equation extraction pipeline)'
     })
 
+    _throttle()
+    spool = tempfile.SpooledTemporaryFile(max_size=SOURCE_SPOOL_BYTES)
     try:
         with urllib.request.urlopen(req, timeout=30) as resp:
-            data = resp.read()
+            size = 0
+            for chunk in iter(lambda: resp.read(1 << 16), b''):
+                size += len(chunk)
+                if size > MAX_SOURCE_BYTES:
+                    spool.close()
+                    return None
+                spool.write(chunk)
     except Exception:
+        spool.close()
         return None
+    spool.seek(0)
+    return spool
 
-    # arXiv returns either a gzipped tarball or a single gzipped .tex file
-    tex_contents = []
 
-    # Try as tarball first
+def fetch_latex_source(arxiv_id: str) -> Optional[List[str]]:
+    """Fetch LaTeX source files for an arXiv paper. Returns list of .tex contents, or None.
+
+    Consults the local source store first (see pipeline/sources.py); a hit
+    costs no network and no rate-limit wait. In offline mode a miss returns
+    None without downloading.
+    """
+    store = get_source_store()
+    f = store.open(arxiv_id) if store is not None else None
+    if f is None:
+        if SOURCES_OFFLINE:
+            return None
+        f = _download_source(arxiv_id)
+        if f is None:
+            return None
+        if store is not None:
+            try:
+                store.put_file(arxiv_id, f)
+            except OSError:
+                pass  # a full/read-only cache dir must not break extraction
+            f.seek(0)
+    with f:
+        return _decode_stream(f)
+
+
+def _decode_source(data: bytes) -> Optional[List[str]]:
+    """Turn raw e-print bytes into a list of .tex contents, or None."""
+    return _decode_stream(io.BytesIO(data))
+
+
+def _is_tar_header(block: bytes) -> bool:
+    """Does this 512-byte block look like a tar header (ustar/GNU or v7)?"""
+    if len(block) < 512:
+        return False
+    if block[257:262] == b'ustar':
+        return True
+    # v7 tar has no magic; fall back to the header checksum.
     try:
-        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
-            for member in tar.getmembers():
-                if member.name.endswith('.tex') and member.isfile():
-                    f = tar.extractfile(member)
-                    if f:
-                        content = f.read()
-                        # Try UTF-8, fall back to latin-1
-                        try:
-                            tex_contents.append(content.decode('utf-8'))
-                        except UnicodeDecodeError:
-                            tex_contents.append(content.decode('latin-1'))
-        if tex_contents:
-            return tex_contents
-    except (tarfile.TarError, gzip.BadGzipFile):
-        pass
-
-    # Try as single gzipped file
+        stored = int(block[148:156].rstrip(b' \x00').decode('ascii') or '-1', 8)
+    except ValueError:
+        return False
+    return stored == sum(block[:148]) + 8 * 32 + sum(block[156:])
+
+
+def _decode_text(content: bytes) -> str:
+    # Try UTF-8, fall back to latin-1
     try:
-        decompressed = gzip.decompress(data)
-        text = decompressed.decode('utf-8', errors='replace')
-        if '\\begin{document}' in text or '\\documentclass' in text:
-            return [text]
-    except (gzip.BadGzipFile, OSError):
-        pass
-
-    # Try as plain text (some very old papers)
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('latin-1')
+
+
+def _decode_stream(f: BinaryIO) -> Optional[List[str]]:
+    """Turn a seekable e-print file into a list of .tex contents, or None.
+
+    arXiv returns a gzipped tarball, a single gzipped .tex file, or (for some
+    very old papers) plain text. The format is sniffed once from the magic
+    bytes and the first decompressed block; a tarball is then read as a
+    stream, skipping non-.tex members without buffering them.
+    """
+    gzipped = f.read(2) == b'\x1f\x8b'
+    f.seek(0)
+
+    def payload() -> BinaryIO:
+        f.seek(0)
+        return gzip.GzipFile(fileobj=f, mode='rb') if gzipped else f
+
     try:
-        text = data.decode('utf-8', errors='replace')
-        if '\\begin{document}' in text or '\\documentclass' in text:
-            return [text]
-    except Exception:
-        pass
+        is_tar = _is_tar_header(payload().read(512))
+    except (gzip.BadGzipFile, OSError, EOFError):
+        return None
+
+    if is_tar:
+        return _read_tex_members(payload())
 
+    # Single file: gzipped .tex, or plain text
+    try:
+        content = payload().read(MAX_PAPER_TEX_BYTES + 1)
+    except (gzip.BadGzipFile, OSError, EOFError):
+        return None
+    if len(content) > MAX_PAPER_TEX_BYTES:
+        return None
+    text = content.decode('utf-8', errors='replace')
+    if '\\begin{document}' in text or '\\documentclass' in text:
+        return [text]
     return None
 
 
+def _read_tex_members(stream: BinaryIO) -> Optional[List[str]]:
+    """Collect .tex members from a tar stream, within the byte caps."""
+    tex_contents = []
+    total = 0
+    try:
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                if not (member.name.endswith('.tex') and member.isfile()):
+                    continue
+                if member.size > MAX_TEX_MEMBER_BYTES:
+                    continue
+                if total + member.size > MAX_PAPER_TEX_BYTES:
+                    break
+                f = tar.extractfile(member)
+                if f:
+                    tex_contents.append(_decode_text(f.read()))
+                    total += member.size
+    except (tarfile.TarError, gzip.BadGzipFile, OSError, EOFError):
+        pass  # truncated or corrupt: keep whatever was read before the damage
+    return tex_contents or None
+
+
+# `.` stops at newlines, so one sub over the whole file strips each line's
+# comment exactly as a per-line pass would.
+_COMMENT_RE = re.compile(r'(?<!\\)%.*')
+
+
 def _strip_comments(tex: str) -> str:
     """Remove LaTeX comments (lines starting with % or inline %)."""
-    lines = tex.split('\n')
-    result = []
-    for line in lines:
-        # Remove inline comments (but not \%)
-        cleaned = re.sub(r'(?<!\\)%.*$', '', line)
-        result.append(cleaned)
-    return '\n'.join(result)
+    # Remove inline comments (but not \%)
+    return _COMMENT_RE.sub('', tex)
+
+
+class _Cursor:
+    """Forward-only search over a sorted list of positions."""
+
+    def __init__(self, positions: List[int]):
+        self.positions = positions
+        self.i = 0
+
+    def seek(self, pos: int) -> Optional[int]:
+        """First position >= pos. Calls must use non-decreasing pos."""
+        positions, i = self.positions, self.i
+        while i < len(positions) and positions[i] < pos:
+            i += 1
+        self.i = i
+        return positions[i] if i < len(positions) else None
+
+
+def _pair_delimiters(kind: str, openers: List[int], closers: List[int],
+                     open_len: int, close_len: int) -> List[MathSpan]:
+    """Pair delimiters the way `OPEN(.+?)CLOSE` with finditer would: leftmost
+    opener, nearest closer leaving at least one character of content, resume
+    after the closer. If an opener has no closer, no later opener can either."""
+    spans = []
+    opens, closes = _Cursor(openers), _Cursor(closers)
+    pos = 0
+    while True:
+        start = opens.seek(pos)
+        if start is None:
+            break
+        close = closes.seek(start + open_len + 1)
+        if close is None:
+            break
+        spans.append(MathSpan(kind, kind, start, close + close_len, start + open_len, close))
+        pos = close + close_len
+    return spans
+
+
+def scan_math_spans(tex: str) -> List[MathSpan]:
+    """Find all math in `tex` with a single pass over it.
+
+    One regex sweep collects every delimiter ($, \\[, \\], \\begin{env},
+    \\end{env}); the spans are then paired from those position lists in
+    linear time. The result is identical to running DISPLAY_ENV_RE,
+    DISPLAY_DOLLAR_RE, BRACKET_DISPLAY_RE and INLINE_MATH_RE with finditer —
+    each kind independently, so spans of different kinds may overlap just as
+    the regex matches did — and is returned in that order: environments, then
+    $$, then \\[, then inline, each in document order.
+    """
+    dollars: List[int] = []
+    bracket_opens: List[int] = []
+    bracket_closes: List[int] = []
+    begins: List[Tuple[int, int, str]] = []    # (start, content_start, env)
+    ends: Dict[str, List[int]] = {}
+    for m in _MATH_TOKEN_RE.finditer(tex):
+        tok = m.group(0)
+        if tok == '$':
+            dollars.append(m.start())
+        elif tok == '\\[':
+            bracket_opens.append(m.start())
+        elif tok == '\\]':
+            bracket_closes.append(m.start())
+        elif m.group(1) == 'begin':
+            begins.append((m.start(), m.end(), m.group(2)))
+        else:
+            ends.setdefault(m.group(2), []).append(m.start())
+
+    # \begin{env} ... nearest \end{env} of the same name.
+    spans = []
+    end_cursors = {env: _Cursor(positions) for env, positions in ends.items()}
+    pos = 0
+    for start, content_start, env in begins:
+        if start < pos or env not in end_cursors:
+            continue
+        close = end_cursors[env].seek(content_start)
+        if close is None:
+            continue
+        end = close + len(env) + 6     # len('\\end{') + len('}')
+        spans.append(MathSpan('env', env, start, end, content_start, close))
+        pos = end
+
+    # $$ can start at any $ followed by another (so '$$$' holds two); inline $
+    # must have no $ on either side.
+    dollar_set = set(dollars)
+    double = [p for p in dollars if p + 1 in dollar_set]
+    single = [p for p in dollars if p - 1 not in dollar_set and p + 1 not in dollar_set]
+
+    spans += _pair_delimiters('display_dollar', double, double, 2, 2)
+    spans += _pair_delimiters('bracket_display', bracket_opens, bracket_closes, 2, 2)
+    spans += _pair_delimiters('inline', single, single, 1, 1)
+    return spans
 
 
 # PostScript / PDF binary blocks embedded in some .tex files.
@@ -262,9 +490,39 @@ def _looks_like_latex(tex: str) -> bool:
     return has_math_env
 
 
+def _clean_source(tex: str) -> str:
+    """Strip embedded PostScript/binary blocks, then comments. PostScript goes
+    first because its %% markers are themselves comments."""
+    return _strip_comments(_strip_embedded_postscript(tex))
+
+
+def collect_paper_macros(
+    tex_files: List[str],
+    cleaned: Optional[List[str]] = None,
+) -> Dict[str, MacroDef]:
+    """One macro table for a whole paper, from every file in it.
+
+    Papers often put \\newcommand in a separate preamble file like
+    `macros.tex` that's \\input'd from `main.tex` — and that file usually
+    has no math of its own, so every file is scanned, LaTeX-looking or not.
+    Definitions in comments are not real definitions, so comments are
+    stripped first. Last definition (in file order) wins.
+
+    `cleaned` is tex_files already through _clean_source, for callers that
+    have it (extract_from_source), so no file is cleaned twice.
+    """
+    if cleaned is None:
+        cleaned = [_clean_source(tex) for tex in tex_files]
+    macros: Dict[str, MacroDef] = {}
+    for clean in cleaned:
+        macros.update(collect_macros(clean))
+    return macros
+
+
 def extract_equations_from_tex(
     tex: str,
     extra_macros: Optional[Dict[str, MacroDef]] = None,
+    expansion_stats: Optional[ExpansionStats] = None,
 ) -> List[tuple]:
     """Extract (latex, env_name) pairs from a single .tex string.
 
@@ -273,32 +531,42 @@ def extract_equations_from_tex(
          \\let) from this file, merged with any `extra_macros` supplied by
          the caller (for multi-file papers that split preamble and body).
       2. After equation extraction, each equation is expanded against the
-         merged macro table so SymPy sees the fully-resolved LaTeX.
+         merged macro table so SymPy sees the fully-resolved LaTeX. Repeated
+         macro uses are memoized; pass `expansion_stats` to collect hit rates.
 
-    We still strip the raw definition text before the math-regex scan — the
-    definition bodies often contain $ signs that would otherwise match as
-    inline math and produce garbage equations.
+    extract_from_source doesn't come through here: it collects the paper's
+    macros once and hands the compiled table straight to _extract_cleaned.
     """
     # Reject files that don't look like LaTeX at all
     if not _looks_like_latex(tex):
         return []
 
-    # Strip embedded PostScript/binary blocks BEFORE stripping comments,
-    # because the %% markers are themselves comments.
-    tex = _strip_embedded_postscript(tex)
-    tex = _strip_comments(tex)
+    tex = _clean_source(tex)
 
     # Collect macros from the comment-stripped source (definitions in comments
     # are not real definitions). Merge with any caller-supplied extras; the
     # current file's definitions win on conflict since they're typically more
     # local to the equations we're about to extract.
     # Only populated when EXPAND_MACROS is on — collection is cheap but
-    # pointless if we're not going to use it.
-    macros: Dict[str, MacroDef] = {}
+    # pointless if we're not going to use it. The merged table is compiled
+    # once here and the expander reused for every equation in the file.
+    expander = None
     if EXPAND_MACROS:
-        macros = dict(extra_macros) if extra_macros else {}
+        macros: Dict[str, MacroDef] = dict(extra_macros) if extra_macros else {}
         macros.update(collect_macros(tex))
+        if macros:
+            expander = compile_macros(macros, stats=expansion_stats)
+
+    return _extract_cleaned(tex, expander)
 
+
+def _extract_cleaned(tex: str, expander: Optional[MacroExpander]) -> List[tuple]:
+    """Equations from a file that has already been through _clean_source.
+
+    We still strip the raw definition text before the math scan — the
+    definition bodies often contain $ signs that would otherwise match as
+    inline math and produce garbage equations.
+    """
     # Strip macro definitions so their braced bodies (which may contain $)
     # don't get matched as inline math.
     tex = _strip_macro_definitions(tex)
@@ -306,75 +574,137 @@ def extract_equations_from_tex(
 
     def _finalize(eq: str, env: str) -> None:
         """Optionally expand macros, then re-run trivial-rejection."""
-        if macros:
-            eq = expand_macros(eq, macros)
+        if expander is not None:
+            eq = expander.expand(eq)
             eq = _clean_latex(eq)
         if eq and not _is_trivial(eq):
             results.append((eq, env))
 
-    # Display environments
-    for match in DISPLAY_ENV_RE.finditer(tex):
-        env_name = match.group(1)
-        content = match.group(2)
-        for eq in _split_align_rows(content, env_name):
-            eq = _clean_latex(eq)
-            if eq and not _is_trivial(eq):
-                _finalize(eq, env_name)
+    for span in scan_math_spans(tex):
+        content = tex[span.content_start:span.content_end]
 
-    # $$...$$ display math
-    for match in DISPLAY_DOLLAR_RE.finditer(tex):
-        eq = _clean_latex(match.group(1))
-        if eq and not _is_trivial(eq):
-            _finalize(eq, 'display_dollar')
+        # Display environments
+        if span.kind == 'env':
+            for eq in _split_align_rows(content, span.env):
+                eq = _clean_latex(eq)
+                if eq and not _is_trivial(eq):
+                    _finalize(eq, span.env)
+            continue
 
-    # \[...\] display math
-    for match in BRACKET_DISPLAY_RE.finditer(tex):
-        eq = _clean_latex(match.group(1))
-        if eq and not _is_trivial(eq):
-            _finalize(eq, 'bracket_display')
-
-    # Inline math — only keep substantial ones (likely to be definitions/equations)
-    for match in INLINE_MATH_RE.finditer(tex):
-        eq = _clean_latex(match.group(1))
+        eq = _clean_latex(content)
+        if not eq or _is_trivial(eq):
+            continue
         # Inline math is very noisy — only keep equations with operators
         # that suggest a relationship (=, \sim, \approx, \propto, derivatives)
-        if eq and not _is_trivial(eq) and re.search(r'[=~]|\\sim|\\approx|\\propto|\\frac\{d|\\partial|\\nabla', eq):
-            _finalize(eq, 'inline')
+        if span.kind == 'inline' and not _INLINE_RELATION_RE.search(eq):
+            continue
+        # $$...$$, \[...\] display math and substantial inline math
+        _finalize(eq, span.kind)
 
     return results
 
 
+def iter_sources(
+    arxiv_ids: Iterable[str],
+    prefetch: int = 4,
+    transform: Optional[Callable[[str, Optional[List[str]]], Any]] = None,
+) -> Iterator[Tuple[str, Any]]:
+    """Yield (arxiv_id, tex_files) pairs, fetching ahead on a background thread.
+
+    The fetcher thread pulls sources at arXiv's allowed cadence (see _throttle)
+    into a bounded queue of `prefetch` papers while the caller does CPU work on
+    the previous ones, so a run costs max(fetch, compute) instead of the sum.
+    Order is preserved. Closing the generator early (break, exception) stops
+    the fetcher after its in-flight request.
+
+    With `transform`, the fetcher thread also runs transform(arxiv_id,
+    tex_files) and yields (arxiv_id, its result) instead. run_pipeline.py
+    passes extract_from_source, so extraction happens in the gap before the
+    next rate-limited fetch while the caller waits on the normalizer pool.
+    """
+    done = object()
+    buf: queue.Queue = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        # Bounded put that gives up once the consumer has gone away.
+        while not stop.is_set():
+            try:
+                buf.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    errors: List[BaseException] = []
+
+    def _fetcher() -> None:
+        try:
+            for arxiv_id in arxiv_ids:
+                if stop.is_set():
+                    return
+                tex_files = fetch_latex_source(arxiv_id)
+                item = transform(arxiv_id, tex_files) if transform else tex_files
+                if not _put((arxiv_id, item)):
+                    return
+        except BaseException as e:
+            # Surface on the consumer side instead of dying silently.
+            errors.append(e)
+        finally:
+            _put(done)
+
+    thread = threading.Thread(target=_fetcher, name='arxiv-fetcher', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buf.get()
+            if item is done:
+                if errors:
+                    raise errors[0]
+                return
+            yield item
+    finally:
+        stop.set()
+
+
 def extract_paper(arxiv_id: str) -> ExtractionResult:
-    """Full extraction for one paper: fetch source, extract all equations.
+    """Full extraction for one paper: fetch source, extract all equations."""
+    return extract_from_source(arxiv_id, fetch_latex_source(arxiv_id))
+
+
+def extract_from_source(
+    arxiv_id: str,
+    tex_files: Optional[List[str]],
+    expansion_stats: Optional[ExpansionStats] = None,
+) -> ExtractionResult:
+    """Extract all equations from already-fetched source (None = unavailable).
 
     Two-pass macro handling for multi-file papers: we first walk every .tex
-    file to collect all macro definitions (papers often put \\newcommand in a
-    separate preamble file like `macros.tex` that's \\input'd from `main.tex`),
-    then extract equations with that unified macro table available for
-    expansion.
+    file to collect all macro definitions (see collect_paper_macros), then
+    extract equations from each file with that one compiled table. Each file
+    is cleaned once and the table is collected and compiled once per paper.
     """
-    tex_files = fetch_latex_source(arxiv_id)
-
     if tex_files is None:
         return ExtractionResult(arxiv_id=arxiv_id, source_available=False,
                                 error='Could not fetch LaTeX source')
 
-    # Pass 1: collect macros from every file. Strip embedded PostScript and
-    # comments first, same as extract_equations_from_tex does, so we don't
-    # pick up commented-out or binary-block definitions. Only runs when
-    # expansion is enabled.
-    paper_macros: Dict[str, MacroDef] = {}
+    cleaned = [_clean_source(tex) for tex in tex_files]
+
+    # Pass 1: the paper-wide macro table. Only runs when expansion is enabled.
+    expander = None
     if EXPAND_MACROS:
-        for tex in tex_files:
-            clean = _strip_comments(_strip_embedded_postscript(tex))
-            paper_macros.update(collect_macros(clean))
+        paper_macros = collect_paper_macros(tex_files, cleaned)
+        if paper_macros:
+            expander = compile_macros(paper_macros, stats=expansion_stats)
 
-    # Pass 2: extract equations, supplying the paper-wide macro table.
+    # Pass 2: extract equations from the files that look like LaTeX.
     all_equations = []
     position = 0
 
-    for tex in tex_files:
-        for latex, env in extract_equations_from_tex(tex, extra_macros=paper_macros):
+    for tex, clean in zip(tex_files, cleaned):
+        if not _looks_like_latex(tex):
+            continue
+        for latex, env in _extract_cleaned(clean, expander):
             all_equations.append(ExtractedEquation(
                 latex=latex,
                 source_env=env,
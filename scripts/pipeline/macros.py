@@ -18,8 +18,9 @@ This module does two things:
 
 1. collect_macros(tex) scans a .tex string for definitions and returns a dict
    mapping macro name (without leading backslash) to a MacroDef.
-2. expand_macros(equation, macros) applies the definitions to an equation
-   string, iterating to a fixed point so nested macros resolve.
+2. compile_macros(macros) turns that dict into a MacroExpander — built once
+   per paper — and expand_macros(equation, expander) applies it to an
+   equation string, rescanning substituted text so nested macros resolve.
 
 What's supported:
   - \\newcommand / \\renewcommand / \\providecommand, with optional *:
@@ -42,12 +43,14 @@ LaTeX. Better to fail to parse than to silently mis-parse.
 from __future__ import annotations
 
 import re
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Dict, Optional
 
 
 MAX_EXPANSION_PASSES = 8  # recursion budget — 8 nested macro layers is plenty
 MAX_ARG_SCAN = 5000       # don't scan more than this many chars for one argument
+EXPANSION_CACHE_SIZE = 4096  # memoized macro uses kept per compiled table
 
 
 @dataclass
@@ -128,113 +131,125 @@ def _count_params(param_text: str) -> int:
     return max((int(n) for n in nums), default=0)
 
 
+# All four forms in one alternation, so collect_macros reads the file once
+# and sees definitions in document order. Every form starts with a backslash;
+# factoring it out gives the regex engine a literal prefix to skip ahead to,
+# and the keyword lookahead rejects \frac, \cite, ... before trying any form.
+_DEFINITION_FORMS = {
+    'newcmd': _NEWCMD_START_RE,
+    'def': _DEF_START_RE,
+    'declop': _DECLAREOP_START_RE,
+    'let': _LET_RE,
+}
+assert all(rx.pattern.startswith('\\\\') for rx in _DEFINITION_FORMS.values())
+_DEFINITION_RE = re.compile(
+    r'\\(?=newcommand|renewcommand|providecommand|def|DeclareMathOperator|let)(?:'
+    + '|'.join(f'(?P<{kind}>{rx.pattern[2:]})' for kind, rx in _DEFINITION_FORMS.items())
+    + ')'
+)
+
+
+def _captures(m: re.Match) -> tuple:
+    """The captures of whichever form matched, numbered as in its own regex."""
+    base = m.re.groupindex[m.lastgroup]
+    width = _DEFINITION_FORMS[m.lastgroup].groups
+    return m.group(*range(base + 1, base + 1 + width))
+
+
 def collect_macros(tex: str) -> Dict[str, MacroDef]:
     """Scan a .tex string and return a dict of macro name → MacroDef.
 
-    Later definitions override earlier ones (last-definition-wins), which is
-    consistent with how TeX actually behaves.
+    Definitions are read in a single pass in document order, and later
+    definitions override earlier ones (last-definition-wins), which is
+    consistent with how TeX actually behaves. The body of a \\newcommand or
+    \\def is skipped once matched, so definitions nested inside it (which
+    only take effect when the outer macro is used) are not collected.
 
     \\let aliases are resolved against macros defined earlier in the scan.
     A \\let to an unknown external macro (not defined in the same file) is
-    silently dropped; those mostly reference TeX/LaTeX primitives that SymPy
-    either already handles or will fail on regardless.
+    recorded as an alias for the bare command; those mostly reference
+    TeX/LaTeX primitives that SymPy either already handles or will fail on
+    regardless.
     """
     macros: Dict[str, MacroDef] = {}
-
-    # ─── \newcommand / \renewcommand / \providecommand ───
     pos = 0
     while True:
-        m = _NEWCMD_START_RE.search(tex, pos)
+        m = _DEFINITION_RE.search(tex, pos)
         if not m:
             break
-        name = m.group(1)
-        num_args = int(m.group(2)) if m.group(2) else 0
-        default_arg = m.group(3)  # may be None
-        body_start = m.end() - 1  # the '{' that started the body
-        body_end = _match_balanced(tex, body_start)
-        if body_end is None:
-            pos = m.end()
-            continue
-        body = tex[body_start + 1:body_end - 1]
-        macros[name] = MacroDef(
-            name=name,
-            num_args=num_args,
-            default_arg=default_arg,
-            body=body,
-        )
-        pos = body_end
-
-    # ─── \def ───
-    pos = 0
-    while True:
-        m = _DEF_START_RE.search(tex, pos)
-        if not m:
-            break
-        name = m.group(1)
-        param_text = m.group(2)
-        num_args = _count_params(param_text)
-        body_start = m.end() - 1
-        body_end = _match_balanced(tex, body_start)
-        if body_end is None:
-            pos = m.end()
-            continue
-        body = tex[body_start + 1:body_end - 1]
-        macros[name] = MacroDef(
-            name=name,
-            num_args=num_args,
-            default_arg=None,
-            body=body,
-        )
-        pos = body_end
-
-    # ─── \DeclareMathOperator ───
-    for m in _DECLAREOP_START_RE.finditer(tex):
-        name = m.group(1)
-        text = m.group(2)
-        macros[name] = MacroDef(
-            name=name,
-            num_args=0,
-            default_arg=None,
-            body=r'\mathrm{' + text + '}',
-        )
-
-    # ─── \let aliases ───
-    # Resolve against what we've collected. A \let to an unknown target is
-    # recorded with the target backslashed in the body so expansion preserves
-    # the original token (SymPy can then try to parse it directly).
-    for m in _LET_RE.finditer(tex):
-        alias = m.group(1)
-        target = m.group(2)
-        if target in macros:
-            src = macros[target]
-            macros[alias] = MacroDef(
-                name=alias,
-                num_args=src.num_args,
-                default_arg=src.default_arg,
-                body=src.body,
+        kind = m.lastgroup
+
+        if kind == 'newcmd' or kind == 'def':
+            # ─── \newcommand / \renewcommand / \providecommand / \def ───
+            if kind == 'newcmd':
+                name, n, default_arg = _captures(m)
+                num_args = int(n) if n else 0
+            else:
+                name, param_text = _captures(m)
+                num_args = _count_params(param_text)
+                default_arg = None
+            body_start = m.end() - 1  # the '{' that started the body
+            body_end = _match_balanced(tex, body_start)
+            if body_end is None:
+                pos = m.end()
+                continue
+            macros[name] = MacroDef(
+                name=name,
+                num_args=num_args,
+                default_arg=default_arg,
+                body=tex[body_start + 1:body_end - 1],
             )
-        else:
-            # Preserve the original token so the equation still references
-            # something SymPy might understand (e.g. \let\eps\epsilon).
-            macros[alias] = MacroDef(
-                name=alias,
+            pos = body_end
+
+        elif kind == 'declop':
+            # ─── \DeclareMathOperator ───
+            name, text = _captures(m)
+            macros[name] = MacroDef(
+                name=name,
                 num_args=0,
                 default_arg=None,
-                body='\\' + target,
+                body=r'\mathrm{' + text + '}',
             )
+            pos = m.end()
+
+        else:
+            # ─── \let aliases ───
+            # A \let to an unknown target is recorded with the target
+            # backslashed in the body so expansion preserves the original
+            # token (SymPy can then try to parse it directly, e.g.
+            # \let\eps\epsilon). If the target is defined later in the
+            # paper, expansion resolves it then.
+            alias, target = _captures(m)
+            if target in macros:
+                src = macros[target]
+                macros[alias] = MacroDef(
+                    name=alias,
+                    num_args=src.num_args,
+                    default_arg=src.default_arg,
+                    body=src.body,
+                )
+            else:
+                macros[alias] = MacroDef(
+                    name=alias,
+                    num_args=0,
+                    default_arg=None,
+                    body='\\' + target,
+                )
+            pos = m.end()
 
     return macros
 
 
 # ─── Expansion ─────────────────────────────────────────────────────────────
 #
-# Expansion walks through the equation string, finds each \name usage, collects
-# the right number of arguments (skipping whitespace and handling optional
-# [default] args), substitutes, and continues. We then iterate until no more
-# substitutions happen (fixed point) or MAX_EXPANSION_PASSES is hit.
-
-_MACRO_USE_RE = re.compile(r'\\([A-Za-z@]+)')
-
+# A paper's macro table is fixed, so it is compiled once (compile_macros) and
+# reused for every equation in the paper: one regex that only matches the
+# defined names, and each body pre-split into literal text and parameter
+# slots. Expansion is then a single left-to-right pass. A substituted body is
+# pushed back onto the input and rescanned at depth + 1, the way TeX does it,
+# so nested macros resolve without re-copying the whole equation once per
+# nesting level; MAX_EXPANSION_PASSES bounds the depth instead of the number
+# of passes.
 
 def _collect_arg(s: str, pos: int) -> Optional[tuple[str, int]]:
     """Starting at pos, collect one macro argument.
@@ -300,108 +315,219 @@ def _collect_optional_arg(s: str, pos: int) -> tuple[Optional[str], int]:
     return (None, pos)
 
 
-def _substitute_params(body: str, args: list[str]) -> str:
-    """Replace #1, #2, ... in body with args[0], args[1], ...
+def _parse_body(body: str, num_args: int) -> list:
+    """Split a macro body into literal strings and 0-based parameter indices.
 
-    Leaves ## as a literal # (TeX convention). Missing args (if body references
-    #3 but only 2 args were collected) are left as-is.
+    ## becomes a literal #. A #n beyond the macro's arity (or #0) stays as
+    literal text, same as TeX leaves it for the caller to trip over.
     """
-    result = []
+    parts: list = []
+    literal: list[str] = []
     i = 0
     while i < len(body):
         if body[i] == '#' and i + 1 < len(body):
             nxt = body[i + 1]
             if nxt == '#':
-                result.append('#')
+                literal.append('#')
                 i += 2
                 continue
-            if nxt.isdigit():
-                idx = int(nxt) - 1
-                if 0 <= idx < len(args):
-                    result.append(args[idx])
-                else:
-                    result.append(body[i:i + 2])
+            if nxt.isdigit() and 0 <= int(nxt) - 1 < num_args:
+                if literal:
+                    parts.append(''.join(literal))
+                    literal = []
+                parts.append(int(nxt) - 1)
                 i += 2
                 continue
-        result.append(body[i])
+        literal.append(body[i])
         i += 1
-    return ''.join(result)
+    if literal:
+        parts.append(''.join(literal))
+    return parts
+
 
+@dataclass
+class _CompiledMacro:
+    defn: MacroDef
+    parts: list                   # literal strings and parameter indices
+    text: Optional[str]           # the whole expansion, for no-arg macros
+    leaf: bool = False            # no-arg and text uses no other macro
 
-def _expand_once(s: str, macros: Dict[str, MacroDef]) -> tuple[str, bool]:
-    """One pass of macro expansion. Returns (expanded_string, made_substitution).
 
-    Scans left-to-right. When it finds \\name that matches a known macro,
-    collects its arguments and substitutes. If argument collection fails (not
-    enough braces, truncated input), the macro use is left as-is and scanning
-    continues past it.
+@dataclass
+class ExpansionStats:
+    """Memo hit/miss totals; one instance can be shared by many expanders."""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = f'{100 * self.hits / lookups:.1f}%' if lookups else 'n/a'
+        return (f'{rate} hit rate ({self.hits} hits, {self.misses} misses, '
+                f'{self.evictions} evictions)')
+
+
+class MacroExpander:
+    """A macro table compiled for repeated expansion. Build with compile_macros.
+
+    Macro uses are memoized: the same fragment (\\bra{\\psi}, \\E[X]) appears
+    dozens of times in a paper, so its expansion is kept in a bounded LRU
+    keyed by the raw text of the use and stays valid as long as the table
+    does — that is, for one paper.
     """
-    out = []
-    i = 0
-    changed = False
-    while i < len(s):
-        ch = s[i]
-        if ch != '\\':
-            out.append(ch)
-            i += 1
-            continue
-        m = _MACRO_USE_RE.match(s, i)
-        if not m:
-            # Backslash followed by non-letter (e.g. \{, \\, \$). Pass through.
-            out.append(s[i:i + 2])
-            i += 2
-            continue
-        name = m.group(1)
-        if name not in macros:
-            out.append(m.group(0))
-            i = m.end()
-            continue
-        defn = macros[name]
-        arg_pos = m.end()
-        args: list[str] = []
-        aborted = False
 
+    def __init__(
+        self,
+        macros: Dict[str, MacroDef],
+        cache_size: int = EXPANSION_CACHE_SIZE,
+        stats: Optional[ExpansionStats] = None,
+    ):
+        self.macros = dict(macros)
+        self.cache_size = cache_size
+        self.stats = stats if stats is not None else ExpansionStats()
+        self._cache: OrderedDict = OrderedDict()
+        self._compiled: Dict[str, _CompiledMacro] = {}
+        for name, defn in self.macros.items():
+            parts = _parse_body(defn.body, defn.num_args)
+            text = None
+            if defn.num_args == 0:
+                text = ''.join(parts)
+            self._compiled[name] = _CompiledMacro(defn, parts, text)
+        # Longest names first so the alternation can't stop at a prefix; the
+        # lookahead rejects \Rn when only \R is defined.
+        names = sorted(self.macros, key=len, reverse=True)
+        self._use_re = None
+        if names:
+            self._use_re = re.compile(
+                r'\\(' + '|'.join(re.escape(n) for n in names) + r')(?![A-Za-z@])'
+            )
+            # \R -> \mathbb{R} is cheaper to splice in than to look up.
+            for c in self._compiled.values():
+                c.leaf = c.text is not None and self._use_re.search(c.text) is None
+
+    def __len__(self) -> int:
+        return len(self.macros)
+
+    def _collect_args(self, s: str, pos: int, c: _CompiledMacro) -> Optional[tuple[list[str], int]]:
+        defn = c.defn
+        args: list[str] = []
         if defn.default_arg is not None:
-            # First argument is optional, bracket-delimited
-            opt_val, arg_pos = _collect_optional_arg(s, arg_pos)
+            opt_val, pos = _collect_optional_arg(s, pos)
             args.append(opt_val if opt_val is not None else defn.default_arg)
             mandatory = defn.num_args - 1
         else:
             mandatory = defn.num_args
-
         for _ in range(mandatory):
-            res = _collect_arg(s, arg_pos)
+            res = _collect_arg(s, pos)
             if res is None:
-                aborted = True
-                break
-            arg, arg_pos = res
+                return None
+            arg, pos = res
             args.append(arg)
-
-        if aborted:
-            # Leave the original token in place, advance past the name.
-            out.append(m.group(0))
-            i = m.end()
-            continue
-
-        out.append(_substitute_params(defn.body, args))
-        i = arg_pos
-        changed = True
-
-    return ''.join(out), changed
+        return args, pos
+
+    def _remember(self, key: tuple, value: str) -> None:
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self.stats.evictions += 1
+
+    def expand(self, equation: str) -> str:
+        """Expand every defined macro in `equation`. See expand_macros."""
+        use_re = self._use_re
+        if use_re is None or use_re.search(equation) is None:
+            return equation
+        cache = self._cache
+        out: list[str] = []
+        # Input stack of [text, pos, depth, memo key, len(out) at push]; the
+        # top frame is scanned first. A frame that runs to its end without
+        # borrowing from the one below has expanded to out[mark:], which is
+        # what gets memoized under its key.
+        frames = [[equation, 0, 0, None, 0]]
+        while frames:
+            frame = frames[-1]
+            s, pos, depth = frame[0], frame[1], frame[2]
+            m = use_re.search(s, pos) if depth < MAX_EXPANSION_PASSES else None
+            if m is None:
+                out.append(s[pos:])
+                frames.pop()
+                if frame[3] is not None:
+                    self._remember(frame[3], ''.join(out[frame[4]:]))
+                continue
+            start = m.start()
+            # \\R is a line break followed by the letter R, not a use of \R:
+            # an odd run of backslashes before the match means ours is escaped.
+            k = start
+            while k > pos and s[k - 1] == '\\':
+                k -= 1
+            if (start - k) % 2:
+                out.append(s[pos:start + 1])
+                frame[1] = start + 1
+                continue
+            c = self._compiled[m.group(1)]
+            out.append(s[pos:start])
+            if c.leaf:
+                out.append(c.text)
+                frame[1] = m.end()
+                continue
+            if c.text is not None:
+                collected = ([], m.end())
+            else:
+                collected = self._collect_args(s, m.end(), c)
+                if collected is None and len(frames) > 1:
+                    # The arguments may continue past the end of a substituted
+                    # body (\\newcommand{\\a}{\\b} used as \\a{x}); splice the
+                    # rest of the enclosing input on and try again. Neither
+                    # frame's output is self-contained any more.
+                    parent = frames[-2]
+                    frames[-2:] = [[s[start:] + parent[0][parent[1]:], 0, depth, None, 0]]
+                    continue
+            if collected is None:
+                # Leave the original token in place, advance past the name.
+                out.append(m.group(0))
+                frame[1] = m.end()
+                continue
+            args, end = collected
+            frame[1] = end
+            key = (s[start:end], depth)
+            hit = cache.get(key)
+            if hit is not None:
+                cache.move_to_end(key)
+                self.stats.hits += 1
+                out.append(hit)
+                continue
+            self.stats.misses += 1
+            if c.text is not None:
+                body = c.text
+            else:
+                body = ''.join(p if isinstance(p, str) else args[p] for p in c.parts)
+            frames.append([body, 0, depth + 1, key, len(out)])
+        return ''.join(out)
+
+
+def compile_macros(
+    macros: Dict[str, MacroDef],
+    stats: Optional[ExpansionStats] = None,
+) -> MacroExpander:
+    """Compile a macro table once so it can be applied to many equations.
+
+    Pass `stats` to accumulate memo hit rates across several tables.
+    """
+    return MacroExpander(macros, stats=stats)
 
 
-def expand_macros(equation: str, macros: Dict[str, MacroDef]) -> str:
-    """Expand all uses of `macros` in `equation` to a fixed point.
+def expand_macros(equation: str, macros) -> str:
+    """Expand all uses of `macros` in `equation`.
 
-    Iterates up to MAX_EXPANSION_PASSES. Returns the final expanded string.
-    If no macros are defined, returns the input unchanged.
+    `macros` is a MacroExpander, or a plain name → MacroDef dict (compiled on
+    the spot — callers expanding many equations should compile_macros once).
+    Substituted text is rescanned, so macros defined in terms of other macros
+    resolve, up to MAX_EXPANSION_PASSES levels deep. If no macros are defined,
+    returns the input unchanged.
     """
     if not macros:
         return equation
-    current = equation
-    for _ in range(MAX_EXPANSION_PASSES):
-        new, changed = _expand_once(current, macros)
-        if not changed:
-            return new
-        current = new
-    return current
+    if not isinstance(macros, MacroExpander):
+        macros = compile_macros(macros)
+    return macros.expand(equation)
@@ -1,13 +1,45 @@
 """
 match.py — Find cross-domain equation matches.
 
-Two matching strategies:
+Three matching strategies:
 1. Exact structural: equations with the same structure_hash in different domains
-2. Embedding similarity: nearest neighbors in vector space across domains
+2. Near structural: equations sharing a large subtree (equation_subtrees)
+3. Embedding similarity: nearest neighbors in vector space across domains
 
-Both produce candidates in the equation_matches table.
+All produce candidates in the equation_matches table.
+
+Exact and near-structural matching are incremental: match_watermarks records
+the highest equation id each matcher has already joined, and a run only
+looks at pairs involving equations above it. Since equation ids only grow and
+a pair is stored as (lower id, higher id), "pairs involving a new equation"
+is exactly "pairs whose higher id is above the watermark", so each run costs
+an index lookup per new equation instead of a self-join of the whole table.
+Rows whose hash changes in place (renormalize.py) are handled by that
+script's delta updates, and full=True re-joins everything. Writers that are
+still in flight are fenced off from the watermark by EQUATION_INSERT_LOCK.
+
+structure_buckets keeps per-hash statistics (equations, papers, domains),
+refreshed for each hash an exact-match run touches. Hashes over
+MAX_EXACT_BUCKET equations are hubs and get one representative pair per
+domain pair rather than every pair, so match volume grows with the number
+of distinct forms rather than quadratically in their popularity.
+
+Embedding matching runs as one SQL statement by default. With
+ANALOG_QUEST_EMBED_MATCHER=numpy|hnswlib|faiss it loads every embedding once
+and searches in memory instead (see pipeline/ann.py), which scales far
+better than the per-row LATERAL scans once the table is large.
 """
 
+import os
+from typing import Optional, Sequence
+
+
+# How find_embedding_matches searches: 'sql', or one of ann.ANN_METHODS.
+EMBEDDING_MATCHER = os.environ.get('ANALOG_QUEST_EMBED_MATCHER', 'sql').strip().lower()
+
+# Nearest cross-domain neighbours kept per unparsed equation.
+EMBEDDING_NEIGHBOURS = 5
+
 
 # Minimum structural complexity (chars in normalized srepr form) for a match
 # to be considered interesting. Filters out trivial things like "x = 0", "x = y".
@@ -19,52 +51,352 @@ GARBAGE_PATTERNS = ['pd_', 'setpacking', 'readonly', 'cvn', 'putinterval',
                     'setglobal', 'currentdict', 'definefont']
 
 
-def find_exact_matches(conn, min_complexity: int = MIN_COMPLEXITY) -> int:
+# Advisory lock fencing equation inserts off from watermark reads. Ids come
+# from a sequence when a row is inserted, not when it commits, so a writer
+# still in flight can hold an id below MAX(id). If the watermark moved past
+# it, its row would never be matched. So every transaction that inserts into
+# equations first takes this lock shared (guard_equation_inserts). The
+# matcher takes it exclusively just long enough to read MAX(id). That waits
+# out every in-flight insert, and any insert that starts later draws a
+# larger id. This relies on the id sequence's default CACHE 1 and on READ
+# COMMITTED, so the MAX(id) read after the wait sees those commits.
+EQUATION_INSERT_LOCK = 0x616e616c6f67    # arbitrary, unique to this table
+
+
+def guard_equation_inserts(cur) -> None:
+    """Call in any transaction that inserts into equations, before the insert."""
+    cur.execute('SELECT pg_advisory_xact_lock_shared(%s)', (EQUATION_INSERT_LOCK,))
+
+
+def _equation_range(cur, matcher: str, full: bool):
+    """(low, high): the ids this matcher run covers are low < id <= high.
+
+    high is fixed at the start, so rows inserted while the match runs wait
+    for the next run rather than being skipped by the watermark. It is read
+    behind EQUATION_INSERT_LOCK, so no uncommitted insert holds an id at or
+    below it.
+    """
+    cur.execute('SELECT pg_advisory_lock(%s)', (EQUATION_INSERT_LOCK,))
+    try:
+        cur.execute('SELECT COALESCE(MAX(id), 0) FROM equations')
+        high = cur.fetchone()[0]
+    finally:
+        cur.execute('SELECT pg_advisory_unlock(%s)', (EQUATION_INSERT_LOCK,))
+    if full:
+        return 0, high
+    cur.execute('SELECT last_equation_id FROM match_watermarks WHERE matcher = %s', (matcher,))
+    row = cur.fetchone()
+    return (row[0] if row else 0), high
+
+
+def _set_watermark(cur, matcher: str, last_id: int) -> None:
+    cur.execute("""
+        INSERT INTO match_watermarks (matcher, last_equation_id, updated_at)
+        VALUES (%s, %s, NOW())
+        ON CONFLICT (matcher) DO UPDATE
+            SET last_equation_id = EXCLUDED.last_equation_id, updated_at = NOW()
+    """, (matcher, last_id))
+
+
+# Hub suppression. A structure_hash shared by k equations would pair k²/2
+# ways, flooding equation_matches and the moderation queue with copies of the
+# same finding. Above MAX_EXACT_BUCKET equations a hash is a hub: it gets one
+# representative pair per domain pair instead — the earliest equation in
+# each domain — and structure_buckets carries the group's size and domains.
+MAX_EXACT_BUCKET = 20
+
+
+def _garbage_filter(*aliases):
+    """NOT LIKE clauses excluding GARBAGE_PATTERNS from each alias's latex, and their params."""
+    clauses = []
+    params = []
+    for pat in GARBAGE_PATTERNS:
+        clauses.append('AND ' + ' AND '.join(f'{a}.latex NOT LIKE %s' for a in aliases))
+        params += [f'%{pat}%'] * len(aliases)
+    return ' '.join(clauses), params
+
+
+def _refresh_buckets(cur, touched_sql: str, touched_params) -> None:
+    """Recompute structure_buckets rows for the hashes `touched_sql` selects."""
+    cur.execute(f"""
+        WITH touched AS ({touched_sql}),
+        stats AS (
+            SELECT e.structure_hash,
+                   COUNT(*) AS equations,
+                   COUNT(DISTINCT e.paper_id) AS papers,
+                   COALESCE(ARRAY_AGG(DISTINCT p.domain ORDER BY p.domain)
+                            FILTER (WHERE p.domain IS NOT NULL), '{{}}') AS domains
+            FROM equations e
+            JOIN papers p ON e.paper_id = p.id
+            WHERE e.structure_hash IN (SELECT structure_hash FROM touched)
+            GROUP BY e.structure_hash
+        ),
+        emptied AS (
+            DELETE FROM structure_buckets
+            WHERE structure_hash IN (SELECT structure_hash FROM touched)
+                AND structure_hash NOT IN (SELECT structure_hash FROM stats)
+        )
+        INSERT INTO structure_buckets (structure_hash, equations, papers, domains, updated_at)
+        SELECT structure_hash, equations, papers, domains, NOW() FROM stats
+        ON CONFLICT (structure_hash) DO UPDATE
+            SET equations = EXCLUDED.equations, papers = EXCLUDED.papers,
+                domains = EXCLUDED.domains, updated_at = NOW()
+    """, tuple(touched_params))
+
+
+def find_exact_matches(conn, min_complexity: int = MIN_COMPLEXITY,
+                       hashes: Optional[Sequence[str]] = None,
+                       full: bool = False,
+                       max_bucket: Optional[int] = MAX_EXACT_BUCKET,
+                       commit: bool = True) -> int:
     """Find equations with identical normalized forms across different domains.
 
     Applies a complexity floor: equations whose normalized form is shorter
     than `min_complexity` chars are considered too trivial to generate
     interesting matches (e.g. "x = 0", "a = b", "F = ma"-level simplicity).
 
+    If `hashes` is given, only those structure hashes are considered — used by
+    renormalize.py to update matches for the hashes whose membership changed
+    instead of re-joining the whole table. The watermark is neither used nor
+    moved.
+
+    Otherwise only pairs involving equations added since the last run are
+    joined (see the module docstring), and the watermark is advanced;
+    full=True joins the whole table, for rebuilds.
+
+    structure_buckets is refreshed for every hash considered. Hashes with
+    more than `max_bucket` equations get representative pairs only (see
+    MAX_EXACT_BUCKET); max_bucket=None pairs every bucket in full.
+
+    commit=False leaves the transaction open, so a caller can make this and
+    delete_stale_exact_matches for the same rows one unit.
+
     Returns count of new matches created.
     """
-    # Build a NOT LIKE clause for garbage patterns using parameterized query.
-    # Each pattern becomes two parameters (one for e1.latex, one for e2.latex).
+    if hashes is not None and not hashes:
+        return 0
+
+    with conn.cursor() as cur:
+        if hashes is not None:
+            touched_sql = 'SELECT UNNEST(%s::text[]) AS structure_hash'
+            touched_params = [list(hashes)]
+            range_sql = ''
+            range_params = []
+        else:
+            low, high = _equation_range(cur, 'exact_structural', full)
+            touched_sql = """
+                SELECT DISTINCT structure_hash FROM equations
+                WHERE id > %s AND id <= %s AND structure_hash IS NOT NULL"""
+            touched_params = [low, high]
+            range_sql = 'AND e2.id > %s AND e2.id <= %s'
+            range_params = [low, high]
+            if full:
+                cur.execute('DELETE FROM structure_buckets')
+
+        _refresh_buckets(cur, touched_sql, touched_params)
+
+        cap = max_bucket if max_bucket is not None else 2 ** 31 - 1
+        garbage_sql, garbage_params = _garbage_filter('e1', 'e2')
+
+        # NOT EXISTS against trivial_hashes: if a moderator has ever rejected a
+        # match on this canonical form as a "standard_canonical_object", the hash
+        # gets added to trivial_hashes, and we exclude it from future match
+        # generation. This is the moderator-learned trivia filter: the system
+        # gets smarter as humans teach it which forms are textbook objects.
+        cur.execute(f"""
+            WITH touched AS ({touched_sql})
+            INSERT INTO equation_matches
+                (equation_1_id, equation_2_id, match_type, similarity,
+                 paper_1_id, paper_2_id, domain_1, domain_2)
+            SELECT
+                e1.id, e2.id, 'exact_structural', 1.0,
+                e1.paper_id, e2.paper_id,
+                p1.domain, p2.domain
+            FROM structure_buckets b
+            JOIN equations e1 ON e1.structure_hash = b.structure_hash
+            JOIN equations e2 ON e1.structure_hash = e2.structure_hash
+                AND e1.id < e2.id
+                AND e1.paper_id != e2.paper_id
+            JOIN papers p1 ON e1.paper_id = p1.id
+            JOIN papers p2 ON e2.paper_id = p2.id
+            WHERE b.structure_hash IN (SELECT structure_hash FROM touched)
+                AND b.equations <= %s
+                AND p1.domain != p2.domain
+                AND LENGTH(e1.normalized_form) >= %s
+                AND NOT EXISTS (
+                    SELECT 1 FROM trivial_hashes t WHERE t.structure_hash = e1.structure_hash
+                )
+                {garbage_sql}
+                {range_sql}
+            ON CONFLICT (equation_1_id, equation_2_id) DO NOTHING
+        """, tuple(touched_params + [cap, min_complexity] + garbage_params + range_params))
+        count = cur.rowcount
+
+        # Hubs: pair each domain's earliest equation with every other
+        # domain's. A domain's earliest equation never changes as rows are
+        # added, so re-running only inserts pairs for newly reached domains.
+        garbage_sql, garbage_params = _garbage_filter('e')
+        cur.execute(f"""
+            WITH touched AS ({touched_sql}),
+            reps AS (
+                SELECT DISTINCT ON (e.structure_hash, p.domain)
+                    e.structure_hash, e.id, e.paper_id, p.domain
+                FROM structure_buckets b
+                JOIN equations e ON e.structure_hash = b.structure_hash
+                JOIN papers p ON e.paper_id = p.id
+                WHERE b.structure_hash IN (SELECT structure_hash FROM touched)
+                    AND b.equations > %s
+                    AND p.domain IS NOT NULL
+                    AND LENGTH(e.normalized_form) >= %s
+                    AND NOT EXISTS (
+                        SELECT 1 FROM trivial_hashes t WHERE t.structure_hash = e.structure_hash
+                    )
+                    {garbage_sql}
+                ORDER BY e.structure_hash, p.domain, e.id
+            )
+            INSERT INTO equation_matches
+                (equation_1_id, equation_2_id, match_type, similarity,
+                 paper_1_id, paper_2_id, domain_1, domain_2)
+            SELECT
+                r1.id, r2.id, 'exact_structural', 1.0,
+                r1.paper_id, r2.paper_id,
+                r1.domain, r2.domain
+            FROM reps r1
+            JOIN reps r2 ON r1.structure_hash = r2.structure_hash
+                AND r1.domain != r2.domain
+                AND r1.id < r2.id
+            ON CONFLICT (equation_1_id, equation_2_id) DO NOTHING
+        """, tuple(touched_params + [cap, min_complexity] + garbage_params))
+        count += cur.rowcount
+
+        if hashes is None:
+            _set_watermark(cur, 'exact_structural', high)
+    if commit:
+        conn.commit()
+    return count
+
+
+def delete_stale_exact_matches(conn, equation_ids: Sequence[int], commit: bool = True) -> int:
+    """Delete exact_structural matches touching `equation_ids` that no longer hold.
+
+    A match is stale once its two equations stop sharing a structure_hash
+    (either side changed hash or failed to parse). Matches that still hold are
+    kept, along with any moderation status they carry.
+
+    commit=False leaves the transaction to the caller (see find_exact_matches).
+
+    Returns count of matches deleted.
+    """
+    if not equation_ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM equation_matches m
+            USING equations e1, equations e2
+            WHERE m.match_type = 'exact_structural'
+                AND e1.id = m.equation_1_id
+                AND e2.id = m.equation_2_id
+                AND (m.equation_1_id = ANY(%s) OR m.equation_2_id = ANY(%s))
+                AND (e1.structure_hash IS NULL
+                     OR e1.structure_hash IS DISTINCT FROM e2.structure_hash)
+        """, (list(equation_ids), list(equation_ids)))
+        count = cur.rowcount
+    if commit:
+        conn.commit()
+    return count
+
+
+# Near-structural matching. A pair qualifies when some subtree they share
+# covers at least MIN_SUBTREE_SHARE of *both* equations. Subtrees held by more
+# than MAX_SUBTREE_BUCKET equations are textbook fragments (a quadratic form, a
+# logistic term) — they'd pair every equation containing them, so they're
+# skipped rather than matched k² ways.
+MIN_SUBTREE_SHARE = 0.5
+MAX_SUBTREE_BUCKET = 50
+
+
+def find_near_structural_matches(conn, min_share: float = MIN_SUBTREE_SHARE,
+                                 max_bucket: int = MAX_SUBTREE_BUCKET,
+                                 equation_ids: Optional[Sequence[int]] = None,
+                                 full: bool = False, commit: bool = True) -> int:
+    """Find cross-domain equations that share a large common subtree.
+
+    Looks pairs up through the equation_subtrees index instead of comparing
+    equations pairwise. similarity is the largest shared subtree's share of
+    the bigger equation. Pairs with the same structure_hash are left to
+    find_exact_matches.
+
+    If `equation_ids` is given, only pairs involving those equations are
+    considered — used by renormalize.py for the rows it just rewrote.
+    Otherwise it works from the watermark like find_exact_matches (full=True
+    to re-join everything). commit=False leaves the transaction to the caller.
+
+    Returns count of new matches created.
+    """
+    if equation_ids is not None and not equation_ids:
+        return 0
+
+    if equation_ids is None:
+        with conn.cursor() as cur:
+            low, high = _equation_range(cur, 'near_structural', full)
+
+    if equation_ids is not None:
+        scope_sql = """
+            WHERE subtree_hash IN (
+                SELECT subtree_hash FROM equation_subtrees WHERE equation_id = ANY(%s)
+            )"""
+        pair_sql = 'AND (s1.equation_id = ANY(%s) OR s2.equation_id = ANY(%s))'
+        scope_params = [list(equation_ids)]
+        pair_params = [list(equation_ids), list(equation_ids)]
+    else:
+        scope_sql = """
+            WHERE subtree_hash IN (
+                SELECT subtree_hash FROM equation_subtrees
+                WHERE equation_id > %s AND equation_id <= %s
+            )"""
+        pair_sql = 'AND s2.equation_id > %s AND s2.equation_id <= %s'
+        scope_params = pair_params = [low, high]
+    params = scope_params + [max_bucket, min_share] + pair_params
+
     garbage_clauses = []
-    params = [min_complexity]
     for pat in GARBAGE_PATTERNS:
         garbage_clauses.append("AND e1.latex NOT LIKE %s AND e2.latex NOT LIKE %s")
-        wrapped = f'%{pat}%'
-        params.append(wrapped)
-        params.append(wrapped)
-
+        params += [f'%{pat}%', f'%{pat}%']
     garbage_sql = " ".join(garbage_clauses)
 
-    # NOT EXISTS against trivial_hashes: if a moderator has ever rejected a
-    # match on this canonical form as a "standard_canonical_object", the hash
-    # gets added to trivial_hashes, and we exclude it from future match
-    # generation. This is the moderator-learned trivia filter: the system
-    # gets smarter as humans teach it which forms are textbook objects.
     query = f"""
+        WITH buckets AS (
+            SELECT subtree_hash FROM equation_subtrees
+            {scope_sql}
+            GROUP BY subtree_hash
+            HAVING COUNT(*) BETWEEN 2 AND %s
+        ),
+        pairs AS (
+            SELECT s1.equation_id AS id1, s2.equation_id AS id2,
+                   MAX(LEAST(s1.share, s2.share)) AS similarity
+            FROM buckets b
+            JOIN equation_subtrees s1 ON s1.subtree_hash = b.subtree_hash
+            JOIN equation_subtrees s2 ON s2.subtree_hash = b.subtree_hash
+                AND s1.equation_id < s2.equation_id
+            WHERE LEAST(s1.share, s2.share) >= %s
+                {pair_sql}
+            GROUP BY s1.equation_id, s2.equation_id
+        )
         INSERT INTO equation_matches
             (equation_1_id, equation_2_id, match_type, similarity,
              paper_1_id, paper_2_id, domain_1, domain_2)
         SELECT
-            e1.id, e2.id, 'exact_structural', 1.0,
+            e1.id, e2.id, 'near_structural', pairs.similarity,
             e1.paper_id, e2.paper_id,
             p1.domain, p2.domain
-        FROM equations e1
-        JOIN equations e2 ON e1.structure_hash = e2.structure_hash
-            AND e1.id < e2.id
-            AND e1.paper_id != e2.paper_id
+        FROM pairs
+        JOIN equations e1 ON e1.id = pairs.id1
+        JOIN equations e2 ON e2.id = pairs.id2
         JOIN papers p1 ON e1.paper_id = p1.id
         JOIN papers p2 ON e2.paper_id = p2.id
-        WHERE e1.structure_hash IS NOT NULL
+        WHERE e1.paper_id != e2.paper_id
             AND p1.domain != p2.domain
-            AND LENGTH(e1.normalized_form) >= %s
-            AND NOT EXISTS (
-                SELECT 1 FROM trivial_hashes t WHERE t.structure_hash = e1.structure_hash
-            )
+            AND e1.structure_hash IS DISTINCT FROM e2.structure_hash
             {garbage_sql}
         ON CONFLICT (equation_1_id, equation_2_id) DO NOTHING
     """
@@ -72,19 +404,62 @@ def find_exact_matches(conn, min_complexity: int = MIN_COMPLEXITY) -> int:
     with conn.cursor() as cur:
         cur.execute(query, tuple(params))
         count = cur.rowcount
-    conn.commit()
+        if equation_ids is None:
+            _set_watermark(cur, 'near_structural', high)
+    if commit:
+        conn.commit()
+    return count
+
+
+def delete_stale_near_matches(conn, equation_ids: Sequence[int], commit: bool = True) -> int:
+    """Delete near_structural matches touching `equation_ids` that no longer hold.
+
+    A match is stale once its equations share no indexed subtree, or have
+    become an exact match. The rest keep their moderation status.
+    commit=False leaves the transaction to the caller.
+
+    Returns count of matches deleted.
+    """
+    if not equation_ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM equation_matches m
+            USING equations e1, equations e2
+            WHERE m.match_type = 'near_structural'
+                AND e1.id = m.equation_1_id
+                AND e2.id = m.equation_2_id
+                AND (m.equation_1_id = ANY(%s) OR m.equation_2_id = ANY(%s))
+                AND (e1.structure_hash = e2.structure_hash
+                     OR NOT EXISTS (
+                        SELECT 1 FROM equation_subtrees s1
+                        JOIN equation_subtrees s2 ON s2.subtree_hash = s1.subtree_hash
+                        WHERE s1.equation_id = e1.id AND s2.equation_id = e2.id
+                     ))
+        """, (list(equation_ids), list(equation_ids)))
+        count = cur.rowcount
+    if commit:
+        conn.commit()
     return count
 
 
-def find_embedding_matches(conn, similarity_threshold: float = 0.92, limit: int = 1000) -> int:
+def find_embedding_matches(conn, similarity_threshold: float = 0.92, limit: int = 1000,
+                           method: Optional[str] = None) -> int:
     """Find equations with similar embeddings across different domains.
 
     Uses pgvector cosine distance. Only considers equations where SymPy
     parsing failed (those without a structure_hash) — exact matches are
     already handled by find_exact_matches.
 
+    `method` (default EMBEDDING_MATCHER) other than 'sql' hands off to
+    find_embedding_matches_in_memory.
+
     Returns count of new matches created.
     """
+    method = method or EMBEDDING_MATCHER
+    if method != 'sql':
+        return find_embedding_matches_in_memory(conn, similarity_threshold, method=method)
+
     with conn.cursor() as cur:
         # For each equation without a structure_hash that has an embedding,
         # find its nearest cross-domain neighbors.
@@ -113,13 +488,93 @@ def find_embedding_matches(conn, similarity_threshold: float = 0.92, limit: int
                     AND p2sub.domain != p1.domain
                     AND (1 - (e1.embedding <=> e2.embedding)) >= %s
                 ORDER BY e1.embedding <=> e2.embedding
-                LIMIT 5
+                LIMIT %s
             ) neighbor
             JOIN papers p2 ON neighbor.paper_id = p2.id
             WHERE e1.embedding IS NOT NULL
                 AND e1.structure_hash IS NULL
             ON CONFLICT (equation_1_id, equation_2_id) DO NOTHING
-        """, (similarity_threshold,))
+        """, (similarity_threshold, EMBEDDING_NEIGHBOURS))
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
+def find_embedding_matches_in_memory(conn, similarity_threshold: float = 0.92,
+                                     method: str = 'numpy',
+                                     k: int = EMBEDDING_NEIGHBOURS) -> int:
+    """find_embedding_matches, searched in memory rather than per row in SQL.
+
+    Streams every embedding of a paper with a domain into one float32
+    matrix, finds each unparsed equation's k nearest cross-domain
+    neighbours at or above the threshold in bulk (pipeline/ann.py), and
+    inserts the pairs with one COPY + INSERT ... SELECT. Same pairs as the
+    SQL with method='numpy'; hnswlib / faiss are approximate.
+
+    Needs numpy (and hnswlib or faiss-cpu for those methods).
+
+    Returns count of new matches created.
+    """
+    import numpy as np
+    from .ann import cross_domain_topk, unit_rows
+
+    ids, papers, domains, queries, vectors = [], [], [], [], []
+    with conn.cursor(name='embedding_matrix') as cur:
+        cur.itersize = 5000
+        cur.execute("""
+            SELECT e.id, e.paper_id, p.domain, e.structure_hash IS NULL, e.embedding::text
+            FROM equations e
+            JOIN papers p ON e.paper_id = p.id
+            WHERE e.embedding IS NOT NULL AND p.domain IS NOT NULL
+        """)
+        for eq_id, paper_id, domain, unparsed, text in cur:
+            if unparsed:
+                queries.append(len(ids))
+            ids.append(eq_id)
+            papers.append(paper_id)
+            domains.append(domain)
+            vectors.append(np.array(text[1:-1].split(','), dtype=np.float32))
+    conn.commit()
+    if not queries:
+        return 0
+
+    labels = np.unique(np.asarray(domains), return_inverse=True)[1]
+    unit = unit_rows(np.vstack(vectors))
+    del vectors
+
+    pairs = {}
+    for i, j, sim in cross_domain_topk(unit, labels, np.asarray(queries), k,
+                                       similarity_threshold, method):
+        a, b = (i, j) if ids[i] < ids[j] else (j, i)
+        pairs[(a, b)] = max(sim, pairs.get((a, b), sim))
+    if not pairs:
+        return 0
+
+    rows = [(ids[a], ids[b], 'embedding_similarity', sim,
+             papers[a], papers[b], domains[a], domains[b])
+            for (a, b), sim in pairs.items()]
+    from .store import _copy_rows
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS equation_matches_staging (
+                equation_1_id   INTEGER,
+                equation_2_id   INTEGER,
+                match_type      TEXT,
+                similarity      FLOAT,
+                paper_1_id      INTEGER,
+                paper_2_id      INTEGER,
+                domain_1        TEXT,
+                domain_2        TEXT
+            ) ON COMMIT DELETE ROWS
+        """)
+        columns = ('equation_1_id', 'equation_2_id', 'match_type', 'similarity',
+                   'paper_1_id', 'paper_2_id', 'domain_1', 'domain_2')
+        _copy_rows(cur, 'equation_matches_staging', columns, rows)
+        cur.execute(f"""
+            INSERT INTO equation_matches ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM equation_matches_staging
+            ON CONFLICT (equation_1_id, equation_2_id) DO NOTHING
+        """)
         count = cur.rowcount
     conn.commit()
     return count
@@ -148,4 +603,13 @@ def get_match_stats(conn) -> dict:
         cur.execute("SELECT COUNT(*) FROM equation_matches WHERE status = 'verified'")
         stats['verified'] = cur.fetchone()[0]
 
+        cur.execute("""
+            SELECT structure_hash, equations, papers, CARDINALITY(domains)
+            FROM structure_buckets
+            WHERE equations > %s
+            ORDER BY equations DESC
+            LIMIT 10
+        """, (MAX_EXACT_BUCKET,))
+        stats['largest_hubs'] = [(r[0], r[1], r[2], r[3]) for r in cur.fetchall()]
+
     return stats
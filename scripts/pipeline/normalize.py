@@ -56,10 +56,30 @@ Known limitations:
 
 from __future__ import annotations
 
+import functools
 import hashlib
+import os
 import re
+import signal
+import threading
+import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional
+
+
+# Bump whenever a change to this module can alter any NormalizationResult for
+# some input (preprocessing rules, filters, canonicalization, hashing, scoring).
+# Cached results (pipeline/normcache.py) are keyed by this, so a stale cache
+# can never leak old hashes into the database.
+NORMALIZER_VERSION = 2
+
+# The NORMALIZER_VERSION at which anything *other than* _preprocess_latex last
+# changed (pre-filter, classification, parsing, canonicalization, hashing,
+# scoring). A bump that only touches preprocessing leaves this alone: rows
+# whose stored preprocess_hash still matches are then known to be unaffected
+# and renormalize.py skips SymPy for them. When in doubt, set it equal to
+# NORMALIZER_VERSION — that is always safe, just slower.
+CANONICALIZER_VERSION = 2
 
 
 @dataclass
@@ -74,6 +94,18 @@ class NormalizationResult:
     # A form with only Mul(Symbol(...)) and nothing else scores 0.
     # A form with Pow, Derivative, Function, Add etc. scores higher.
     structure_score: int = 0
+    # Set only by normalize_latex_bounded when it abandoned the parse:
+    # 'timeout' or 'memory', plus the wall seconds burned before giving up.
+    aborted: Optional[str] = None
+    elapsed: Optional[float] = None
+    # sha256 of the preprocessed LaTeX (see preprocess_fingerprint). Stored per
+    # equation row so renormalize.py can tell which rows a change affects.
+    preprocess_hash: Optional[str] = None
+    # Significant subtrees of the canonical form, {subtree hash: node count},
+    # and the node count of the whole equation (see _significant_subtrees).
+    # Indexed in equation_subtrees for near-structural matching.
+    subtrees: Optional[Dict[str, int]] = None
+    structure_size: Optional[int] = None
 
 
 # LaTeX patterns that SymPy cannot meaningfully parse — reject before even trying.
@@ -138,41 +170,70 @@ _FONT_MACRO_RE = re.compile(
 )
 
 
-def _preprocess_latex(latex: str) -> str:
-    """Clean up LaTeX for SymPy's parser.
+# ─── Preprocessing rules ──────────────────────────────────────────────────
+#
+# _preprocess_latex is an ordered table of rewrites, compiled once at import.
+# Each rule names trigger substrings, at least one of which is part of every
+# match — so when none of them is in the string the rule cannot fire and is
+# skipped without running the regex. Most equations trip only a handful of
+# rules; one combined search (_ANY_TRIGGER_RE) catches the many that trip
+# none and sends them straight to the final whitespace cleanup.
+#
+# Order matters: some substitutions must happen before others. The steps
+# below are documented in the module docstring.
+
+@dataclass(frozen=True)
+class _Rule:
+    triggers: tuple          # rule is skipped unless one of these is in the string
+    pattern: object = None   # compiled regex; None = str.replace(triggers[0], repl)
+    repl: object = ''        # replacement string or function
+    context: tuple = ()      # if set, also skipped unless one of these is present
+
+
+def _sub(triggers, pattern: str, repl, context: tuple = ()) -> _Rule:
+    if isinstance(triggers, str):
+        triggers = (triggers,)
+    return _Rule(triggers, re.compile(pattern), repl, context)
 
-    This function handles the LaTeX conventions that SymPy doesn't understand
-    or mis-parses. Order matters: some substitutions must happen before others.
-    See module docstring for full documentation of each transformation.
-    """
-    s = latex
 
-    # ── Step 0: Assignment operators ──────────────────────────��─────────────
+def _literal(text: str, repl: str) -> _Rule:
+    return _Rule((text,), None, repl)
+
+
+# x^{(t+1)} → x_{t+1}: see Step 2.
+_TIME_INDEX_RULE = _sub(
+    '^{(',
+    r'(?<![A-Za-z])([A-Za-z])\s*(?:_\{[^}]*\}|_[A-Za-z])?\s*\^\{\(([^)]*[A-Za-z][^)]*)\)\}',
+    lambda m: f'{m.group(1)}_{{{m.group(2)}}}',
+)
+
+_PREPROCESS_RULES = [
+    # ── Step 0: Assignment operators ────────────────────────────────────────
     # Treat update/assignment operators as structural equality.
     # Must run BEFORE \\left stripping, which would mangle \\leftarrow → 'arrow'.
-    s = re.sub(r'\\leftarrow\b', '=', s)  # \leftarrow: update rule (ML papers)
-    s = re.sub(r'\\gets\b', '=', s)        # \gets: same as \leftarrow
-    s = re.sub(r':=', '=', s)              # :=: definition/assignment
+    _sub(r'\leftarrow', r'\\leftarrow\b', '='),  # \leftarrow: update rule (ML papers)
+    _sub(r'\gets', r'\\gets\b', '='),            # \gets: same as \leftarrow
+    _literal(':=', '='),                         # :=: definition/assignment
 
-    # ── Step 1: Transpose / conjugate operators ──────────────────────────────
+    # ── Step 1: Transpose / conjugate operators ─────────────────────────────
     # These appear as superscripts but are NOT exponents.
     # SymPy would parse A^\top as Pow(A, Symbol('top')) — wrong.
     # We replace with a subscript-style canonical marker: A_Tp, A_Cj, A_Hm.
     # Key distinction: we ONLY replace uppercase T and the \\top command.
     # Lowercase ^t (as in A^t) is left alone — it could be a real variable exponent.
     # We do this BEFORE macro stripping to catch both A^\top and \mathbf{A}^\top forms.
-    s = re.sub(r'\^\{\\top\}', '_Tp', s)   # ^{\top} — explicit brace form
-    s = re.sub(r'\^\\top\b', '_Tp', s)      # ^\top   — no brace form
-    s = re.sub(r'\^\{T\}', '_Tp', s)        # ^{T}    — capital T in braces
-    s = re.sub(r'\^T\b', '_Tp', s)          # ^T      — capital T word boundary
-    s = re.sub(r'\^\{[*]\}', '_Cj', s)     # ^{*}    — complex conjugate
-    s = re.sub(r'\^[*]', '_Cj', s)          # ^*      — complex conjugate
-    s = re.sub(r'\^\{\\dagger\}', '_Hm', s)  # ^{\dagger} — Hermitian conjugate
-    s = re.sub(r'\^\\dagger\b', '_Hm', s)    # ^\dagger
-    s = re.sub(r'\^\{H\}', '_Hm', s)         # ^{H}   — Hermitian (control theory)
-    s = re.sub(r'\^H\b', '_Hm', s)           # ^H     — Hermitian word boundary
-
-    # ── Step 2: Time / iteration indices in parenthesized superscripts ───────
+    _literal(r'^{\top}', '_Tp'),                 # ^{\top} — explicit brace form
+    _sub(r'^\top', r'\^\\top\b', '_Tp'),         # ^\top   — no brace form
+    _literal('^{T}', '_Tp'),                     # ^{T}    — capital T in braces
+    _sub('^T', r'\^T\b', '_Tp'),                 # ^T      — capital T word boundary
+    _literal('^{*}', '_Cj'),                     # ^{*}    — complex conjugate
+    _literal('^*', '_Cj'),                       # ^*      — complex conjugate
+    _literal(r'^{\dagger}', '_Hm'),              # ^{\dagger} — Hermitian conjugate
+    _sub(r'^\dagger', r'\^\\dagger\b', '_Hm'),   # ^\dagger
+    _literal('^{H}', '_Hm'),                     # ^{H}   — Hermitian (control theory)
+    _sub('^H', r'\^H\b', '_Hm'),                 # ^H     — Hermitian word boundary
+
+    # ── Step 2: Time / iteration indices in parenthesized superscripts ──────
     # x^{(t+1)} is a time/iteration index, NOT exponentiation to the power (t+1).
     # x^{(t+1)} → x_{t+1}, x^{(t)} → x_{t}
     #
@@ -190,122 +251,156 @@ def _preprocess_latex(latex: str) -> str:
     # previously matched via the optional brace branch, capturing the inner `x`,
     # producing `\mathbfx_{t+1}` (token merge). We now have two alternations —
     # bare form and fully-braced form — each independently guarded.
-    s = re.sub(
-        r'(?<![A-Za-z])([A-Za-z])\s*(?:_\{[^}]*\}|_[A-Za-z])?\s*\^\{\(([^)]*[A-Za-z][^)]*)\)\}',
-        lambda m: f'{m.group(1)}_{{{m.group(2)}}}',
-        s
-    )
+    _TIME_INDEX_RULE,
     # Handle the fully-braced form {x}^{(...)}: the char before the `{` must
     # not be a letter, so this won't fire inside \mathbf{x}.
-    s = re.sub(
+    _sub(
+        '^{(',
         r'(?<![A-Za-z])\{([A-Za-z])\}\s*(?:_\{[^}]*\}|_[A-Za-z])?\s*\^\{\(([^)]*[A-Za-z][^)]*)\)\}',
         lambda m: f'{m.group(1)}_{{{m.group(2)}}}',
-        s
-    )
+    ),
 
-    # ── Step 3: Gradient subscripts ────────────────────────────────��────────
+    # ── Step 3: Gradient subscripts ─────────────────────────────────────────
     # \nabla_\theta L means "gradient of L w.r.t. theta".
     # The subscript is just labeling the differentiation variable, which gets
     # absorbed into variable renaming anyway. Strip it: \nabla_\theta → \nabla.
     # Must run BEFORE macro stripping so \theta is still a backslash command.
-    s = re.sub(r'\\nabla_\{[^}]+\}', r'\\nabla', s)   # \nabla_{X} or \nabla_{\theta}
-    s = re.sub(r'\\nabla_\\[A-Za-z]+', r'\\nabla', s)  # \nabla_\theta, \nabla_\phi
-    s = re.sub(r'\\nabla_[A-Za-z]', r'\\nabla', s)     # \nabla_P (single char)
+    _sub(r'\nabla_{', r'\\nabla_\{[^}]+\}', r'\\nabla'),    # \nabla_{X} or \nabla_{\theta}
+    _sub('\\nabla_\\', r'\\nabla_\\[A-Za-z]+', r'\\nabla'),  # \nabla_\theta, \nabla_\phi
+    _sub(r'\nabla_', r'\\nabla_[A-Za-z]', r'\\nabla'),      # \nabla_P (single char)
 
     # ── Step 4: Standard size / grouping macro stripping ────────────────────
     # These macros affect display but not mathematical meaning.
-    s = s.replace(r'\left', '').replace(r'\right', '')
-    s = s.replace(r'\bigl', '').replace(r'\bigr', '')
-    s = s.replace(r'\Bigl', '').replace(r'\Bigr', '')
-    s = s.replace(r'\biggl', '').replace(r'\biggr', '')
-    s = s.replace(r'\displaystyle', '')
-    s = s.replace(r'\textstyle', '')
-    s = s.replace(r'\scriptstyle', '')
-
-    # ── Step 4a: Font / style macros ────────────────────────────────��───────
+    _literal(r'\left', ''), _literal(r'\right', ''),
+    _literal(r'\bigl', ''), _literal(r'\bigr', ''),
+    _literal(r'\Bigl', ''), _literal(r'\Bigr', ''),
+    _literal(r'\biggl', ''), _literal(r'\biggr', ''),
+    _literal(r'\displaystyle', ''),
+    _literal(r'\textstyle', ''),
+    _literal(r'\scriptstyle', ''),
+
+    # ── Step 4a: Font / style macros ────────────────────────────────────────
     # \mathcal{L} → L, \mathbf{x} → x, \mathrm{total} → total, etc.
     # We use a pattern replacement (\command{arg} → " arg ") to avoid token merging.
     # Without the spaces, \nabla\mathcal{L} → \nablaL (one token, parse failure).
-    s = _FONT_MACRO_RE.sub(r' \2 ', s)
+    _Rule((r'\math', r'\boldsymbol', r'\text'), _FONT_MACRO_RE, r' \2 '),
 
     # Re-run the time-index rule from Step 2: font-stripping \mathbf{x}^{(t+1)}
     # leaves ` x ^{(t+1)}` which Step 2 (running earlier, before font-strip) never
     # saw. The \s* allowances in the regex let it match across the spaces.
-    s = re.sub(
-        r'(?<![A-Za-z])([A-Za-z])\s*(?:_\{[^}]*\}|_[A-Za-z])?\s*\^\{\(([^)]*[A-Za-z][^)]*)\)\}',
-        lambda m: f'{m.group(1)}_{{{m.group(2)}}}',
-        s
-    )
+    _TIME_INDEX_RULE,
 
     # ── Step 4b: Spacing and misc macros ────────────────────────────────────
-    s = s.replace(r'\quad', ' ')
-    s = s.replace(r'\qquad', ' ')
-    s = s.replace(r'\,', ' ')
-    s = s.replace(r'\;', ' ')
-    s = s.replace(r'\!', '')
-    s = s.replace(r'\hbar', r'\hbar')  # keep, SymPy knows it
-
-    # ── Step 5: Dot / double-dot derivatives ────────────────────────��───────
+    _literal(r'\quad', ' '),
+    _literal(r'\qquad', ' '),
+    _literal(r'\,', ' '),
+    _literal(r'\;', ' '),
+    _literal(r'\!', ''),
+
+    # ── Step 5: Dot / double-dot derivatives ────────────────────────────────
     # \dot{x} = dx/dt (first time derivative), \ddot{x} = d²x/dt²
     # SymPy can parse the Leibniz form but not the dot notation.
-    s = re.sub(r'\\dot\{([^}]+)\}', r'\\frac{d \1}{d t}', s)
-    s = re.sub(r'\\ddot\{([^}]+)\}', r'\\frac{d^2 \1}{d t^2}', s)
+    _sub(r'\dot{', r'\\dot\{([^}]+)\}', r'\\frac{d \1}{d t}'),
+    _sub(r'\ddot{', r'\\ddot\{([^}]+)\}', r'\\frac{d^2 \1}{d t^2}'),
 
     # ── Step 6: Decorator macros → bare identifiers ─────────────────────────
     # \hat{x}, \tilde{x}, \bar{x}, \vec{x} — these are decorators that modify
     # a symbol but don't change its essential identity in structural matching.
     # We strip them and keep the bare identifier.
-    s = re.sub(r'\\hat\{([^}]+)\}', r'\1', s)
-    s = re.sub(r'\\tilde\{([^}]+)\}', r'\1', s)
-    s = re.sub(r'\\bar\{([^}]+)\}', r'\1', s)
-    s = re.sub(r'\\vec\{([^}]+)\}', r'\1', s)
-    s = re.sub(r'\\widehat\{([^}]+)\}', r'\1', s)
-    s = re.sub(r'\\widetilde\{([^}]+)\}', r'\1', s)
-    s = re.sub(r'\\overline\{([^}]+)\}', r'\1', s)
+    _sub(r'\hat{', r'\\hat\{([^}]+)\}', r'\1'),
+    _sub(r'\tilde{', r'\\tilde\{([^}]+)\}', r'\1'),
+    _sub(r'\bar{', r'\\bar\{([^}]+)\}', r'\1'),
+    _sub(r'\vec{', r'\\vec\{([^}]+)\}', r'\1'),
+    _sub(r'\widehat{', r'\\widehat\{([^}]+)\}', r'\1'),
+    _sub(r'\widetilde{', r'\\widetilde\{([^}]+)\}', r'\1'),
+    _sub(r'\overline{', r'\\overline\{([^}]+)\}', r'\1'),
     # \underline{x} is visual emphasis, same as \bar in structural terms.
     # Commonly appears in papers that use _{\underline{...}} for tensor
     # index labels after macro expansion.
-    s = re.sub(r'\\underline\{([^}]+)\}', r'\1', s)
+    _sub(r'\underline{', r'\\underline\{([^}]+)\}', r'\1'),
 
-    # ── Step 7: Laplacian normalization ────────────────────────────────��────
+    # ── Step 7: Laplacian normalization ─────────────────────────────────────
     # In PDE context (when \partial or \nabla is present): \Delta v → \nabla^2 v
     # Both forms then produce the same SymPy parse: Mul(Pow(Symbol('nabla'), 2), ...)
     # This is still a "degenerate" parse (nabla treated as a symbol) but it's
     # CONSISTENTLY degenerate, so the structural hash matches across both notations.
     # We only convert in PDE context to avoid mangling \Delta used as a difference.
-    if r'\partial' in s or r'\nabla' in s:
-        s = re.sub(r'\\Delta\s+([A-Za-z{\\])', r'\\nabla^2 \1', s)
-        s = re.sub(r'\\Delta\b(?!\s*[=<>])', r'\\nabla^2', s)
-
-    # ── Step 7a: Collapse nested subscripts _{_{...}} and ^{^{...}} ─────────
-    # After macro expansion, patterns like r_{_{\underline{12}}} appear: the
-    # macro was defined as {_{...}} (pushing its arg into a sub-subscript for
-    # typographic effect) and then used inside another _{...}. SymPy can't
-    # parse nested brace-only subscripts. Collapse to a single level.
-    # Run fixed-point iteration — each pass collapses one level, and font-strip
-    # artifacts like _{_{{12}}} need two passes.
-    for _ in range(6):
-        new_s = re.sub(r'_\{\s*_\{([^{}]*)\}\s*\}', r'_{\1}', s)
-        new_s = re.sub(r'\^\{\s*\^\{([^{}]*)\}\s*\}', r'^{\1}', new_s)
-        # Also collapse bare brace-wrapped groups inside sub/sup: _{{X}} → _{X}
-        new_s = re.sub(r'(_|\^)\{\{([^{}]*)\}\}', r'\1{\2}', new_s)
-        if new_s == s:
-            break
-        s = new_s
+    _sub(r'\Delta', r'\\Delta\s+([A-Za-z{\\])', r'\\nabla^2 \1',
+         context=(r'\partial', r'\nabla')),
+    _sub(r'\Delta', r'\\Delta\b(?!\s*[=<>])', r'\\nabla^2',
+         context=(r'\partial', r'\nabla')),
+]
 
+# ── Step 7a: Collapse nested subscripts _{_{...}} and ^{^{...}} ─────────────
+# After macro expansion, patterns like r_{_{\underline{12}}} appear: the
+# macro was defined as {_{...}} (pushing its arg into a sub-subscript for
+# typographic effect) and then used inside another _{...}. SymPy can't
+# parse nested brace-only subscripts. Collapse to a single level.
+# Run fixed-point iteration — each pass collapses one level, and font-strip
+# artifacts like _{_{{12}}} need two passes.
+_COLLAPSE_RULES = [
+    _sub('_{', r'_\{\s*_\{([^{}]*)\}\s*\}', r'_{\1}'),
+    _sub('^{', r'\^\{\s*\^\{([^{}]*)\}\s*\}', r'^{\1}'),
+    # Also collapse bare brace-wrapped groups inside sub/sup: _{{X}} → _{X}
+    _sub('{{', r'(_|\^)\{\{([^{}]*)\}\}', r'\1{\2}'),
+]
+_COLLAPSE_PASSES = 6
+
+_FINAL_RULES = [
     # ── Step 8: Clean up double subscripts ──────────────────────────────────
     # After time-index conversion, \mathbf{x}^{(t+1)}_i becomes x_{t+1}_i.
     # SymPy can't parse double subscripts. Drop the trailing particle index
     # (it's a dummy index anyway — whether it's _i or _j doesn't affect structure).
     # Pattern: _{time_expr}_{single_letter} → _{time_expr}
-    s = re.sub(r'(_\{[^}]+\})(_\{[A-Za-z]\}|_[A-Za-z])\b', r'\1', s)
+    _sub('}_', r'(_\{[^}]+\})(_\{[A-Za-z]\}|_[A-Za-z])\b', r'\1'),
+
+    # ── Step 9: Final cleanup ───────────────────────────────────────────────
+    _literal(r'\limits', ''),
+]
 
-    # ── Step 9: Final cleanup ────────────────────────────────────────────────
-    s = s.replace(r'\limits', '')
-    s = re.sub(r'\s+', ' ', s).strip()
+# Anything that could make some rule fire. Step 7a's triggers are left out:
+# _{ and ^{ are in nearly every equation, and its patterns also need a
+# second brace that only shows up after macro expansion.
+_ANY_TRIGGER_RE = re.compile('|'.join(
+    re.escape(t) for rule in _PREPROCESS_RULES + _FINAL_RULES for t in rule.triggers
+))
+_NESTED_SCRIPT_RE = re.compile(r'[_^]\{\s*[_^{]')
+
+
+def _apply(rules: list, s: str) -> str:
+    for rule in rules:
+        if not any(t in s for t in rule.triggers):
+            continue
+        if rule.context and not any(c in s for c in rule.context):
+            continue
+        if rule.pattern is None:
+            s = s.replace(rule.triggers[0], rule.repl)
+        else:
+            s = rule.pattern.sub(rule.repl, s)
     return s
 
 
+def _preprocess_latex(latex: str) -> str:
+    """Clean up LaTeX for SymPy's parser.
+
+    This function handles the LaTeX conventions that SymPy doesn't understand
+    or mis-parses, by running the _PREPROCESS_RULES table in order. See the
+    module docstring for full documentation of each transformation.
+    """
+    s = latex
+    if _ANY_TRIGGER_RE.search(s) is not None or _NESTED_SCRIPT_RE.search(s) is not None:
+        s = _apply(_PREPROCESS_RULES, s)
+        if _NESTED_SCRIPT_RE.search(s) is not None:
+            for _ in range(_COLLAPSE_PASSES):
+                new_s = _apply(_COLLAPSE_RULES, s)
+                if new_s == s:
+                    break
+                s = new_s
+        s = _apply(_FINAL_RULES, s)
+    # Collapse whitespace runs (same set re's \s matches) and trim.
+    return ' '.join(s.split())
+
+
 def _classify_equation_type(latex: str) -> str:
     """Rough classification based on operators present."""
     if re.search(r'\\partial|\\frac\{\\partial', latex):
@@ -362,6 +457,9 @@ STRUCTURAL_OPERATORS = [
 def _compute_structure_score(normalized_form: str) -> int:
     """Score a normalized form by counting meaningful structural operators.
 
+    This is the definition; normalize_latex gets the same number from
+    _walk_structure without scanning the string.
+
     A score of 0 means the form is a flat product/symbol with no real structure,
     likely a SymPy mis-parse. A score >= 3 is a strong signal that the equation
     has genuine mathematical content.
@@ -444,6 +542,125 @@ def _apply_canonical_renaming(expr, sym_map: dict, func_map: dict):
     return expr
 
 
+# ─── Structure walk ─────────────────────────────────────────────────────────
+#
+# One pass over the canonical expression that yields the structure score and
+# the subtree hashes. The score is defined over the srepr text
+# (_compute_structure_score); the walk reproduces it exactly from the text
+# each node contributes — its head, e.g. 'Pow(' or "Function('f0')(", or the
+# full srepr of an atom — without scanning the joined string.
+#
+# Subtree hashes (near-structural matching) are name-blind Merkle digests:
+# sha256 of the node's head plus its children's digests, with Add/Mul
+# children sorted so operand order doesn't matter. Every symbol hashes as one
+# leaf, every undefined function as one head, and the count of distinct
+# symbols under the node is mixed in. structure_hash stays sha256 of
+# normalized_form, which stored matches and trivial_hashes refer to.
+# Canonical names can't be used there — they depend on the rest of the
+# equation, and evaluation re-sorts Mul/Add arguments by them — so the
+# \alpha x - \beta x y on the right of a Lotka-Volterra equation would hash
+# differently under different left-hand sides. Only significant subtrees
+# are kept: at least MIN_SUBTREE_NODES nodes and two levels deep (so not a
+# bare product or sum of symbols), the largest MAX_SUBTREES per equation.
+
+MIN_SUBTREE_NODES = 8
+MAX_SUBTREES = 32
+
+_BLIND_SYMBOL = hashlib.sha256(b'Symbol').digest()
+
+
+@dataclass
+class _Subtree:
+    digest: bytes      # name-blind digest plus distinct-symbol count
+    size: int          # nodes, counting atoms
+    height: int        # 1 for a node whose children are all atoms
+
+
+@dataclass
+class _StructureSummary:
+    score: int
+    subtrees: list                 # _Subtree per non-atom node, in walk order
+    size: int                      # nodes in all sides together
+
+
+@functools.lru_cache(maxsize=4096)
+def _atom_text(atom) -> str:
+    from sympy import srepr
+    return srepr(atom)
+
+
+@functools.lru_cache(maxsize=1024)
+def _head_points(text: str) -> frozenset:
+    """Indices into STRUCTURAL_OPERATORS of the operators `text` contains."""
+    return frozenset(i for i, (op, _points) in enumerate(STRUCTURAL_OPERATORS) if op in text)
+
+
+def _walk_structure(parts: list) -> _StructureSummary:
+    """Score the canonical (already renamed) sides of an equation and hash its subtrees."""
+    from sympy import Add, Mul, Symbol, srepr
+    from sympy.core.function import AppliedUndef
+    from sympy.core.numbers import ImaginaryUnit
+
+    found = set()
+    subtrees = []
+    sha256 = hashlib.sha256
+
+    # Each call returns (blind digest, symbols, size, height).
+    def walk(e):
+        if not e.args:
+            text = _atom_text(e)
+            found.update(_head_points(text))
+            if isinstance(e, Symbol):
+                return _BLIND_SYMBOL, {e}, 1, 0
+            return sha256(text.encode()).digest(), set(), 1, 0
+        if isinstance(e, AppliedUndef):
+            text = f"Function('{e.func.__name__}')("
+            blind_text = 'Function('
+        else:
+            text = blind_text = type(e).__name__ + '('
+        found.update(_head_points(text))
+        children = [walk(a) for a in e.args]
+        if any(isinstance(a, ImaginaryUnit) for a in e.args):
+            # 'I,' is the one operator that spans nodes: it needs the printed
+            # argument order, so take it from this node's own srepr.
+            found.update(_head_points(srepr(e)))
+        blind = [c[0] for c in children]
+        if isinstance(e, (Add, Mul)):
+            blind.sort()
+        symbols = set().union(*(c[1] for c in children))
+        size = 1 + sum(c[2] for c in children)
+        height = 1 + max(c[3] for c in children)
+        blind_digest = sha256(blind_text.encode() + b''.join(blind)).digest()
+        subtrees.append(_Subtree(sha256(blind_digest + str(len(symbols)).encode()).digest(),
+                                 size, height))
+        return blind_digest, symbols, size, height
+
+    roots = [walk(p) for p in parts]
+    score = sum(STRUCTURAL_OPERATORS[i][1] for i in found)
+    return _StructureSummary(score, subtrees, sum(r[2] for r in roots))
+
+
+def _significant_subtrees(summary: _StructureSummary) -> Dict[str, int]:
+    """{subtree hash: node count} for the equation's significant subtrees."""
+    candidates = sorted((t for t in summary.subtrees
+                         if t.size >= MIN_SUBTREE_NODES and t.height >= 2),
+                        key=lambda t: t.size, reverse=True)
+    subtrees = {}
+    for t in candidates:
+        if len(subtrees) >= MAX_SUBTREES:
+            break
+        subtrees.setdefault(t.digest.hex(), t.size)
+    return subtrees
+
+
+# ─── Parser ────────────────────────────────────────────────────────────────
+
+def _get_parser():
+    """SymPy's parse_latex, imported on first use."""
+    from sympy.parsing.latex import parse_latex
+    return parse_latex
+
+
 def normalize_latex(latex: str) -> NormalizationResult:
     """Attempt to parse LaTeX into SymPy and produce a normalized form.
 
@@ -465,7 +682,30 @@ def normalize_latex(latex: str) -> NormalizationResult:
     We deliberately do NOT call simplify() — it can destroy structural
     information (e.g. moving everything to one side as 0 = ...).
     """
+    preprocessed = _preprocess_latex(latex)
+    result = _normalize_preprocessed(latex, preprocessed)
+    result.preprocess_hash = _fingerprint(preprocessed)
+    return result
+
+
+def _fingerprint(preprocessed: str) -> str:
+    return hashlib.sha256(preprocessed.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+
+def preprocess_fingerprint(latex: str) -> str:
+    """sha256 of _preprocess_latex(latex) — identifies what SymPy actually sees."""
+    return _fingerprint(_preprocess_latex(latex))
+
+
+def _normalize_preprocessed(latex: str, preprocessed: str, parse_latex=None) -> NormalizationResult:
+    """Steps 1 and 3-7 of normalize_latex, given the step-2 output.
+
+    `parse_latex` replaces SymPy's parser for step 3 (bench_parser.py uses
+    this to try another one); results from any other parser must not be
+    stored.
+    """
     equation_type = _classify_equation_type(latex)
+    parse_latex = parse_latex or _get_parser()
 
     # Pre-filter: reject LaTeX with patterns SymPy silently mis-parses.
     if _is_unparseable(latex):
@@ -476,13 +716,10 @@ def normalize_latex(latex: str) -> NormalizationResult:
             structure_score=0,
         )
 
-    preprocessed = _preprocess_latex(latex)
-
     # Split on = (but not == or \neq)
     sides = re.split(r'(?<!\\)(?<!=)=(?!=)', preprocessed)
 
     try:
-        from sympy.parsing.latex import parse_latex
         from sympy import Symbol, Function, srepr
 
         parsed_parts = []
@@ -523,10 +760,8 @@ def normalize_latex(latex: str) -> NormalizationResult:
         sym_map = {sym: Symbol(f'x{i}') for i, sym in enumerate(ordered_symbols)}
         func_map = {func: Function(f'f{i}') for i, func in enumerate(ordered_functions)}
 
-        normalized_parts = [
-            srepr(_apply_canonical_renaming(p, sym_map, func_map))
-            for p in parsed_parts
-        ]
+        canonical_parts = [_apply_canonical_renaming(p, sym_map, func_map) for p in parsed_parts]
+        normalized_parts = [srepr(p) for p in canonical_parts]
         normalized_form = ' = '.join(normalized_parts)
 
         # Tautology filter: if there are exactly two canonical parts and they
@@ -547,7 +782,8 @@ def normalize_latex(latex: str) -> NormalizationResult:
                 structure_score=0,
             )
 
-        structure_score = _compute_structure_score(normalized_form)
+        summary = _walk_structure(canonical_parts)
+        structure_score = summary.score
         num_symbols = len(ordered_symbols)
 
         # Reject degenerate parses. Two failure modes:
@@ -584,11 +820,125 @@ def normalize_latex(latex: str) -> NormalizationResult:
             structure_hash=structure_hash,
             equation_type=equation_type,
             structure_score=structure_score,
+            subtrees=_significant_subtrees(summary),
+            structure_size=summary.size,
         )
 
     except Exception as e:
+        # Under normalize_latex_bounded a MemoryError is a budget abort, and is
+        # reported as one there. Everywhere else it's a failed parse, as before.
+        if isinstance(e, MemoryError) and getattr(_bounded, 'active', False):
+            raise
         return NormalizationResult(
             success=False,
             equation_type=equation_type,
             error=str(e)[:200],
         )
+
+
+# ─── Bounded execution ─────────────────────────────────────────────────────
+#
+# A single pathological equation (deeply nested \frac, a 40-term align row)
+# can keep SymPy's parser or srepr busy for minutes. normalize_latex_bounded
+# runs normalize_latex under a SIGALRM-driven watchdog that abandons the parse
+# once it exceeds a wall-time budget or grows the process RSS past a memory
+# budget, and returns a failed result with a distinct error instead.
+#
+# Signals only reach the main thread, so the watchdog is active in the main
+# thread of a process (pool workers, single-process scripts). Called from any
+# other thread it falls back to plain normalize_latex. Time spent inside one
+# long C-level call (huge integer arithmetic) can overshoot the budget — the
+# check runs between Python bytecodes.
+
+DEFAULT_TIMEOUT = 20.0        # seconds of wall time per equation
+DEFAULT_MAX_RSS_MB = 1024     # RSS growth allowed during one equation
+_RSS_CHECK_INTERVAL = 0.1     # seconds between memory checks
+
+TIMEOUT_ERROR = 'Timeout: normalization exceeded time budget'
+MEMORY_ERROR = 'Memory budget exceeded during normalization'
+
+# `active` is set while normalize_latex runs under the watchdog.
+_bounded = threading.local()
+
+
+class NormalizationAborted(BaseException):
+    """Raised by the watchdog inside a bounded normalization.
+
+    Derives from BaseException so normalize_latex's broad `except Exception`
+    can't mistake it for a parse failure and swallow it.
+    """
+
+    def __init__(self, kind: str):
+        super().__init__(kind)
+        self.kind = kind
+
+
+def _current_rss_mb() -> Optional[float]:
+    """Resident set size of this process in MB (Linux /proc), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def normalize_latex_bounded(
+    latex: str,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    max_rss_mb: Optional[float] = DEFAULT_MAX_RSS_MB,
+) -> NormalizationResult:
+    """normalize_latex with a per-equation time and memory budget.
+
+    Returns the normal result when the parse finishes within budget. When it
+    doesn't, returns success=False with error TIMEOUT_ERROR or MEMORY_ERROR,
+    `aborted` set to 'timeout' / 'memory' and `elapsed` to the seconds lost.
+    A budget of None or 0 disables that check.
+    """
+    base_rss = _current_rss_mb() if max_rss_mb else None
+    if ((not timeout and base_rss is None)
+            or not hasattr(signal, 'setitimer')
+            or threading.current_thread() is not threading.main_thread()):
+        return normalize_latex(latex)
+
+    start = time.monotonic()
+    state = {'done': False}
+
+    def _watchdog(signum, frame):
+        if state['done']:
+            return
+        if timeout and time.monotonic() - start >= timeout:
+            raise NormalizationAborted('timeout')
+        if base_rss is not None:
+            rss = _current_rss_mb()
+            if rss is not None and rss - base_rss > max_rss_mb:
+                raise NormalizationAborted('memory')
+
+    if base_rss is not None:
+        first, interval = _RSS_CHECK_INTERVAL, _RSS_CHECK_INTERVAL
+    else:
+        first, interval = timeout, 0.0
+    previous = signal.signal(signal.SIGALRM, _watchdog)
+    signal.setitimer(signal.ITIMER_REAL, first, interval)
+    _bounded.active = True
+    try:
+        result = normalize_latex(latex)
+        state['done'] = True
+        return result
+    except NormalizationAborted as e:
+        kind = e.kind
+    except MemoryError:
+        kind = 'memory'
+    finally:
+        state['done'] = True
+        _bounded.active = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+    return NormalizationResult(
+        success=False,
+        equation_type=_classify_equation_type(latex),
+        error=TIMEOUT_ERROR if kind == 'timeout' else MEMORY_ERROR,
+        aborted=kind,
+        elapsed=time.monotonic() - start,
+    )
@@ -0,0 +1,206 @@
+"""
+normalize_pool.py — Batch normalization across a process pool.
+
+normalize_latex is pure CPU (SymPy's LaTeX parser plus srepr) and holds the
+GIL the whole time, so threads don't help. This module fans a batch of LaTeX
+strings out to worker processes and hands back NormalizationResults in input
+order.
+
+Each worker warms up once at start (imports SymPy and runs one parse so the
+ANTLR grammar is loaded) instead of paying that on its first real equation.
+
+Every equation runs under normalize_latex_bounded, so one pathological parse
+costs at most `timeout` seconds instead of stalling a worker for minutes.
+`pool.stats` counts those aborts and the wall time they burned.
+
+With a NormalizationCache attached, each batch is first resolved against the
+cache (and de-duplicated), and only the misses are shipped to the workers.
+
+Usage:
+    results = normalize_many(latex_list, workers=8)
+
+    # or, to reuse one pool across many small batches (one per paper):
+    with NormalizerPool(workers=8) as pool:
+        for paper in papers:
+            norms = pool.map(eq.latex for eq in paper.equations)
+"""
+
+from __future__ import annotations
+
+import functools
+import itertools
+import multiprocessing
+import os
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+from .normalize import (
+    DEFAULT_MAX_RSS_MB,
+    DEFAULT_TIMEOUT,
+    NormalizationResult,
+    normalize_latex,
+    normalize_latex_bounded,
+)
+from .normcache import NormalizationCache
+
+
+DEFAULT_CHUNKSIZE = 32
+
+# Below this many equations a batch runs in-process: shipping a handful of
+# strings to the pool costs more than parsing them.
+MIN_PARALLEL_BATCH = 8
+
+# imap() resolves its input in blocks of this many strings so cache lookups
+# and de-duplication can be batched.
+IMAP_BLOCK = 2000
+
+
+@dataclass
+class NormalizerStats:
+    """Running totals for one pool: how much time outliers cost us."""
+    equations: int = 0
+    timeouts: int = 0
+    memory_aborts: int = 0
+    seconds_lost: float = 0.0
+
+    def record(self, result: NormalizationResult) -> NormalizationResult:
+        self.equations += 1
+        if result.aborted == 'timeout':
+            self.timeouts += 1
+        elif result.aborted == 'memory':
+            self.memory_aborts += 1
+        if result.aborted:
+            self.seconds_lost += result.elapsed or 0.0
+        return result
+
+    def summary(self) -> str:
+        return (f'{self.timeouts} timeouts, {self.memory_aborts} memory aborts, '
+                f'{self.seconds_lost:.1f}s lost to outliers '
+                f'(of {self.equations} equations)')
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _init_worker() -> None:
+    """Pool initializer: pay SymPy / ANTLR import cost once per worker."""
+    try:
+        normalize_latex('x = y + 1')
+    except Exception:
+        pass
+
+
+class NormalizerPool:
+    """A reusable, order-preserving pool of normalizer processes.
+
+    workers <= 1 runs everything in-process (no pool is ever started), which
+    keeps single-core machines and debugging sessions simple.
+
+    timeout / max_rss_mb are the per-equation budgets passed to
+    normalize_latex_bounded; None or 0 disables that limit.
+
+    cache, if given, is consulted before and filled after every batch.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+        max_rss_mb: Optional[float] = DEFAULT_MAX_RSS_MB,
+        cache: Optional[NormalizationCache] = None,
+    ):
+        self.cache = cache
+        self.workers = default_workers() if workers is None else max(1, workers)
+        self.chunksize = max(1, chunksize)
+        self._fn = functools.partial(normalize_latex_bounded,
+                                     timeout=timeout, max_rss_mb=max_rss_mb)
+        self.stats = NormalizerStats()
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker)
+        return self._pool
+
+    def start(self) -> 'NormalizerPool':
+        """Start the workers now rather than on first use.
+
+        Callers that also run threads (the arXiv prefetcher, the embedder)
+        must start the pool first so workers are forked from a single-threaded
+        parent: a fork taken while another thread holds a lock (or is halfway
+        through importing torch) can deadlock the child. Raises RuntimeError
+        if another thread is already running.
+        """
+        if self.workers > 1 and self._pool is None:
+            if threading.active_count() > 1:
+                raise RuntimeError(
+                    f'NormalizerPool started with {threading.active_count() - 1} other '
+                    f'thread(s) running; start it before any other thread')
+            self._get_pool()
+        return self
+
+    def imap(self, latex_iter: Iterable[str]) -> Iterator[NormalizationResult]:
+        """Lazily normalize an iterable, yielding results in input order."""
+        it = iter(latex_iter)
+        while True:
+            block = list(itertools.islice(it, IMAP_BLOCK))
+            if not block:
+                return
+            yield from self.map(block)
+
+    def map(self, latex_iter: Iterable[str]) -> List[NormalizationResult]:
+        """Normalize a batch and return results in input order."""
+        latex_list = list(latex_iter)
+        known = self.cache.get_many(latex_list) if self.cache is not None else {}
+        todo = [latex for latex in dict.fromkeys(latex_list) if latex not in known]
+        computed = dict(zip(todo, self._compute(todo)))
+        if self.cache is not None:
+            self.cache.put_many(computed)
+        known.update(computed)
+        return [known[latex] for latex in latex_list]
+
+    def _compute(self, latex_list: List[str]) -> List[NormalizationResult]:
+        if self.workers <= 1 or len(latex_list) < MIN_PARALLEL_BATCH:
+            results = [self._fn(latex) for latex in latex_list]
+        else:
+            # Spread small batches across all workers instead of one big chunk.
+            chunksize = max(1, min(self.chunksize, len(latex_list) // self.workers))
+            results = self._get_pool().map(self._fn, latex_list, chunksize)
+        return [self.stats.record(r) for r in results]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> 'NormalizerPool':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def normalize_many(
+    latex_iter: Iterable[str],
+    workers: Optional[int] = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    max_rss_mb: Optional[float] = DEFAULT_MAX_RSS_MB,
+    cache: Optional[NormalizationCache] = None,
+) -> List[NormalizationResult]:
+    """Normalize many LaTeX strings in parallel. Results are in input order."""
+    with NormalizerPool(workers, chunksize, timeout, max_rss_mb, cache) as pool:
+        return pool.map(latex_iter)
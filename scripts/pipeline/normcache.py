@@ -0,0 +1,170 @@
+"""
+normcache.py — Memoize normalize_latex results across equations and runs.
+
+The same LaTeX strings recur constantly across papers (\\frac{dx}{dt} = f(x),
+textbook definitions, E = mc^2), and renormalize.py re-parses the whole corpus
+after every normalizer tweak. Since normalize_latex is a pure function of its
+input and of the normalizer code, its results can be cached under
+
+    sha256(latex)  +  NORMALIZER_VERSION
+
+Two tiers:
+  1. An in-process LRU (always on) for repeats within one run.
+  2. An optional SQLite file shared across runs. Entries from other
+     NORMALIZER_VERSIONs are simply never looked up, so bumping the version
+     invalidates the tier without deleting anything.
+
+Results that were aborted by the bounded mode (timeouts, memory) are never
+cached — they depend on the budget and machine load, not on the input.
+
+The cache is only touched by the parent process (NormalizerPool looks up and
+stores around its worker dispatch), so SQLite sees a single writer.
+
+Environment:
+    ANALOG_QUEST_NORM_CACHE   path of the SQLite tier (unset = memory only)
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from .normalize import NORMALIZER_VERSION, NormalizationResult
+
+
+DEFAULT_MAX_ENTRIES = 100_000
+
+# Fields that describe one particular execution rather than the input.
+_VOLATILE_FIELDS = ('aborted', 'elapsed')
+
+
+def cache_key(latex: str) -> str:
+    return hashlib.sha256(latex.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+
+def _encode(result: NormalizationResult) -> str:
+    data = dataclasses.asdict(result)
+    for name in _VOLATILE_FIELDS:
+        data.pop(name, None)
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _decode(blob: str) -> NormalizationResult:
+    return NormalizationResult(**json.loads(blob))
+
+
+class NormalizationCache:
+    """Two-tier (LRU + optional SQLite) cache of NormalizationResults."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        version: str = str(NORMALIZER_VERSION),
+    ):
+        self.version = version
+        self.max_entries = max_entries
+        self._lru: 'OrderedDict[str, NormalizationResult]' = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS normalizations (
+                    version TEXT NOT NULL,
+                    key     TEXT NOT NULL,
+                    result  TEXT NOT NULL,
+                    PRIMARY KEY (version, key)
+                )
+            """)
+            self._db.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, result: NormalizationResult) -> None:
+        self._lru[key] = result
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_many(self, latex_iter: Iterable[str]) -> Dict[str, NormalizationResult]:
+        """Look up many strings at once. Returns {latex: result} for the hits."""
+        found: Dict[str, NormalizationResult] = {}
+        pending: Dict[str, str] = {}   # key -> latex, for the disk tier
+        seen = set()
+        for latex in latex_iter:
+            if latex in seen:
+                continue
+            seen.add(latex)
+            key = cache_key(latex)
+            hit = self._lru.get(key)
+            if hit is not None:
+                self._lru.move_to_end(key)
+                found[latex] = hit
+                self.memory_hits += 1
+            else:
+                pending[key] = latex
+
+        if pending and self._db is not None:
+            keys = list(pending)
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._db.execute(
+                    f'SELECT key, result FROM normalizations '
+                    f'WHERE version = ? AND key IN ({",".join("?" * len(chunk))})',
+                    [self.version, *chunk],
+                ).fetchall()
+                for key, blob in rows:
+                    result = _decode(blob)
+                    self._remember(key, result)
+                    found[pending.pop(key)] = result
+                    self.disk_hits += 1
+
+        self.misses += len(pending)
+        return found
+
+    def get(self, latex: str) -> Optional[NormalizationResult]:
+        return self.get_many([latex]).get(latex)
+
+    def put_many(self, items: Dict[str, NormalizationResult]) -> None:
+        """Store {latex: result}. Aborted results are skipped."""
+        rows = []
+        for latex, result in items.items():
+            if result.aborted:
+                continue
+            key = cache_key(latex)
+            self._remember(key, result)
+            if self._db is not None:
+                rows.append((self.version, key, _encode(result)))
+        if rows:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO normalizations (version, key, result) VALUES (?, ?, ?)',
+                rows,
+            )
+            self._db.commit()
+
+    def put(self, latex: str, result: NormalizationResult) -> None:
+        self.put_many({latex: result})
+
+    def summary(self) -> str:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        rate = f'{100 * (lookups - self.misses) / lookups:.1f}%' if lookups else 'n/a'
+        return (f'{rate} hit rate ({self.memory_hits} memory, {self.disk_hits} disk, '
+                f'{self.misses} misses)')
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def get_normalization_cache(path: Optional[str] = None) -> NormalizationCache:
+    """A cache with the disk tier at `path`, else ANALOG_QUEST_NORM_CACHE, else memory only."""
+    return NormalizationCache(path or os.environ.get('ANALOG_QUEST_NORM_CACHE') or None)
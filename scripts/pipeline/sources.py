@@ -0,0 +1,194 @@
+"""
+sources.py — Local content-addressed store for arXiv e-print downloads.
+
+Every script that looks at paper source (run_pipeline, triage_no_source,
+measure_macro_impact, diagnose_regressions, the experiment bundle builders)
+goes through fetch_latex_source, and until now each of them re-downloaded the
+same tarballs — paying the network and arXiv's 3s rate limit again on every
+A/B run. This store sits in front of the download:
+
+    <root>/objects/<sha256 of bytes>   raw e-print response, stored once
+    <root>/refs/<arxiv_id>             sha256 of the object for that id
+
+Refs are keyed by the arxiv_id exactly as requested, so "2307.04768v2" pins a
+version and a bare "2307.04768" means "whatever was latest when we fetched
+it". Two refs with identical bytes share one object.
+
+Eviction is LRU by object mtime (touched on every hit), triggered on put once
+the store exceeds its byte budget. Refs whose object was evicted are treated
+as misses and cleaned up lazily.
+
+Environment:
+    ANALOG_QUEST_SOURCE_CACHE     store directory, or "off" to disable
+                                  (default: ~/.cache/analog-quest/sources)
+    ANALOG_QUEST_SOURCE_CACHE_MB  byte budget in MB (default: 2048)
+    ANALOG_QUEST_OFFLINE          1/true/yes: never touch the network; a
+                                  store miss behaves like "no source"
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Optional
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'analog-quest', 'sources')
+DEFAULT_MAX_MB = 2048
+
+OFFLINE = os.environ.get('ANALOG_QUEST_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def _ref_name(arxiv_id: str) -> str:
+    # Old-style ids contain a slash (hep-th/9901001).
+    return arxiv_id.strip().replace('/', '_')
+
+
+class SourceStore:
+    """Content-addressed, size-bounded LRU store of raw e-print bytes."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.refs_dir = os.path.join(root, 'refs')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.refs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest)
+
+    def _ref_path(self, arxiv_id: str) -> str:
+        return os.path.join(self.refs_dir, _ref_name(arxiv_id))
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def get(self, arxiv_id: str) -> Optional[bytes]:
+        """Return the stored bytes for arxiv_id, or None on a miss."""
+        f = self.open(arxiv_id)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def open(self, arxiv_id: str) -> Optional[BinaryIO]:
+        """Open the stored object for arxiv_id for reading, or None on a miss.
+
+        Lets callers stream a large tarball instead of loading it whole.
+        """
+        ref = self._ref_path(arxiv_id)
+        try:
+            with open(ref) as f:
+                digest = f.read().strip()
+            path = self._object_path(digest)
+            obj = open(path, 'rb')
+        except FileNotFoundError:
+            # No ref, or the object behind it was evicted.
+            if os.path.exists(ref):
+                try:
+                    os.unlink(ref)
+                except OSError:
+                    pass
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # LRU bookkeeping
+        except OSError:
+            pass
+        self.hits += 1
+        return obj
+
+    def put(self, arxiv_id: str, data: bytes) -> str:
+        """Store bytes for arxiv_id and return their sha256. Evicts if over budget."""
+        return self.put_file(arxiv_id, io.BytesIO(data))
+
+    def put_file(self, arxiv_id: str, src: BinaryIO) -> str:
+        """Store the rest of file `src` for arxiv_id, copying in chunks, and
+        return its sha256. Evicts if over budget."""
+        fd, tmp = tempfile.mkstemp(dir=self.objects_dir, prefix='.tmp-')
+        h = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: src.read(1 << 16), b''):
+                    h.update(chunk)
+                    out.write(chunk)
+            digest = h.hexdigest()
+            with self._lock:
+                path = self._object_path(digest)
+                if os.path.exists(path):
+                    os.unlink(tmp)
+                    os.utime(path)
+                else:
+                    os.replace(tmp, path)
+                self._write_atomic(self._ref_path(arxiv_id), digest.encode())
+                self._evict(keep=digest)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        return digest
+
+    def _evict(self, keep: Optional[str] = None) -> int:
+        """Delete least-recently-used objects until under max_bytes. Returns count."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.objects_dir):
+            if name.startswith('.tmp-'):
+                continue
+            try:
+                st = os.stat(self._object_path(name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for _mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.unlink(self._object_path(name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+_default_store: Optional[SourceStore] = None
+_default_lock = threading.Lock()
+
+
+def get_source_store() -> Optional[SourceStore]:
+    """Process-wide store configured from the environment, or None if disabled."""
+    global _default_store
+    root = os.environ.get('ANALOG_QUEST_SOURCE_CACHE', DEFAULT_CACHE_DIR)
+    if root.lower() in ('', '0', 'off', 'none', 'false'):
+        return None
+    with _default_lock:
+        if _default_store is None:
+            max_mb = int(os.environ.get('ANALOG_QUEST_SOURCE_CACHE_MB', DEFAULT_MAX_MB))
+            _default_store = SourceStore(root, max_mb * 1024 * 1024)
+        return _default_store
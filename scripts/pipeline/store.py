@@ -0,0 +1,355 @@
+"""
+store.py — Bulk writer for extracted equations.
+
+run_pipeline.py used to INSERT one row per equation, so a paper with a few
+hundred inline equations cost a few hundred round-trips to Neon. This writer
+buffers several papers, streams all their rows into a temp staging table with
+one COPY ... FROM STDIN, and moves them into `equations` with a single
+INSERT ... SELECT — one transaction per batch.
+
+Writes go through ConnectionManager.run, so a connection Neon dropped is
+replaced and the batch replayed transparently. Replaying is safe: the batch
+is one transaction, and if the first attempt did commit, the merge's
+ON CONFLICT (paper_id, position) DO NOTHING skips the rows already there.
+
+Each parsed equation's significant subtrees (NormalizationResult.subtrees)
+go into equation_subtrees in the same transaction: staged by (paper_id,
+position) and joined to the ids the merge assigned.
+
+Per-paper failure isolation is preserved: if a batch fails (constraint
+violation, bad row) it is rolled back and each paper in it is retried in its
+own transaction, so one bad paper only loses itself.
+
+Embeddings for unparsed equations are filled in afterwards by an
+EmbeddingAccumulator. It collects those equations across many papers,
+embeds them in full batches and writes the vectors back with
+one COPY + UPDATE per flush, keyed by (paper_id, position).
+
+Usage:
+    writer = EquationWriter(db, batch_papers=8)   # db: ConnectionManager
+    writer.add(paper_id, equations, norms, embeddings)
+    writer.add_sentinel(paper_id)      # "processed, no equations"
+    writer.flush()
+
+    pending = EmbeddingAccumulator(writer, embedder)   # embedder: EmbeddingWorker
+    pending.add(paper_id, equations, norms)
+    pending.flush()
+"""
+
+from __future__ import annotations
+
+import io
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from .config import ConnectionManager
+from .match import guard_equation_inserts
+from .normalize import NORMALIZER_VERSION
+
+
+DEFAULT_BATCH_PAPERS = 8
+
+# An EmbeddingAccumulator flushes once it holds this many equations, or once
+# its oldest one has waited this long.
+DEFAULT_EMBED_FLUSH_ROWS = 512
+DEFAULT_EMBED_FLUSH_SECONDS = 120.0
+
+# Column order shared by the staging table, the COPY stream and the merge.
+_COLUMNS = (
+    'paper_id', 'latex', 'source_env', 'position',
+    'sympy_parsed', 'normalized_form', 'structure_hash',
+    'embedding', 'equation_type',
+    'normalizer_version', 'preprocess_hash',
+)
+
+# embedding is staged as its text literal and cast on merge, so the staging
+# table doesn't need the pgvector type.
+_STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS equations_staging (
+        paper_id            INTEGER,
+        latex               TEXT,
+        source_env          TEXT,
+        position            INTEGER,
+        sympy_parsed        BOOLEAN,
+        normalized_form     TEXT,
+        structure_hash      TEXT,
+        embedding           TEXT,
+        equation_type       TEXT,
+        normalizer_version  INTEGER,
+        preprocess_hash     TEXT
+    ) ON COMMIT DELETE ROWS
+"""
+
+_SUBTREE_COLUMNS = ('paper_id', 'position', 'subtree_hash', 'nodes', 'share')
+
+_SUBTREE_STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS equation_subtrees_staging (
+        paper_id        INTEGER,
+        position        INTEGER,
+        subtree_hash    TEXT,
+        nodes           INTEGER,
+        share           REAL
+    ) ON COMMIT DELETE ROWS
+"""
+
+_SUBTREE_MERGE_SQL = """
+    INSERT INTO equation_subtrees (subtree_hash, equation_id, nodes, share)
+    SELECT s.subtree_hash, e.id, s.nodes, s.share
+    FROM equation_subtrees_staging s
+    JOIN equations e ON e.paper_id = s.paper_id AND e.position = s.position
+    ON CONFLICT DO NOTHING
+"""
+
+_MERGE_SQL = f"""
+    INSERT INTO equations ({', '.join(_COLUMNS)})
+    SELECT {', '.join('embedding::vector' if c == 'embedding' else c for c in _COLUMNS)}
+    FROM equations_staging
+    ORDER BY paper_id, position
+    ON CONFLICT (paper_id, position) DO NOTHING
+"""
+
+
+_EMBEDDING_STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS embeddings_staging (
+        paper_id    INTEGER,
+        position    INTEGER,
+        embedding   TEXT
+    ) ON COMMIT DELETE ROWS
+"""
+
+_EMBEDDING_UPDATE_SQL = """
+    UPDATE equations e SET embedding = s.embedding::vector
+    FROM embeddings_staging s
+    WHERE e.paper_id = s.paper_id AND e.position = s.position
+"""
+
+
+def subtree_rows(norm) -> List[tuple]:
+    """(subtree_hash, nodes, share) for each significant subtree of a result."""
+    if not norm.success or not norm.subtrees:
+        return []
+    return [(h, nodes, nodes / norm.structure_size) for h, nodes in norm.subtrees.items()]
+
+
+def _copy_rows(cur, table: str, columns, rows) -> None:
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_field(v) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def _sanitize(s):
+    """Postgres TEXT can't hold NUL bytes, so strip them. Other control chars
+    are kept; _copy_field escapes the ones COPY cares about."""
+    if s is None:
+        return None
+    return s.replace('\x00', '')
+
+
+def _copy_field(value) -> str:
+    """Encode one value for COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(repr(float(x)) for x in value) + ']'
+    return (_sanitize(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+@dataclass
+class _PendingPaper:
+    paper_id: int
+    rows: List[tuple] = field(default_factory=list)
+    subtrees: List[tuple] = field(default_factory=list)
+    sentinel: bool = False
+
+
+class EquationWriter:
+    """Buffers papers and writes them with COPY, several per transaction."""
+
+    def __init__(self, db: ConnectionManager, batch_papers: int = DEFAULT_BATCH_PAPERS):
+        self.db = db
+        self.batch_papers = max(1, batch_papers)
+        self._pending: List[_PendingPaper] = []
+        self.papers_written = 0
+        self.papers_failed = 0
+        self.rows_written = 0
+
+    def add(self, paper_id: int, equations: list, norms: list,
+            embeddings: Optional[List] = None) -> None:
+        """Queue a paper's equations. `norms` has one NormalizationResult per
+        equation; embeddings (if any) are only stored for unparsed equations."""
+        paper = _PendingPaper(paper_id)
+        for i, eq in enumerate(equations):
+            norm = norms[i]
+            embedding = None
+            if embeddings and i < len(embeddings) and not norm.success:
+                embedding = embeddings[i]
+            paper.rows.append((
+                paper_id,
+                eq.latex,
+                eq.source_env,
+                eq.position,
+                norm.success,
+                norm.normalized_form,
+                norm.structure_hash,
+                embedding,
+                norm.equation_type,
+                # An aborted result (timeout, memory) isn't this version's
+                # answer: leave the version unset so renormalize.py retries it.
+                None if norm.aborted else NORMALIZER_VERSION,
+                norm.preprocess_hash,
+            ))
+            paper.subtrees.extend((paper_id, eq.position) + row for row in subtree_rows(norm))
+        self._queue(paper)
+
+    def add_sentinel(self, paper_id: int) -> None:
+        """Queue the sentinel row that marks a paper processed with no equations,
+        so we don't re-download its source."""
+        self._queue(_PendingPaper(paper_id, sentinel=True))
+
+    def _queue(self, paper: _PendingPaper) -> None:
+        self._pending.append(paper)
+        if len(self._pending) >= self.batch_papers:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write everything queued. Never raises for data errors; failed papers
+        are reported and counted in papers_failed."""
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch[0], e)
+                return
+            print(f'  ! Batch write of {len(batch)} papers failed, retrying per paper: '
+                  f'{str(e)[:120]}')
+            for paper in batch:
+                try:
+                    self._write([paper])
+                except Exception as e:
+                    self._fail(paper, e)
+
+    def _write(self, batch: List[_PendingPaper]) -> None:
+        rows = [row for paper in batch for row in paper.rows]
+        self.db.run(lambda conn: self._write_rows(conn, batch, rows))
+        self.papers_written += len(batch)
+        self.rows_written += len(rows)
+
+    def _write_rows(self, conn, batch: List[_PendingPaper], rows: List[tuple]) -> None:
+        sentinels = [(paper.paper_id,) for paper in batch if paper.sentinel]
+        subtrees = [row for paper in batch for row in paper.subtrees]
+        with conn.cursor() as cur:
+            guard_equation_inserts(cur)
+            if rows:
+                cur.execute(_STAGING_DDL)
+                _copy_rows(cur, 'equations_staging', _COLUMNS, rows)
+                cur.execute(_MERGE_SQL)
+            if subtrees:
+                cur.execute(_SUBTREE_STAGING_DDL)
+                _copy_rows(cur, 'equation_subtrees_staging', _SUBTREE_COLUMNS, subtrees)
+                cur.execute(_SUBTREE_MERGE_SQL)
+            if sentinels:
+                from psycopg2.extras import execute_values
+                execute_values(cur, """
+                    INSERT INTO equations (paper_id, latex, source_env, position, sympy_parsed, equation_type)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                """, sentinels, template="(%s, '', 'none', -1, FALSE, 'none')")
+
+    def _fail(self, paper: _PendingPaper, e: Exception) -> None:
+        self.papers_failed += 1
+        print(f'  ! Store failed for paper {paper.paper_id}: {str(e)[:120]}')
+
+
+def write_embeddings(conn, rows: List[tuple]) -> int:
+    """Set equations.embedding from (paper_id, position, vector) rows.
+
+    Returns the number of equations updated.
+    """
+    if not rows:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(_EMBEDDING_STAGING_DDL)
+        _copy_rows(cur, 'embeddings_staging', ('paper_id', 'position', 'embedding'), rows)
+        cur.execute(_EMBEDDING_UPDATE_SQL)
+        return cur.rowcount
+
+
+class EmbeddingAccumulator:
+    """Collects unparsed equations across papers and embeds them in bulk.
+
+    A paper rarely has more than a handful of equations SymPy can't parse,
+    so embedding per paper never fills a model batch. Queued equations are
+    flushed once there are flush_rows of them or the oldest has waited
+    flush_seconds: the paper rows are written first (writer.flush), then the
+    strings are embedded in one request (SentenceTransformer.encode sorts
+    each request by length itself, so batches pad little) and the vectors go
+    back in one UPDATE.
+
+    An embedding failure is reported and counted, not raised: the equations
+    keep a NULL embedding, which embed_unparsed.py backfills.
+    """
+
+    def __init__(self, writer: EquationWriter, embedder,
+                 flush_rows: int = DEFAULT_EMBED_FLUSH_ROWS,
+                 flush_seconds: float = DEFAULT_EMBED_FLUSH_SECONDS):
+        self.writer = writer
+        self.embedder = embedder
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self._pending: List[tuple] = []   # (paper_id, position, latex)
+        self._oldest: Optional[float] = None
+        self.embedded = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def add(self, paper_id: int, equations: list, norms: list) -> int:
+        """Queue a paper's unparsed equations. Returns how many were queued."""
+        queued = [(paper_id, eq.position, eq.latex)
+                  for eq, norm in zip(equations, norms) if not norm.success]
+        if queued:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._pending.extend(queued)
+        if self._pending and (len(self._pending) >= self.flush_rows
+                              or time.monotonic() - self._oldest >= self.flush_seconds):
+            self.flush()
+        return len(queued)
+
+    def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        self._oldest = None
+        if not batch:
+            return
+        self.writer.flush()
+        try:
+            vectors = self.embedder.embed([latex for _, _, latex in batch])
+            rows = [(paper_id, position, vector)
+                    for (paper_id, position, _), vector in zip(batch, vectors)]
+            self.writer.db.run(lambda conn: write_embeddings(conn, rows))
+        except Exception as e:
+            self.failed += len(batch)
+            print(f'  ! Embedding {len(batch)} equations failed: {str(e)[:120]}')
+            return
+        self.embedded += len(batch)
+        self.flushes += 1
+
+    def summary(self) -> str:
+        text = f'{self.embedded} embedded in {self.flushes} flushes'
+        if self.failed:
+            text += f', {self.failed} failed'
+        return text
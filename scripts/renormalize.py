@@ -7,22 +7,71 @@ without having to re-download arXiv source for every paper. Also deletes
 equations that look like PostScript garbage (retroactive fix for papers
 processed before the extractor was tightened).
 
-Uses reconnect-safe phased execution: the DB connection is closed during the
-local compute phase (which can take several minutes on a large corpus) so
-Neon's SSL connection doesn't time out mid-job. Each write phase opens a
-fresh connection.
+Equations are streamed in keyset order (id > last id, --chunk-size rows at a
+time): each chunk is loaded, normalized, written with execute_values and
+checkpointed before the next one is read, so memory stays bounded by the
+chunk size rather than the corpus. Connections come from a pooled
+ConnectionManager: nothing is held open while a chunk is being normalized,
+an idle connection is health-checked before reuse, and a chunk write that
+hits a dropped socket is replayed on a fresh connection (every write here is
+idempotent), so Neon's idle SSL disconnect never costs a run.
+
+After a crash, --resume continues after the last checkpointed id. (In the
+default incremental mode re-running without --resume is also safe — written
+rows already carry the current version — it just re-scans from the start.)
+
+By default only stale rows are touched: each row records the
+NORMALIZER_VERSION that produced it, and only rows from an older version are
+loaded. Of those, rows normalized at or after CANONICALIZER_VERSION whose
+preprocessed LaTeX is unchanged (same preprocess_hash) just get their version
+bumped — SymPy isn't run. Matches are then delta-updated: exact matches that
+no longer hold are deleted and only the structure hashes that gained members
+are re-joined. --full restores the old behaviour (every row, and a full
+equation_matches rebuild).
+
+Every renormalized row's equation_subtrees entries are replaced along with
+its hash. With --near-structural, near_structural matches are kept up to
+date the same way (stale ones deleted, the rewritten rows re-matched).
+
+Normalization fans out across a process pool (one worker per CPU by
+default), so a full-corpus renormalize scales with cores. With --norm-cache
+(or ANALOG_QUEST_NORM_CACHE) results persist across runs keyed by
+NORMALIZER_VERSION, so re-running after an unrelated change skips SymPy.
 
 Usage:
-    python3 scripts/renormalize.py [--dry-run] [--limit N]
+    python3 scripts/renormalize.py [--dry-run] [--full] [--limit N] [--workers N]
+                                   [--chunk-size N] [--resume] [--checkpoint PATH]
+                                   [--near-structural]
 """
 
 from __future__ import annotations
 
 import argparse
+import json
+import os
 import sys
-
-from pipeline.config import get_connection
-from pipeline.normalize import normalize_latex
+import tempfile
+from collections import Counter
+from typing import List, Tuple
+
+from pipeline.config import ConnectionManager
+from pipeline.match import (
+    delete_stale_exact_matches,
+    delete_stale_near_matches,
+    find_exact_matches,
+    find_near_structural_matches,
+    get_match_stats,
+)
+from pipeline.normalize import (
+    CANONICALIZER_VERSION,
+    DEFAULT_MAX_RSS_MB,
+    DEFAULT_TIMEOUT,
+    NORMALIZER_VERSION,
+    preprocess_fingerprint,
+)
+from pipeline.normalize_pool import NormalizerPool
+from pipeline.normcache import get_normalization_cache
+from pipeline.store import subtree_rows
 
 
 # Same garbage patterns the extractor now filters on. Retroactive cleanup.
@@ -33,130 +82,335 @@ GARBAGE_SUBSTRINGS = [
 ]
 
 
-def is_garbage(latex: str) -> bool:
-    return any(pat in latex for pat in GARBAGE_SUBSTRINGS)
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_CHECKPOINT = os.path.join(os.path.expanduser('~'), '.cache', 'analog-quest',
+                                  'renormalize.checkpoint.json')
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--dry-run', action='store_true')
-    parser.add_argument('--limit', type=int, default=None)
-    args = parser.parse_args()
+def is_garbage(latex: str) -> bool:
+    return any(pat in latex for pat in GARBAGE_SUBSTRINGS)
 
-    # ── Phase 1: Delete garbage rows and load equations (short-lived conn) ──
-    print('Phase 1: Deleting garbage rows and loading equations...')
-    conn = get_connection()
 
+# ─── Checkpointing ───────────────────────────────────────────────────────────
+
+def _read_checkpoint(path: str, full: bool) -> int:
+    """Last committed id from a previous run of the same kind, else 0."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if data.get('normalizer_version') != NORMALIZER_VERSION or data.get('full') != full:
+        print(f'  Checkpoint {path} is from a different run '
+              f'(version {data.get("normalizer_version")}, full={data.get("full")}); ignoring')
+        return 0
+    return int(data.get('last_id', 0))
+
+
+def _write_checkpoint(path: str, full: bool, last_id: int) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'normalizer_version': NORMALIZER_VERSION, 'full': full,
+                   'last_id': last_id}, f)
+    os.replace(tmp, path)
+
+
+def _clear_checkpoint(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+# ─── Chunk load / write ──────────────────────────────────────────────────────
+
+def _load_chunk(conn, after_id: int, size: int, full: bool) -> List[Tuple]:
+    """Next `size` equations with id > after_id (keyset pagination)."""
+    query = """
+        SELECT id, latex, structure_hash, normalizer_version, preprocess_hash
+        FROM equations WHERE latex != '' AND id > %s
+    """
+    params = [after_id]
+    if not full:
+        query += ' AND normalizer_version IS DISTINCT FROM %s'
+        params.append(NORMALIZER_VERSION)
+    query += ' ORDER BY id LIMIT %s'
+    params.append(size)
     with conn.cursor() as cur:
-        garbage_clauses = " OR ".join(["latex LIKE %s"] * len(GARBAGE_SUBSTRINGS))
-        garbage_params = [f'%{p}%' for p in GARBAGE_SUBSTRINGS]
-        cur.execute(f"SELECT COUNT(*) FROM equations WHERE {garbage_clauses}", garbage_params)
-        garbage_count = cur.fetchone()[0]
-        print(f'  Found {garbage_count} garbage rows')
-
-        if not args.dry_run and garbage_count > 0:
-            cur.execute(f"DELETE FROM equations WHERE {garbage_clauses}", garbage_params)
-            print(f'  Deleted {cur.rowcount} rows')
-    if not args.dry_run:
-        conn.commit()
+        cur.execute(query, params)
+        return cur.fetchall()
 
-    with conn.cursor() as cur:
-        query = "SELECT id, latex FROM equations WHERE latex != '' ORDER BY id"
-        if args.limit:
-            query += f' LIMIT {int(args.limit)}'
-        cur.execute(query)
-        rows = cur.fetchall()
-
-    conn.close()
-    print(f'  Loaded {len(rows)} equations. Disconnected during compute phase.\n')
-
-    # ── Phase 2: Compute normalizations locally (no DB connection) ──
-    print('Phase 2: Normalizing (local, no DB connection)...')
-
-    updates_parsed = []    # (id, normalized_form, structure_hash, equation_type)
-    updates_failed = []    # (id,)
-    updated_rejected = 0
-    updated_already_failed = 0
-
-    for i, (eq_id, latex) in enumerate(rows):
-        norm = normalize_latex(latex)
-        if norm.success:
-            updates_parsed.append((eq_id, norm.normalized_form,
-                                   norm.structure_hash, norm.equation_type))
-        else:
-            updates_failed.append((eq_id,))
-            if norm.error and 'Degenerate' in norm.error:
-                updated_rejected += 1
-            else:
-                updated_already_failed += 1
-        if (i + 1) % 2000 == 0:
-            print(f'  Normalized {i+1}/{len(rows)}...')
-
-    print(f'  Local compute done: {len(updates_parsed)} parsed, '
-          f'{len(updates_failed)} failed ({updated_rejected} rejected as degenerate)')
 
-    if args.dry_run:
-        print('\n[dry-run] skipping DB writes and match rebuild')
-        print(f'\nDone.')
-        print(f'  Successfully parsed: {len(updates_parsed)}')
-        print(f'  Rejected (degenerate): {updated_rejected}')
-        print(f'  Failed to parse:     {updated_already_failed}')
-        print(f'  Garbage found:       {garbage_count}')
-        return
+def _write_chunk(conn, updates_parsed, updates_failed, updates_version,
+                 normalized_ids, subtrees) -> None:
+    """Write one chunk's results. The caller commits (see _apply_chunk).
 
-    # ── Phase 3: Write results with fresh connection ──
-    print('\nPhase 3: Writing updates (fresh connection)...')
+    normalized_ids are the rows SymPy re-ran on; their equation_subtrees
+    entries are replaced by `subtrees` (subtree_hash, equation_id, nodes, share).
+    """
     from psycopg2.extras import execute_values
 
-    conn = get_connection()
     with conn.cursor() as cur:
+        if normalized_ids:
+            cur.execute('DELETE FROM equation_subtrees WHERE equation_id = ANY(%s)',
+                        (list(normalized_ids),))
         execute_values(cur, """
+            INSERT INTO equation_subtrees (subtree_hash, equation_id, nodes, share)
+            VALUES %s
+            ON CONFLICT DO NOTHING
+        """, subtrees, page_size=1000)
+        execute_values(cur, f"""
             UPDATE equations AS e SET
                 sympy_parsed = TRUE,
                 normalized_form = v.form,
                 structure_hash = v.hash,
-                equation_type = v.eqtype
-            FROM (VALUES %s) AS v(id, form, hash, eqtype)
+                equation_type = v.eqtype,
+                normalizer_version = {NORMALIZER_VERSION},
+                preprocess_hash = v.phash
+            FROM (VALUES %s) AS v(id, form, hash, eqtype, phash)
             WHERE e.id = v.id
-        """, updates_parsed, template='(%s, %s, %s, %s)', page_size=1000)
-    conn.commit()
-    print(f'  Wrote {len(updates_parsed)} parsed rows')
-
-    with conn.cursor() as cur:
-        execute_values(cur, """
+        """, updates_parsed, template='(%s, %s, %s, %s, %s)', page_size=1000)
+        execute_values(cur, f"""
             UPDATE equations AS e SET
                 sympy_parsed = FALSE,
                 normalized_form = NULL,
-                structure_hash = NULL
+                structure_hash = NULL,
+                normalizer_version = {NORMALIZER_VERSION},
+                preprocess_hash = v.phash
+            FROM (VALUES %s) AS v(id, phash)
+            WHERE e.id = v.id
+        """, updates_failed, template='(%s, %s)', page_size=1000)
+        execute_values(cur, f"""
+            UPDATE equations AS e SET normalizer_version = {NORMALIZER_VERSION}
             FROM (VALUES %s) AS v(id)
             WHERE e.id = v.id
-        """, updates_failed, template='(%s)', page_size=1000)
-    conn.commit()
-    print(f'  Wrote {len(updates_failed)} failed rows')
+        """, updates_version, template='(%s)', page_size=1000)
+
+
+def _apply_chunk(conn, updates_parsed, updates_failed, updates_version, normalized_ids,
+                 subtrees, changed_ids, touched_hashes, near_structural) -> Tuple[int, int]:
+    """Write one chunk and its match delta without committing.
+
+    Run under ConnectionManager.run, which commits once at the end: the rows'
+    new version stamp and their match delta land together or not at all, so
+    a crash never leaves rows marked current with stale matches behind them.
+    Returns (matches removed, matches added).
+    """
+    _write_chunk(conn, updates_parsed, updates_failed, updates_version,
+                 normalized_ids, subtrees)
+    if touched_hashes is None:
+        return 0, 0
+    # Only hashes whose membership changed can gain or lose pairs.
+    removed = delete_stale_exact_matches(conn, changed_ids, commit=False)
+    added = find_exact_matches(conn, hashes=touched_hashes, commit=False)
+    if near_structural:
+        removed += delete_stale_near_matches(conn, normalized_ids, commit=False)
+        added += find_near_structural_matches(conn, equation_ids=normalized_ids, commit=False)
+    return removed, added
 
-    # ── Phase 4: Rebuild match table ──
-    print('\nPhase 4: Clearing and rebuilding matches...')
-    with conn.cursor() as cur:
-        cur.execute('DELETE FROM equation_matches')
-    conn.commit()
 
-    from pipeline.match import find_exact_matches, get_match_stats
-    n = find_exact_matches(conn)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--full', action='store_true',
+                        help='Renormalize every row and rebuild all matches, '
+                             'not just rows from an older NORMALIZER_VERSION')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Rows loaded, normalized and written per chunk '
+                             f'(default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue after the last checkpointed id')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help=f'Checkpoint file (default: {DEFAULT_CHECKPOINT})')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Normalizer processes (default: one per CPU; 1 = in-process)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f'Per-equation normalization time budget in seconds '
+                             f'(default: {DEFAULT_TIMEOUT:g}; 0 = unbounded)')
+    parser.add_argument('--max-rss-mb', type=float, default=DEFAULT_MAX_RSS_MB,
+                        help=f'Per-equation memory growth budget in MB '
+                             f'(default: {DEFAULT_MAX_RSS_MB}; 0 = unbounded)')
+    parser.add_argument('--norm-cache', default=None,
+                        help='SQLite file for cross-run normalization caching '
+                             '(default: $ANALOG_QUEST_NORM_CACHE, else memory only)')
+    parser.add_argument('--near-structural', action='store_true',
+                        help='Also update near_structural (shared-subtree) matches')
+    args = parser.parse_args()
+    chunk_size = max(1, args.chunk_size)
+
+    db = ConnectionManager(maxconn=1)
+
+    # ── Phase 1: Delete garbage rows ──
+    print('Phase 1: Deleting garbage rows...')
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            garbage_clauses = " OR ".join(["latex LIKE %s"] * len(GARBAGE_SUBSTRINGS))
+            garbage_params = [f'%{p}%' for p in GARBAGE_SUBSTRINGS]
+            cur.execute(f"SELECT COUNT(*) FROM equations WHERE {garbage_clauses}", garbage_params)
+            garbage_count = cur.fetchone()[0]
+            print(f'  Found {garbage_count} garbage rows')
+
+            if not args.dry_run and garbage_count > 0:
+                cur.execute(f"DELETE FROM equations WHERE {garbage_clauses}", garbage_params)
+                print(f'  Deleted {cur.rowcount} rows')
+        if not args.dry_run:
+            conn.commit()
+
+    after_id = _read_checkpoint(args.checkpoint, args.full) if args.resume else 0
+    if after_id:
+        print(f'  Resuming after id {after_id}')
+
+    # ── Phase 2: Stream chunks: load → normalize → write ──
+    scope = 'all equations' if args.full else f'equations older than version {NORMALIZER_VERSION}'
+    print(f'\nPhase 2: Renormalizing {scope} in chunks of {chunk_size}...')
+    norm_cache = get_normalization_cache(args.norm_cache)
+    pool = NormalizerPool(args.workers, timeout=args.timeout, max_rss_mb=args.max_rss_mb,
+                          cache=norm_cache)
+    print(f'  Using {pool.workers} worker process(es)')
+
+    totals = Counter()
+    remaining = args.limit
+
+    def next_chunk():
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        if size <= 0:
+            return []
+        return db.run(lambda conn: _load_chunk(conn, after_id, size, args.full))
+
+    def write_chunk(conn):
+        normalized_ids = [eq_id for eq_id, _latex, _old_hash in to_normalize]
+        # Delta-updating matches in the chunk's own transaction keeps every
+        # committed chunk consistent, so a resumed run has nothing to catch up
+        # on. Vacated hashes are re-run too: their buckets shrink, and a hub
+        # that lost its representative in a domain needs a new one.
+        touched = None if args.full else sorted(affected_hashes | vacated_hashes)
+        return _apply_chunk(conn, updates_parsed, updates_failed, updates_version,
+                            normalized_ids, subtrees, changed_ids, touched,
+                            args.near_structural)
+
+    rows = next_chunk()
+
+    with pool:
+        while rows:
+            # Rows whose preprocessing output is unchanged and whose version
+            # already has the current canonicalizer would normalize to exactly
+            # what's stored.
+            to_normalize = []      # (id, latex, old_hash)
+            updates_version = []   # (id,)
+            for eq_id, latex, old_hash, version, old_phash in rows:
+                if (not args.full and version is not None and version >= CANONICALIZER_VERSION
+                        and old_phash is not None and preprocess_fingerprint(latex) == old_phash):
+                    updates_version.append((eq_id,))
+                else:
+                    to_normalize.append((eq_id, latex, old_hash))
+
+            updates_parsed = []    # (id, normalized_form, structure_hash, equation_type, preprocess_hash)
+            updates_failed = []    # (id, preprocess_hash)
+            changed_ids = []       # rows whose structure_hash changed
+            affected_hashes = set()  # hashes that gained a member
+            vacated_hashes = set()   # hashes that lost one
+            subtrees = []          # (subtree_hash, id, nodes, share)
+
+            norms = pool.map(latex for _eq_id, latex, _old_hash in to_normalize)
+            for (eq_id, _latex, old_hash), norm in zip(to_normalize, norms):
+                if norm.aborted:
+                    # A timeout or memory abort says nothing about the row:
+                    # leave it as stored, unstamped, so the next run retries it.
+                    totals['aborted'] += 1
+                    continue
+                if norm.success:
+                    updates_parsed.append((eq_id, norm.normalized_form, norm.structure_hash,
+                                           norm.equation_type, norm.preprocess_hash))
+                    subtrees.extend((h, eq_id, nodes, share)
+                                    for h, nodes, share in subtree_rows(norm))
+                else:
+                    updates_failed.append((eq_id, norm.preprocess_hash))
+                    if norm.error and 'Degenerate' in norm.error:
+                        totals['rejected'] += 1
+                    else:
+                        totals['failed'] += 1
+                new_hash = norm.structure_hash if norm.success else None
+                if new_hash != old_hash:
+                    changed_ids.append(eq_id)
+                    if new_hash is not None:
+                        affected_hashes.add(new_hash)
+                    if old_hash is not None:
+                        vacated_hashes.add(old_hash)
+
+            totals['rows'] += len(rows)
+            totals['parsed'] += len(updates_parsed)
+            totals['version_only'] += len(updates_version)
+            totals['changed'] += len(changed_ids)
+            after_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+            if not args.dry_run:
+                removed, added = db.run(write_chunk)
+                totals['matches_removed'] += removed
+                totals['matches_new'] += added
+                _write_checkpoint(args.checkpoint, args.full, after_id)
+            print(f'  Through id {after_id}: {totals["rows"]} rows '
+                  f'({totals["parsed"]} parsed, {totals["version_only"]} version bump only, '
+                  f'{totals["changed"]} hash changed)')
+
+            rows = next_chunk()
+
+    print(f'  Outliers: {pool.stats.summary()}')
+    print(f'  Cache:    {norm_cache.summary()}')
+    norm_cache.close()
+
+    if args.dry_run:
+        print('\n[dry-run] skipped DB writes and match updates')
+        print(f'\nDone.')
+        print(f'  Successfully parsed: {totals["parsed"]}')
+        print(f'  Rejected (degenerate): {totals["rejected"]}')
+        print(f'  Failed to parse:     {totals["failed"]}')
+        print(f'  Aborted (left as is): {totals["aborted"]}')
+        print(f'  Version bump only:   {totals["version_only"]}')
+        print(f'  Hash changed:        {totals["changed"]}')
+        print(f'  Garbage found:       {garbage_count}')
+        db.close()
+        return
+
+    # ── Phase 3: Matches ──
+    if args.full:
+        print('\nPhase 3: Clearing and rebuilding matches...')
+
+        def rebuild(conn):
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM equation_matches')
+            # One transaction: a crash mid-rebuild leaves the old matches.
+            n = find_exact_matches(conn, full=True, commit=False)
+            if args.near_structural:
+                n += find_near_structural_matches(conn, full=True, commit=False)
+            return n
+
+        n = db.run(rebuild)
+    else:
+        print('\nPhase 3: Matches were delta-updated per chunk')
+        print(f'  Removed {totals["matches_removed"]} matches that no longer hold')
+        n = totals['matches_new']
     print(f'  Cross-domain structural matches: {n}')
+    _clear_checkpoint(args.checkpoint)
 
-    stats = get_match_stats(conn)
+    stats = db.run(get_match_stats)
     if stats.get('top_domain_pairs'):
         print(f'\nTop cross-domain pairs:')
         for d1, d2, c in stats.get('top_domain_pairs', [])[:10]:
             print(f'  {d1:12s} <-> {d2:12s}: {c}')
 
-    conn.close()
+    db.close()
 
     # ── Summary ──
     print(f'\nDone.')
-    print(f'  Successfully parsed: {len(updates_parsed)}')
-    print(f'  Rejected (degenerate): {updated_rejected}')
-    print(f'  Failed to parse:     {updated_already_failed}')
+    print(f'  Successfully parsed: {totals["parsed"]}')
+    print(f'  Rejected (degenerate): {totals["rejected"]}')
+    print(f'  Failed to parse:     {totals["failed"]}')
+    print(f'  Aborted (left as is): {totals["aborted"]}')
+    print(f'  Version bump only:   {totals["version_only"]}')
     print(f'  Garbage deleted:     {garbage_count}')
     print(f'  New matches:         {n}')
 
@@ -4,13 +4,22 @@ run_pipeline.py — Run the Analog Quest equation extraction and matching pipeli
 
 Usage:
     python3 scripts/run_pipeline.py [--limit N] [--skip-embed] [--skip-match] [--dry-run]
+                                    [--near-structural] [--full-match]
 
 Stages:
     1. Fetch papers from DB that haven't been processed yet
-    2. For each paper: download arXiv LaTeX source, extract equations
+    2. For each paper: download arXiv LaTeX source, extract equations.
+       Downloads run ahead on a background thread at arXiv's rate limit, so
+       stages 2-4 for one paper overlap the fetch of the next ones.
     3. Normalize via SymPy (exact structural matching)
     4. Embed via sentence-transformers (approximate matching fallback)
-    5. Find cross-domain matches
+       Results are written with COPY, --write-batch papers per transaction
+       (see pipeline/store.py). Unparsed equations are embedded across
+       papers in full batches and their vectors filled in with a bulk UPDATE.
+    5. Find cross-domain matches (exact, embedding; near-structural — shared
+       subtrees — with --near-structural). Structural matching only joins
+       equations added since the last run (pipeline/match.py watermarks);
+       --full-match re-joins everything.
     6. Report results
 
 Requires:
@@ -19,20 +28,31 @@ Requires:
 
 Environment:
     POSTGRES_URL — Neon connection string (or set in .env.local)
+    ANALOG_QUEST_EMBED_MATCHER — sql (default) | numpy | hnswlib | faiss:
+        how embedding matches are searched (see pipeline/match.py)
 """
 
 from __future__ import annotations
 
 import argparse
+import re
 import sys
-import time
 from typing import Dict, List, Optional
 
-from pipeline.config import get_connection, load_env
-from pipeline.extract import extract_paper, ARXIV_DELAY
-from pipeline.normalize import normalize_latex
-from pipeline.embed import embed_equations_batch
-from pipeline.match import find_exact_matches, find_embedding_matches, get_match_stats
+from pipeline.config import ConnectionManager, StatementTimer, load_env
+from pipeline.extract import extract_from_source, iter_sources
+from pipeline.normalize import DEFAULT_MAX_RSS_MB, DEFAULT_TIMEOUT
+from pipeline.normalize_pool import NormalizerPool
+from pipeline.normcache import get_normalization_cache
+from pipeline.embed import EMBED_BACKEND, EmbeddingWorker, embedder_available, model_id
+from pipeline.embedcache import get_embedding_cache
+from pipeline.match import (
+    find_embedding_matches,
+    find_exact_matches,
+    find_near_structural_matches,
+    get_match_stats,
+)
+from pipeline.store import DEFAULT_BATCH_PAPERS, EmbeddingAccumulator, EquationWriter
 
 
 def ensure_schema(conn):
@@ -43,8 +63,10 @@ def ensure_schema(conn):
         sql = f.read()
 
     with conn.cursor() as cur:
-        # Split on semicolons and execute each statement
+        # Drop -- comments (a semicolon in one would split a statement), then
+        # split on semicolons and execute each statement
         # Skip CREATE INDEX that might fail on empty tables for ivfflat
+        sql = re.sub(r'--[^\n]*', '', sql)
         statements = [s.strip() for s in sql.split(';') if s.strip()]
         for stmt in statements:
             # ivfflat index needs rows to exist; skip it on first run
@@ -79,64 +101,6 @@ def get_unprocessed_papers(conn, limit: Optional[int] = None) -> List[dict]:
                 for r in cur.fetchall()]
 
 
-def _sanitize(s):
-    """Postgres TEXT can't hold NUL bytes. Strip them and any other control chars."""
-    if s is None:
-        return None
-    return s.replace('\x00', '')
-
-
-def store_equations(conn, paper_id: int, equations: list, norms: list,
-                    embeddings: Optional[List] = None):
-    """Write extracted equations to the DB. Commits per-paper so one failure
-    doesn't lose prior work. `norms` is the list of pre-computed NormalizationResults
-    (one per equation). Returns (success, conn) — conn may be a new connection
-    if the old one died."""
-    try:
-        with conn.cursor() as cur:
-            for i, eq in enumerate(equations):
-                norm = norms[i]
-                embedding = None
-                if embeddings and i < len(embeddings) and not norm.success:
-                    embedding = embeddings[i]
-
-                cur.execute("""
-                    INSERT INTO equations
-                        (paper_id, latex, source_env, position,
-                         sympy_parsed, normalized_form, structure_hash,
-                         embedding, equation_type)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    paper_id,
-                    _sanitize(eq.latex),
-                    eq.source_env,
-                    eq.position,
-                    norm.success,
-                    _sanitize(norm.normalized_form),
-                    norm.structure_hash,
-                    embedding,
-                    norm.equation_type,
-                ))
-        conn.commit()
-        return True, conn
-    except Exception as e:
-        # Try to rollback the old connection; if it's dead, reconnect
-        import psycopg2
-        err_msg = str(e)[:120]
-        try:
-            conn.rollback()
-        except psycopg2.InterfaceError:
-            # Connection is gone — reconnect
-            print(f'  ! Connection lost, reconnecting...')
-            try:
-                conn.close()
-            except Exception:
-                pass
-            conn = get_connection()
-        print(f'  ! Store failed for paper {paper_id}: {err_msg}')
-        return False, conn
-
-
 def main():
     parser = argparse.ArgumentParser(description='Analog Quest equation pipeline')
     parser.add_argument('--limit', type=int, default=None,
@@ -145,36 +109,70 @@ def main():
                         help='Skip embedding generation')
     parser.add_argument('--skip-match', action='store_true',
                         help='Skip matching stage')
+    parser.add_argument('--near-structural', action='store_true',
+                        help='Also match equations that share a large subtree')
+    parser.add_argument('--full-match', action='store_true',
+                        help='Re-join all equations instead of only those added since the last match')
     parser.add_argument('--dry-run', action='store_true',
                         help='Extract and normalize but don\'t write to DB')
+    parser.add_argument('--prefetch', type=int, default=4,
+                        help='Max papers downloaded ahead of processing (default: 4)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Normalizer processes (default: one per CPU; 1 = in-process)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f'Per-equation normalization time budget in seconds '
+                             f'(default: {DEFAULT_TIMEOUT:g}; 0 = unbounded)')
+    parser.add_argument('--max-rss-mb', type=float, default=DEFAULT_MAX_RSS_MB,
+                        help=f'Per-equation memory growth budget in MB '
+                             f'(default: {DEFAULT_MAX_RSS_MB}; 0 = unbounded)')
+    parser.add_argument('--norm-cache', default=None,
+                        help='SQLite file for cross-run normalization caching '
+                             '(default: $ANALOG_QUEST_NORM_CACHE, else memory only)')
+    parser.add_argument('--embed-cache', default=None,
+                        help='SQLite file for cross-run embedding caching '
+                             '(default: $ANALOG_QUEST_EMBED_CACHE, else memory only)')
+    parser.add_argument('--write-batch', type=int, default=DEFAULT_BATCH_PAPERS,
+                        help=f'Papers written per DB transaction (default: {DEFAULT_BATCH_PAPERS})')
+    parser.add_argument('--slow-sql-ms', type=float, default=None,
+                        help='Print any SQL statement slower than this many milliseconds')
     args = parser.parse_args()
 
     load_env()
-    conn = get_connection()
-    print('Connected to database.\n')
-
-    # Stage 0: Ensure schema
-    print('Ensuring equations schema...')
-    ensure_schema(conn)
-
-    # Stage 1: Get unprocessed papers
-    papers = get_unprocessed_papers(conn, args.limit)
-    print(f'Found {len(papers)} unprocessed papers.\n')
+    # Pooled, health-checked connections: a socket Neon dropped while we were
+    # busy normalizing is replaced on next use instead of failing a write.
+    db = ConnectionManager()
+    sql_timer = db.add_hook(StatementTimer(slow_ms=args.slow_sql_ms))
+
+    with db.connection() as conn:
+        print('Connected to database.\n')
+
+        # Stage 0: Ensure schema
+        print('Ensuring equations schema...')
+        ensure_schema(conn)
+
+        # Stage 1: Get unprocessed papers
+        papers = get_unprocessed_papers(conn, args.limit)
+        print(f'Found {len(papers)} unprocessed papers.\n')
+
+        if not papers:
+            print('Nothing to process.')
+            if not args.skip_match:
+                print('\nRunning matcher on existing data...')
+                exact = find_exact_matches(conn, full=args.full_match)
+                print(f'  New exact structural matches: {exact}')
+                if args.near_structural:
+                    near = find_near_structural_matches(conn, full=args.full_match)
+                    print(f'  New near-structural matches: {near}')
+                try:
+                    emb = find_embedding_matches(conn)
+                    print(f'  New embedding matches: {emb}')
+                except Exception as e:
+                    print(f'  Embedding matching skipped: {e}')
+                stats = get_match_stats(conn)
+                _print_match_stats(stats)
 
     if not papers:
-        print('Nothing to process.')
-        if not args.skip_match:
-            print('\nRunning matcher on existing data...')
-            exact = find_exact_matches(conn)
-            print(f'  New exact structural matches: {exact}')
-            try:
-                emb = find_embedding_matches(conn)
-                print(f'  New embedding matches: {emb}')
-            except Exception as e:
-                print(f'  Embedding matching skipped: {e}')
-            stats = get_match_stats(conn)
-            _print_match_stats(stats)
-        conn.close()
+        db.close()
         return
 
     # Stage 2-4: Extract, normalize, embed
@@ -186,67 +184,82 @@ def main():
     # Check if embedding is available
     has_embedder = False
     if not args.skip_embed:
-        try:
-            from sentence_transformers import SentenceTransformer
+        if embedder_available():
             has_embedder = True
-            print('Sentence-transformers available — will generate embeddings.\n')
-        except ImportError:
-            print('sentence-transformers not installed — skipping embeddings.')
-            print('  Install with: pip install sentence-transformers\n')
-
-    for i, paper in enumerate(papers):
-        arxiv_id = paper['arxiv_id']
+            print(f'Sentence-transformers available ({model_id()}) — will generate embeddings.\n')
+        else:
+            extra = '' if EMBED_BACKEND == 'torch' else '[onnx]'
+            print(f'sentence-transformers{extra} not installed — skipping embeddings.')
+            print(f'  Install with: pip install "sentence-transformers{extra}"\n')
+
+    # Start the normalizer processes before the embedder and fetcher threads
+    # so they fork from a single-threaded parent (start() checks this).
+    norm_cache = get_normalization_cache(args.norm_cache)
+    norm_pool = NormalizerPool(args.workers, timeout=args.timeout,
+                               max_rss_mb=args.max_rss_mb, cache=norm_cache).start()
+
+    # The model loads once, on the embedder thread, while the first sources
+    # are still downloading.
+    embed_cache = None
+    embedder = None
+    if has_embedder and not args.dry_run:
+        embed_cache = get_embedding_cache(model_id(), args.embed_cache, db=db)
+        embedder = EmbeddingWorker(cache=embed_cache).start()
+
+    # Sources are fetched and extracted ahead on a background thread
+    # (rate-limited inside fetch_latex_source), so there's no sleep in this
+    # loop: the next paper's download and extraction overlap this paper's
+    # normalization (in the worker processes) and storage.
+    # Equations are buffered and COPYed in a few papers per transaction.
+    # Unparsed equations are embedded across papers, in full batches, and
+    # their vectors written back in bulk (see pipeline/store.py).
+    writer = None if args.dry_run else EquationWriter(db, batch_papers=args.write_batch)
+    pending_embeddings = EmbeddingAccumulator(writer, embedder) if embedder is not None else None
+
+    extractions = iter_sources((p['arxiv_id'] for p in papers), prefetch=args.prefetch,
+                               transform=extract_from_source)
+    for i, (paper, (arxiv_id, result)) in enumerate(zip(papers, extractions)):
         print(f'[{i+1}/{len(papers)}] {arxiv_id} — {paper["title"][:60]}...')
 
-        result = extract_paper(arxiv_id)
-
         if not result.source_available:
             print(f'  ✗ No LaTeX source available')
             total_failed_source += 1
             # Still mark as processed (with 0 equations) so we don't retry
             if not args.dry_run:
-                conn = _mark_paper_processed(conn, paper['id'])
-            if i < len(papers) - 1:
-                time.sleep(ARXIV_DELAY)
+                writer.add_sentinel(paper['id'])
             continue
 
         n_eq = len(result.equations)
         if n_eq == 0:
             print(f'  → 0 equations found')
             if not args.dry_run:
-                conn = _mark_paper_processed(conn, paper['id'])
-            if i < len(papers) - 1:
-                time.sleep(ARXIV_DELAY)
+                writer.add_sentinel(paper['id'])
             continue
 
-        # Normalize all equations once, cache results
-        norms = [normalize_latex(eq.latex) for eq in result.equations]
+        # Normalize all equations once (across the worker pool), cache results
+        norms = norm_pool.map(eq.latex for eq in result.equations)
         parsed_count = sum(1 for n in norms if n.success)
 
-        # Embed equations SymPy couldn't parse
-        embeddings = None
-        if has_embedder and not args.dry_run:
-            unparsed_indices = [i for i, n in enumerate(norms) if not n.success]
-            if unparsed_indices:
-                unparsed_latex = [result.equations[i].latex for i in unparsed_indices]
-                emb_list = embed_equations_batch(unparsed_latex)
-                if emb_list:
-                    embeddings = [None] * len(result.equations)
-                    for idx, emb in zip(unparsed_indices, emb_list):
-                        embeddings[idx] = emb
-
         print(f'  → {n_eq} equations, {parsed_count} SymPy-parsed ({n_eq - parsed_count} embedded)')
 
         if not args.dry_run:
-            _, conn = store_equations(conn, paper['id'], result.equations, norms, embeddings)
+            writer.add(paper['id'], result.equations, norms)
+            # Equations SymPy couldn't parse get an embedding later, in bulk.
+            if pending_embeddings is not None:
+                pending_embeddings.add(paper['id'], result.equations, norms)
 
         total_equations += n_eq
         total_parsed += parsed_count
         total_papers_with_equations += 1
 
-        # Rate limit
-        if i < len(papers) - 1:
-            time.sleep(ARXIV_DELAY)
+    norm_pool.close()
+    norm_cache.close()
+    if writer is not None:
+        writer.flush()
+    if pending_embeddings is not None:
+        pending_embeddings.flush()
+        embedder.close()
+        embed_cache.close()
 
     # Summary
     print(f'\n{"="*60}')
@@ -257,73 +270,68 @@ def main():
     print(f'  Total equations:        {total_equations}')
     print(f'  SymPy parsed:           {total_parsed} ({_pct(total_parsed, total_equations)})')
     print(f'  Embedded (fallback):    {total_equations - total_parsed}')
+    print(f'  Normalizer outliers:    {norm_pool.stats.summary()}')
+    print(f'  Normalization cache:    {norm_cache.summary()}')
+    if not args.dry_run:
+        print(f'  Papers written:         {writer.papers_written} '
+              f'({writer.rows_written} rows, {writer.papers_failed} failed)')
+    if pending_embeddings is not None:
+        print(f'  Embeddings:             {pending_embeddings.summary()}')
+        print(f'  Embedding cache:        {embed_cache.summary()}')
 
     # Stage 5: Match
     if not args.skip_match and not args.dry_run:
-        print(f'\n{"="*60}')
-        print('Running cross-domain matching...')
+        with db.connection() as conn:
+            _run_matching(conn, has_embedder, args.near_structural, args.full_match)
 
-        exact = find_exact_matches(conn)
-        print(f'  New exact structural matches: {exact}')
+    print(f'  DB time: {sql_timer.summary()}; {db.reconnects} reconnects')
+    db.close()
+    print('\nDone.')
 
-        if has_embedder:
-            try:
-                # Need at least 100 rows for ivfflat index; use sequential scan otherwise
-                with conn.cursor() as cur:
-                    cur.execute("SELECT COUNT(*) FROM equations WHERE embedding IS NOT NULL")
-                    emb_count = cur.fetchone()[0]
-
-                if emb_count > 0:
-                    # Create ivfflat index if we have enough data
-                    if emb_count >= 100:
-                        try:
-                            with conn.cursor() as cur:
-                                cur.execute("""
-                                    CREATE INDEX IF NOT EXISTS idx_equations_embedding
-                                    ON equations USING ivfflat (embedding vector_cosine_ops)
-                                    WITH (lists = 100)
-                                """)
-                            conn.commit()
-                        except Exception:
-                            conn.rollback()
-
-                    emb_matches = find_embedding_matches(conn)
-                    print(f'  New embedding matches: {emb_matches}')
-            except Exception as e:
-                print(f'  Embedding matching skipped: {e}')
-        else:
-            print('  Embedding matching skipped (no sentence-transformers)')
 
-        stats = get_match_stats(conn)
-        _print_match_stats(stats)
+def _run_matching(conn, has_embedder: bool, near_structural: bool = False,
+                  full: bool = False):
+    """Stage 5: exact, near-structural and embedding matches over everything stored so far."""
+    print(f'\n{"="*60}')
+    print('Running cross-domain matching...')
 
-    conn.close()
-    print('\nDone.')
+    exact = find_exact_matches(conn, full=full)
+    print(f'  New exact structural matches: {exact}')
 
+    if near_structural:
+        near = find_near_structural_matches(conn, full=full)
+        print(f'  New near-structural matches: {near}')
 
-def _mark_paper_processed(conn, paper_id: int):
-    """Insert a sentinel row so we don't re-download this paper's source.
-    Returns (possibly new) conn."""
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO equations (paper_id, latex, source_env, position, sympy_parsed, equation_type)
-                VALUES (%s, '', 'none', -1, FALSE, 'none')
-                ON CONFLICT DO NOTHING
-            """, (paper_id,))
-        conn.commit()
-        return conn
-    except Exception:
-        import psycopg2
+    if has_embedder:
         try:
-            conn.rollback()
-        except psycopg2.InterfaceError:
-            try:
-                conn.close()
-            except Exception:
-                pass
-            conn = get_connection()
-        return conn
+            # Need at least 100 rows for ivfflat index; use sequential scan otherwise
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM equations WHERE embedding IS NOT NULL")
+                emb_count = cur.fetchone()[0]
+
+            if emb_count > 0:
+                # Create ivfflat index if we have enough data
+                if emb_count >= 100:
+                    try:
+                        with conn.cursor() as cur:
+                            cur.execute("""
+                                CREATE INDEX IF NOT EXISTS idx_equations_embedding
+                                ON equations USING ivfflat (embedding vector_cosine_ops)
+                                WITH (lists = 100)
+                            """)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+
+                emb_matches = find_embedding_matches(conn)
+                print(f'  New embedding matches: {emb_matches}')
+        except Exception as e:
+            print(f'  Embedding matching skipped: {e}')
+    else:
+        print('  Embedding matching skipped (no sentence-transformers)')
+
+    stats = get_match_stats(conn)
+    _print_match_stats(stats)
 
 
 def _pct(n: int, total: int) -> str:
@@ -343,6 +351,10 @@ def _print_match_stats(stats: dict):
         print(f'  Top cross-domain pairs:')
         for d1, d2, c in stats['top_domain_pairs'][:10]:
             print(f'    {d1} ↔ {d2}: {c}')
+    if stats.get('largest_hubs'):
+        print(f'  Largest hub hashes (representative pairs only):')
+        for h, eqs, papers, domains in stats['largest_hubs'][:5]:
+            print(f'    {h[:12]}: {eqs} equations, {papers} papers, {domains} domains')
 
 
 if __name__ == '__main__':
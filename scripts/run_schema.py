@@ -4,19 +4,7 @@
 import os
 import sys
 
-def load_env():
-    env_path = os.path.join(os.path.dirname(__file__), '..', '.env.local')
-    if not os.path.exists(env_path):
-        return
-    with open(env_path) as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith('#') and '=' in line:
-                key, _, val = line.partition('=')
-                val = val.strip().strip('"').strip("'")
-                os.environ.setdefault(key.strip(), val)
-
-load_env()
+from pipeline.config import get_db_url
 
 try:
     import psycopg2
@@ -24,16 +12,8 @@ except ImportError:
     print('Run: pip install psycopg2-binary')
     sys.exit(1)
 
-db_url = (
-    os.environ.get('POSTGRES_URL_NON_POOLING') or
-    os.environ.get('DATABASE_URL_UNPOOLED') or
-    os.environ.get('POSTGRES_URL') or
-    os.environ.get('DATABASE_URL')
-)
-
-if not db_url:
-    print('No POSTGRES_URL found in .env.local')
-    sys.exit(1)
+# DDL goes to the direct (non-pooled) endpoint when one is configured.
+db_url = get_db_url(unpooled=True)
 
 # Which schema file to apply. Default is the base schema; pass a filename
 # (relative to database/) or an absolute path to apply a specific one, e.g.
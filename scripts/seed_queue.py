@@ -18,7 +18,6 @@ each to the `queue` with status='pending'. Safe to run multiple times —
 duplicates are skipped via ON CONFLICT.
 """
 
-import os
 import sys
 import time
 import urllib.request
@@ -26,6 +25,8 @@ import urllib.parse
 import xml.etree.ElementTree as ET
 from datetime import datetime
 
+from pipeline.config import get_connection
+
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
@@ -86,22 +87,6 @@ ARXIV_API_BASE      = 'https://export.arxiv.org/api/query'
 
 NS = '{http://www.w3.org/2005/Atom}'
 
-# ---------------------------------------------------------------------------
-# .env.local loader (so you don't need to export the var manually)
-# ---------------------------------------------------------------------------
-
-def load_env():
-    env_path = os.path.join(os.path.dirname(__file__), '..', '.env.local')
-    if not os.path.exists(env_path):
-        return
-    with open(env_path) as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith('#') and '=' in line:
-                key, _, val = line.partition('=')
-                val = val.strip().strip('"').strip("'")
-                os.environ.setdefault(key.strip(), val)
-
 # ---------------------------------------------------------------------------
 # arXiv fetch
 # ---------------------------------------------------------------------------
@@ -199,24 +184,14 @@ def print_stats(conn):
 # ---------------------------------------------------------------------------
 
 def main():
-    load_env()
-
-    db_url = (
-        os.environ.get('POSTGRES_URL') or
-        os.environ.get('POSTGRES_URL_NON_POOLING') or
-        os.environ.get('DATABASE_URL')
-    )
-    if not db_url:
-        print('Error: set POSTGRES_URL in .env.local or environment')
-        sys.exit(1)
-
     try:
-        import psycopg2
+        import psycopg2  # noqa: F401
     except ImportError:
         print('Error: pip install psycopg2-binary')
         sys.exit(1)
 
-    conn = psycopg2.connect(db_url, sslmode='require')
+    # Reads .env.local via pipeline.config.load_env
+    conn = get_connection()
     print(f'Connected to database.\n')
 
     total_inserted = total_skipped = 0
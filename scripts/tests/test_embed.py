@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+test_embed.py — The embedder's model handling and request batching.
+
+sentence-transformers isn't needed: a stand-in model is installed as the
+process-wide one, so these check the plumbing around it — one load per
+process, an EmbeddingWorker that hands each caller back exactly its own
+vectors however requests were merged, the EmbeddingAccumulator that
+batches unparsed equations across papers (with the DB write stubbed out),
+the EmbeddingCache that keeps duplicate inputs from being re-embedded, and
+(when numpy is installed) that the in-memory cross-domain neighbour search
+agrees with brute force.
+
+Run from the scripts/ directory:
+    python3 tests/test_embed.py
+"""
+
+import importlib.util
+import sys
+import os
+import random
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import embed, store
+from pipeline.embed import EmbeddingWorker, _normalize_latex_for_embedding, embed_equations
+from pipeline.embedcache import EmbeddingCache
+from pipeline.store import EmbeddingAccumulator
+
+
+class _Vector(list):
+    def tolist(self):
+        return list(self)
+
+
+class FakeModel:
+    """Embeds a string as [len, first char code]; records every encode call."""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False):
+        if self.fail:
+            raise RuntimeError('encode failed')
+        self.calls.append(list(texts))
+        return [_Vector([float(len(t)), float(ord(t[0]) if t else 0)]) for t in texts]
+
+
+def _expected(latex):
+    text = _normalize_latex_for_embedding(latex)
+    return [float(len(text)), float(ord(text[0]) if text else 0)]
+
+
+def _with_model(model, fn):
+    saved = dict(embed._models)
+    embed._models[embed._check_backend(None)] = model
+    try:
+        fn()
+    finally:
+        embed._models.clear()
+        embed._models.update(saved)
+
+
+def _run(tests):
+    passed = 0
+    failed = 0
+    for label, fn in tests:
+        try:
+            fn()
+            print(f'  [PASS] {label}')
+            passed += 1
+        except AssertionError as e:
+            print(f'  [FAIL] {label}')
+            print(f'         {e}')
+            failed += 1
+        except Exception as e:
+            print(f'  [FAIL] {label} — unexpected {type(e).__name__}: {e}')
+            failed += 1
+    print(f'\n── Results: {passed} passed, {failed} failed out of {passed + failed} total ──')
+    return failed == 0
+
+
+def assert_eq(actual, expected, label=''):
+    assert actual == expected, f'{label}\n           expected: {expected!r}\n           got:      {actual!r}'
+
+
+# ─── Tests ───────────────────────────────────────────────────────────────────
+
+def t_model_loaded_once():
+    model = FakeModel()
+
+    def check():
+        embed_equations(['a = b'])
+        embed_equations(['c = d', 'e'])
+        assert embed.get_model() is model
+        assert_eq(len(model.calls), 2, 'encode calls')
+    _with_model(model, check)
+
+
+def t_worker_returns_each_callers_vectors():
+    model = FakeModel()
+    requests = [['x = 1', r'\frac{dN}{dt} = rN'], ['y'], [], [r'E = mc^2', 'z', 'w = 2']]
+
+    def check():
+        with EmbeddingWorker() as worker:
+            futures = [worker.submit(r) for r in requests]
+            results = [f.result(timeout=5) for f in futures]
+        for req, got in zip(requests, results):
+            assert_eq(got, [_expected(latex) for latex in req], f'vectors for {req!r}')
+    _with_model(model, check)
+
+
+def t_worker_merges_queued_requests():
+    model = FakeModel()
+    gate = threading.Event()
+    encode = model.encode
+
+    def slow_encode(texts, **kwargs):
+        gate.wait(5)
+        return encode(texts, **kwargs)
+    model.encode = slow_encode
+
+    def check():
+        with EmbeddingWorker() as worker:
+            first = worker.submit(['a'])
+            rest = [worker.submit([f'b{i}', f'c{i}']) for i in range(5)]
+            gate.set()
+            first.result(timeout=5)
+            for f in rest:
+                f.result(timeout=5)
+        # The first request may have started alone; the five queued behind it
+        # go out together.
+        assert len(model.calls) <= 2, f'{len(model.calls)} encode calls: {model.calls}'
+        assert_eq(sum(len(c) for c in model.calls), 11, 'strings encoded')
+    _with_model(model, check)
+
+
+def t_worker_propagates_errors():
+    def check():
+        with EmbeddingWorker() as worker:
+            future = worker.submit(['a = b'])
+            try:
+                future.result(timeout=5)
+            except RuntimeError as e:
+                assert_eq(str(e), 'encode failed')
+            else:
+                raise AssertionError('expected the encode error on the future')
+    _with_model(FakeModel(fail=True), check)
+
+
+class _Writer:
+    """Stands in for EquationWriter: records flushes and runs DB work inline."""
+
+    def __init__(self, log):
+        self.log = log
+        self.db = SimpleNamespace(run=lambda fn: fn(None))
+
+    def flush(self):
+        self.log.append('flush')
+
+
+def _paper(paper_id, latex_parsed):
+    equations = [SimpleNamespace(position=i, latex=latex) for i, (latex, _) in enumerate(latex_parsed)]
+    norms = [SimpleNamespace(success=parsed) for _, parsed in latex_parsed]
+    return paper_id, equations, norms
+
+
+def _with_writes(log, fn):
+    saved = store.write_embeddings
+
+    def fake_write(conn, rows):
+        log.append(('write', rows))
+        return len(rows)
+    store.write_embeddings = fake_write
+    try:
+        fn()
+    finally:
+        store.write_embeddings = saved
+
+
+def t_accumulator_batches_across_papers():
+    log = []
+    model = FakeModel()
+
+    def check():
+        with EmbeddingWorker() as worker:
+            acc = EmbeddingAccumulator(_Writer(log), worker, flush_rows=4, flush_seconds=3600)
+            assert_eq(acc.add(*_paper(1, [('a = bbbb', False), ('x', True)])), 1, 'queued')
+            acc.add(*_paper(2, [('cc', False)]))
+            assert_eq(log, [], 'nothing flushed below flush_rows')
+            acc.add(*_paper(3, [('ddddddd', False), ('e', False)]))
+            assert_eq(log[0], 'flush', 'paper rows are written before their embeddings')
+            rows = log[1][1]
+            assert_eq([(p, pos) for p, pos, _ in rows], [(1, 0), (2, 0), (3, 0), (3, 1)],
+                      'rows in queue order')
+            for (_, _, vector), latex in zip(rows, ['a = bbbb', 'cc', 'ddddddd', 'e']):
+                assert_eq(vector, _expected(latex), f'vector for {latex!r}')
+            assert_eq(len(model.calls), 1, 'one encode call for four papers\' equations')
+            acc.flush()
+            assert_eq(len(log), 2, 'empty flush writes nothing')
+            assert_eq(acc.summary(), '4 embedded in 1 flushes')
+    _with_model(model, lambda: _with_writes(log, check))
+
+
+def t_accumulator_flushes_on_age():
+    log = []
+
+    def check():
+        with EmbeddingWorker() as worker:
+            acc = EmbeddingAccumulator(_Writer(log), worker, flush_rows=1000, flush_seconds=0.05)
+            acc.add(*_paper(1, [('a = b', False)]))
+            assert_eq(log, [], 'fresh equation waits')
+            time.sleep(0.06)
+            acc.add(*_paper(2, [('c = d', True)]))
+            assert_eq([entry if entry == 'flush' else len(entry[1]) for entry in log], ['flush', 1])
+    _with_model(FakeModel(), lambda: _with_writes(log, check))
+
+
+def t_accumulator_counts_failures():
+    log = []
+
+    def check():
+        with EmbeddingWorker() as worker:
+            acc = EmbeddingAccumulator(_Writer(log), worker, flush_rows=1)
+            acc.add(*_paper(1, [('a = b', False)]))
+            assert_eq(log, ['flush'], 'no write after a failed embed')
+            assert_eq(acc.summary(), '0 embedded in 0 flushes, 1 failed')
+    _with_model(FakeModel(fail=True), lambda: _with_writes(log, check))
+
+
+def t_duplicates_embedded_once():
+    model = FakeModel()
+
+    def check():
+        latex = [r'\left( a \right) = b', '( a ) = b', r'x_{max} = 1', r'x_{min} = 1', 'y']
+        got = embed_equations(latex)
+        assert_eq(got, [_expected(l) for l in latex])
+        assert_eq(model.calls, [['( a ) = b', 'x_{_} = 1', 'y']], 'distinct inputs only')
+    _with_model(model, check)
+
+
+def t_cache_reuses_vectors_across_runs():
+    model = FakeModel()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'embed.sqlite')
+
+        def check():
+            cache = EmbeddingCache('test-model', path)
+            first = embed_equations(['a = b', 'c = d', 'a = b'], cache=cache)
+            assert_eq(cache.summary(), '0.0% hit rate (0 memory, 0 disk, 0 db, 2 misses; '
+                                       '1 in-batch duplicates)')
+            cache.close()
+
+            # A fresh process: nothing in memory, everything on disk.
+            cache = EmbeddingCache('test-model', path)
+            second = embed_equations(['c = d', 'a = b', 'e'], cache=cache)
+            assert_eq(second[:2], [first[1], first[0]], 'cached vectors')
+            assert_eq(model.calls, [['a = b', 'c = d'], ['e']], 'only the new input is encoded')
+            assert_eq(cache.summary(), '66.7% hit rate (0 memory, 2 disk, 0 db, 1 misses; '
+                                       '0 in-batch duplicates)')
+            cache.close()
+
+            # Another model never sees these vectors.
+            cache = EmbeddingCache('other-model', path)
+            assert_eq(cache.get_many(['a = b']), {}, 'keyed by model')
+            cache.close()
+        _with_model(model, check)
+
+
+def t_all_hits_skip_model_load():
+    cache = EmbeddingCache('test-model')
+    cache.put_many({'a = b': [1.0, 2.0]})
+
+    def no_load(backend=None):
+        raise AssertionError('model loaded for a fully cached request')
+    saved_get = embed.get_model
+    embed.get_model = no_load
+    try:
+        assert_eq(embed_equations(['a   =  b'], cache=cache), [[1.0, 2.0]])
+    finally:
+        embed.get_model = saved_get
+
+
+def t_backends_name_their_vectors():
+    assert_eq(embed.model_id('torch'), embed.MODEL_NAME)
+    ids = {embed.model_id(b) for b in embed.EMBED_BACKENDS}
+    assert_eq(len(ids), len(embed.EMBED_BACKENDS), 'one cache namespace per backend')
+    for bad in ('fp16', 'ONNX'):
+        try:
+            embed.model_id(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f'backend {bad!r} accepted')
+
+
+def _brute_force_topk(vectors, labels, queries, k, threshold):
+    def cos(a, b):
+        dot = sum(x * y for x, y in zip(a, b))
+        return dot / ((sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5)
+    out = set()
+    for i in queries:
+        scored = sorted(((cos(vectors[i], vectors[j]), j) for j in range(len(vectors))
+                         if labels[j] != labels[i]), reverse=True)[:k]
+        out |= {(i, j) for s, j in scored if s >= threshold}
+    return out
+
+
+def t_ann_numpy_matches_brute_force():
+    import numpy as np
+    from pipeline import ann
+    rng = random.Random(7)
+    vectors = [[rng.gauss(0, 1) for _ in range(8)] for _ in range(300)]
+    labels = [rng.randrange(4) for _ in vectors]
+    queries = sorted(rng.sample(range(len(vectors)), 120))
+    saved = ann.BLOCK_FLOATS
+    ann.BLOCK_FLOATS = 300 * 7      # force several blocks
+    try:
+        got = ann.cross_domain_topk(ann.unit_rows(np.array(vectors)), np.array(labels),
+                                    np.array(queries), 5, 0.3, 'numpy')
+        got = {(i, j) for i, j, _ in got}
+    finally:
+        ann.BLOCK_FLOATS = saved
+    expected = _brute_force_topk(vectors, labels, queries, 5, 0.3)
+    assert_eq(len(got ^ expected), 0, f'{len(got)} found vs {len(expected)} expected')
+    assert expected, 'threshold left no pairs to compare'
+
+
+def main():
+    tests = [
+        ('Model is loaded once and reused', t_model_loaded_once),
+        ('Worker returns each caller its own vectors', t_worker_returns_each_callers_vectors),
+        ('Worker merges requests queued behind a batch', t_worker_merges_queued_requests),
+        ('Worker surfaces encode errors on the Future', t_worker_propagates_errors),
+        ('Accumulator embeds across papers in one request', t_accumulator_batches_across_papers),
+        ('Accumulator flushes once its oldest row is stale', t_accumulator_flushes_on_age),
+        ('Accumulator counts failed embeds instead of raising', t_accumulator_counts_failures),
+        ('Inputs that normalize alike are embedded once', t_duplicates_embedded_once),
+        ('Cache reuses vectors across runs, keyed by model', t_cache_reuses_vectors_across_runs),
+        ('Fully cached request never loads the model', t_all_hits_skip_model_load),
+        ('Each backend has its own model id', t_backends_name_their_vectors),
+    ]
+    if importlib.util.find_spec('numpy') is None:
+        print('  [SKIP] numpy not installed — in-memory neighbour search check')
+    else:
+        tests.append(('In-memory neighbour search equals brute force', t_ann_numpy_matches_brute_force))
+    return _run(tests)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
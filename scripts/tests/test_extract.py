@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+test_extract.py — The single-pass math scanner must match the regex extractor.
+
+scan_math_spans replaces four finditer sweeps (DISPLAY_ENV_RE,
+DISPLAY_DOLLAR_RE, BRACKET_DISPLAY_RE, INLINE_MATH_RE). Any difference in the
+spans it finds changes which equations — and which positions — end up in the
+DB, so these tests compare it against the regexes directly, on hand-picked
+edge cases and on random delimiter soup. It also covers _decode_source:
+the e-print formats arXiv serves, and the .tex filtering / size caps of the
+streaming tar reader — that a paper's macros are collected across files, and
+that iter_sources can extract on its fetcher thread.
+
+Run from the scripts/ directory:
+    python3 tests/test_extract.py
+"""
+
+import gzip
+import io
+import random
+import re
+import tarfile
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import extract as ext
+from pipeline.extract import (
+    BRACKET_DISPLAY_RE,
+    DISPLAY_DOLLAR_RE,
+    DISPLAY_ENV_RE,
+    INLINE_MATH_RE,
+    MAX_TEX_MEMBER_BYTES,
+    _decode_source,
+    _strip_comments,
+    extract_from_source,
+    scan_math_spans,
+)
+
+
+def _run(tests):
+    passed = 0
+    failed = 0
+    for label, fn in tests:
+        try:
+            fn()
+            print(f'  [PASS] {label}')
+            passed += 1
+        except AssertionError as e:
+            print(f'  [FAIL] {label}')
+            print(f'         {e}')
+            failed += 1
+        except Exception as e:
+            print(f'  [FAIL] {label} — unexpected {type(e).__name__}: {e}')
+            failed += 1
+    print(f'\n── Results: {passed} passed, {failed} failed out of {passed + failed} total ──')
+    return failed == 0
+
+
+def assert_eq(actual, expected, label=''):
+    assert actual == expected, f'{label}\n           expected: {expected!r}\n           got:      {actual!r}'
+
+
+def regex_spans(tex):
+    """(env, start, end, content) exactly as the old four-sweep extractor saw them."""
+    out = []
+    for m in DISPLAY_ENV_RE.finditer(tex):
+        out.append((m.group(1), m.start(), m.end(), m.group(2)))
+    for kind, rx in (('display_dollar', DISPLAY_DOLLAR_RE),
+                     ('bracket_display', BRACKET_DISPLAY_RE),
+                     ('inline', INLINE_MATH_RE)):
+        for m in rx.finditer(tex):
+            out.append((kind, m.start(), m.end(), m.group(1)))
+    return out
+
+
+def scanner_spans(tex):
+    return [(s.env, s.start, s.end, tex[s.content_start:s.content_end])
+            for s in scan_math_spans(tex)]
+
+
+def assert_same(tex):
+    assert_eq(scanner_spans(tex), regex_spans(tex), f'spans differ for {tex!r}')
+
+
+# ─── Hand-picked cases ───────────────────────────────────────────────────
+
+def t_basic_mix():
+    assert_same(r'Let $x = 1$. Then \[ y = 2 \] and $$z = 3$$ and '
+                r'\begin{equation} a = b \end{equation} \begin{align*} c &= d \\ e &= f \end{align*}')
+
+
+def t_dollar_runs():
+    for tex in ['$$$', '$$$$', '$$$x$$$', '$a$$b$', '$$a$b$$', '$ $', '$$ $$', '$$$$$x$$',
+                'a$b$$c$d', '$x$ $$y$$ $z$', '$\\$$', '\\$ $x$']:
+        assert_same(tex)
+
+
+def t_empty_content():
+    # .+? needs at least one character between the delimiters.
+    for tex in ['$$$$ x $$', '\\[\\] x \\]', '\\begin{equation}\\end{equation}', '$$']:
+        assert_same(tex)
+
+
+def t_unclosed_openers():
+    assert_same('$a $$b \\[c \\begin{equation} d \\begin{align} e \\end{align}')
+
+
+def t_escaped_backslash_before_bracket():
+    # \\[2pt] is a line break with spacing, but the regex still sees \[ in it.
+    assert_same(r'\begin{align} a \\[2pt] b \end{align} \] and \\] x')
+
+
+def t_starred_and_mismatched_envs():
+    assert_same(r'\begin{equation*} a \end{equation} b \end{equation*} '
+                r'\begin{gather} c \end{gather*} d \end{gather}')
+
+
+def t_nested_same_env():
+    assert_same(r'\begin{equation} a \begin{equation} b \end{equation} c \end{equation}')
+
+
+def t_unknown_env_ignored():
+    assert_same(r'\begin{figure} $x=1$ \end{figure} \begin{eqnarray} a \end{eqnarray}')
+
+
+def t_strip_comments_matches_per_line():
+    tex = 'a % c1\n\\% kept % c2\r\n%full\n\nb\\%c'
+    expected = '\n'.join(re.sub(r'(?<!\\)%.*$', '', line) for line in tex.split('\n'))
+    assert_eq(_strip_comments(tex), expected)
+
+
+# ─── Random delimiter soup ───────────────────────────────────────────────
+
+_PIECES = ['$', '$$', '\\[', '\\]', '\\\\', 'x', ' ', '\n', '=',
+           '\\begin{equation}', '\\end{equation}', '\\begin{align*}', '\\end{align*}',
+           '\\begin{align}', '\\end{align}', '\\begin{equation*}']
+
+
+def t_fuzz_against_regexes():
+    rng = random.Random(1234)
+    for _ in range(3000):
+        tex = ''.join(rng.choice(_PIECES) for _ in range(rng.randint(0, 30)))
+        assert_same(tex)
+
+
+# ─── Source decoding ─────────────────────────────────────────────────────
+
+_DOC = b'\\documentclass{article}\\begin{document}$x = 1$\\end{document}'
+
+
+def _tarball(members, compress=True):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz' if compress else 'w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def t_decode_formats():
+    expected = [_DOC.decode()]
+    assert_eq(_decode_source(_tarball([('main.tex', _DOC)])), expected, 'tar.gz')
+    assert_eq(_decode_source(_tarball([('main.tex', _DOC)], compress=False)), expected, 'tar')
+    assert_eq(_decode_source(gzip.compress(_DOC)), expected, 'single .tex.gz')
+    assert_eq(_decode_source(_DOC), expected, 'plain text')
+    assert_eq(_decode_source(b'%PDF-1.5 not latex'), None, 'pdf')
+
+
+def t_decode_skips_non_tex_and_oversized():
+    data = _tarball([
+        ('figure.eps', b'%!PS $ $ $' * 1000),
+        ('huge.tex', b'x' * (MAX_TEX_MEMBER_BYTES + 1)),
+        ('main.tex', _DOC),
+        ('notes.tex', 'caf\xe9'.encode('latin-1')),
+    ])
+    assert_eq(_decode_source(data), [_DOC.decode(), 'caf\xe9'])
+
+
+# ─── Paper-level macros ──────────────────────────────────────────────────
+
+def t_paper_macros_from_separate_file():
+    macros_tex = r'\newcommand{\pd}[2]{\frac{\partial #1}{\partial #2}}' + '\n% ' + 'x' * 100
+    main_tex = (r'\documentclass{article}\input{macros}\begin{document}'
+                r'\begin{equation}\pd{u}{t} = k u\end{equation}\end{document}')
+    saved = ext.EXPAND_MACROS
+    ext.EXPAND_MACROS = True
+    try:
+        result = extract_from_source('test', [macros_tex, main_tex])
+    finally:
+        ext.EXPAND_MACROS = saved
+    assert_eq([eq.latex for eq in result.equations], [r'\frac{\partial u}{\partial t} = k u'])
+
+
+# ─── Prefetching ─────────────────────────────────────────────────────────
+
+def t_iter_sources_extracts_on_fetcher_thread():
+    import threading
+    sources = {'a': [r'\documentclass{article}\begin{document}'
+                     r'\begin{equation}\frac{dN}{dt} = r N\end{equation}\end{document}'],
+               'b': None}
+    threads = []
+
+    def extract(arxiv_id, tex_files):
+        threads.append(threading.current_thread().name)
+        return extract_from_source(arxiv_id, tex_files)
+
+    saved = ext.fetch_latex_source
+    ext.fetch_latex_source = sources.get
+    try:
+        got = list(ext.iter_sources(['a', 'b'], prefetch=1, transform=extract))
+    finally:
+        ext.fetch_latex_source = saved
+    assert_eq([arxiv_id for arxiv_id, _ in got], ['a', 'b'])
+    assert_eq([eq.latex for eq in got[0][1].equations], [r'\frac{dN}{dt} = r N'])
+    assert_eq(got[1][1].source_available, False)
+    assert_eq(threads, ['arxiv-fetcher'] * 2, 'extraction thread')
+
+
+def main():
+    tests = [
+        ('Mixed display and inline math', t_basic_mix),
+        ('Runs of $ signs', t_dollar_runs),
+        ('Empty content is not a match', t_empty_content),
+        ('Unclosed openers', t_unclosed_openers),
+        ('\\\\[ inside align still opens \\[', t_escaped_backslash_before_bracket),
+        ('Starred / mismatched \\end', t_starred_and_mismatched_envs),
+        ('Nested same environment', t_nested_same_env),
+        ('Unknown environments ignored', t_unknown_env_ignored),
+        ('_strip_comments equals the per-line version', t_strip_comments_matches_per_line),
+        ('Random delimiter soup (3000 cases)', t_fuzz_against_regexes),
+        ('Decode tar.gz / tar / .gz / plain / pdf', t_decode_formats),
+        ('Decode skips non-.tex and oversized members', t_decode_skips_non_tex_and_oversized),
+        ('Macros from a separate preamble file', t_paper_macros_from_separate_file),
+        ('iter_sources extracts on the fetcher thread, in order', t_iter_sources_extracts_on_fetcher_thread),
+    ]
+    return _run(tests)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
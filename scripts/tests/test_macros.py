@@ -10,7 +10,13 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from pipeline.macros import collect_macros, expand_macros
+from pipeline.macros import (
+    MAX_EXPANSION_PASSES,
+    MacroExpander,
+    collect_macros,
+    compile_macros,
+    expand_macros,
+)
 
 
 def _run(tests):
@@ -133,6 +139,25 @@ def t_collect_multiple_definitions():
     assert 'R' in macros and 'N' in macros and 'norm' in macros and 'Tr' in macros
 
 
+def t_collect_document_order_across_forms():
+    # One scan in document order: the last definition wins whatever its form,
+    # and \let copies the meaning the target has at that point.
+    tex = (r'\def\x{first}' '\n'
+           r'\let\y\x' '\n'
+           r'\DeclareMathOperator{\x}{second}' '\n'
+           r'\newcommand{\z}{\w}\let\v\w\def\w{third}')
+    macros = collect_macros(tex)
+    assert_eq(macros['x'].body, r'\mathrm{second}')
+    assert_eq(macros['y'].body, 'first')
+    assert_eq(macros['v'].body, r'\w')
+    assert_eq(expand_macros(r'\v + \z', macros), 'third + third')
+
+
+def t_collect_skips_definitions_inside_bodies():
+    macros = collect_macros(r'\newcommand{\setup}{\def\inner{x}} \def\outer{y}')
+    assert_eq(sorted(macros), ['outer', 'setup'])
+
+
 # ─── expand_macros ───────────────────────────────────────────────────────
 
 def t_expand_noarg():
@@ -262,6 +287,51 @@ def t_expand_realistic_physics():
               r'\frac{\partial u}{\partial t} = \mathrm{Tr}(\rho) \mathrm{d} x')
 
 
+def t_expand_escaped_backslash_not_a_use():
+    # \\R is a line break followed by R, not a use of \R
+    macros = collect_macros(r'\newcommand{\R}{\mathbb{R}}')
+    assert_eq(expand_macros(r'a \\R \\\R', macros), r'a \\R \\\mathbb{R}')
+
+
+def t_expand_args_after_substituted_body():
+    # \a expands to \b, which takes its argument from the text after \a
+    tex = r'\newcommand{\b}[1]{[#1]}\newcommand{\a}{\b}'
+    macros = collect_macros(tex)
+    assert_eq(expand_macros(r'\a{x} + \a y', macros), r'[x] + [y]')
+
+
+def t_expand_recursion_depth_exact():
+    macros = collect_macros(r'\newcommand{\loop}{\loop x}')
+    assert_eq(expand_macros(r'\loop', macros), r'\loop' + ' x' * MAX_EXPANSION_PASSES)
+
+
+def t_compiled_expander_reused():
+    tex = r"""
+    \newcommand{\norm}[1]{\left\| #1 \right\|}
+    \newcommand{\ip}[2][p]{\langle #2 \rangle_{#1}}
+    """
+    macros = collect_macros(tex)
+    expander = compile_macros(macros)
+    for eq in [r'\norm{\ip{x}} = 1', r'\ip[2]{\norm{y}}', r'a + b', r'\norm x']:
+        assert_eq(expander.expand(eq), expand_macros(eq, macros), eq)
+        assert_eq(expand_macros(eq, expander), expand_macros(eq, macros), eq)
+
+
+def t_expansion_memo_hits_and_bound():
+    tex = r'\def\bra#1{\langle #1 \vert}\newcommand{\E}[1]{\mathbb{E}\left[#1\right]}'
+    macros = collect_macros(tex)
+    expander = compile_macros(macros)
+    for _ in range(3):
+        assert_eq(expander.expand(r'\bra{\psi} = \E{\bra{\psi}}'),
+                  r'\langle \psi \vert = \mathbb{E}\left[\langle \psi \vert\right]')
+    # First pass: \bra{\psi}, \E{...}, and the \bra{\psi} inside it at depth 1.
+    assert_eq((expander.stats.hits, expander.stats.misses), (4, 3))
+    tiny = MacroExpander(macros, cache_size=1)
+    tiny.expand(r'\bra{a} \bra{b} \bra{c}')
+    assert_eq(tiny.stats.evictions, 2)
+    assert_eq(tiny.expand(r'\bra{a} \bra{c}'), r'\langle a \vert \langle c \vert')
+
+
 # ─── End-to-end: normalization should match after expansion ──────────────
 
 def t_e2e_normalize_matches():
@@ -319,6 +389,8 @@ def main():
         ('\\let to unknown target', t_collect_let_to_unknown),
         ('Last redefinition wins', t_collect_last_def_wins),
         ('Multiple definitions in one file', t_collect_multiple_definitions),
+        ('Definitions read in document order', t_collect_document_order_across_forms),
+        ('Definitions inside a body are not collected', t_collect_skips_definitions_inside_bodies),
         # expand_macros
         ('Expand no-arg macro', t_expand_noarg),
         ('Expand single arg (braced)', t_expand_single_arg_braced),
@@ -337,6 +409,11 @@ def main():
         ('Missing argument aborts safely', t_expand_missing_arg_aborts_safely),
         ('Non-macro backslashes preserved', t_expand_preserves_non_macro_backslashes),
         ('Realistic physics preamble', t_expand_realistic_physics),
+        ('Escaped \\\\R is not a macro use', t_expand_escaped_backslash_not_a_use),
+        ('Arguments after a substituted body', t_expand_args_after_substituted_body),
+        ('Recursion stops at MAX_EXPANSION_PASSES', t_expand_recursion_depth_exact),
+        ('Compiled expander matches dict expansion', t_compiled_expander_reused),
+        ('Expansion memo: hits and LRU bound', t_expansion_memo_hits_and_bound),
         # end-to-end
         ('E2E: expanded form matches direct form (heat eq)', t_e2e_normalize_matches),
         ('E2E: without expansion, does NOT match', t_e2e_without_expansion_fails),
@@ -11,9 +11,22 @@ both strings and compares their structure_hashes, printing pass/fail.
 
 import sys
 import os
+import random
+import re
+import tempfile
+import threading
+import warnings
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from pipeline.normalize import normalize_latex
+from pipeline import normalize as norm
+from pipeline.normalize import (
+    TIMEOUT_ERROR,
+    normalize_latex,
+    normalize_latex_bounded,
+    preprocess_fingerprint,
+)
+from pipeline.normalize_pool import NormalizerPool, normalize_many
+from pipeline.normcache import NormalizationCache
 
 
 def assert_match(latex1: str, latex2: str, should_match: bool, label: str) -> bool:
@@ -59,6 +72,68 @@ def assert_match(latex1: str, latex2: str, should_match: bool, label: str) -> bo
     return ok
 
 
+def _preprocess_unfiltered(latex: str) -> str:
+    """_preprocess_latex with every trigger check off: each rule always runs."""
+    def apply(rules, s):
+        for rule in rules:
+            if rule.context and not any(c in s for c in rule.context):
+                continue
+            if rule.pattern is None:
+                s = s.replace(rule.triggers[0], rule.repl)
+            else:
+                s = rule.pattern.sub(rule.repl, s)
+        return s
+    s = apply(norm._PREPROCESS_RULES, latex)
+    for _ in range(norm._COLLAPSE_PASSES):
+        new_s = apply(norm._COLLAPSE_RULES, s)
+        if new_s == s:
+            break
+        s = new_s
+    s = apply(norm._FINAL_RULES, s)
+    return re.sub(r'\s+', ' ', s).strip()
+
+
+_PREPROCESS_PIECES = [
+    r'\leftarrow', r'\gets', ':=', r'^{\top}', r'^\top', '^T', '^{*}', '^*', r'^\dagger',
+    '^{H}', '^{(t+1)}', '^{(2)}', 'x', '{x}', r'\mathbf{x}', '_i', '_{i}', r'\nabla_{\theta}',
+    r'\nabla_\theta', r'\nabla_P', r'\left(', r'\right)', r'\text{ if }', r'\quad', r'\,',
+    r'\dot{x}', r'\ddot{x}', r'\hat{y}', r'\underline{12}', r'\Delta', r'\Delta u',
+    r'\partial', '_{_{a}}', '_{ _{a}}', '^{^{b}}', '_{{c}}', '_{t}_j', r'\limits',
+    ' ', '\n', '=', '{', '}',
+]
+
+
+def _random_canonical_expr(rng, depth):
+    """A random canonical-looking SymPy tree covering every STRUCTURAL_OPERATORS head."""
+    import sympy as sp
+    leaves = [sp.Symbol(f'x{i}') for i in range(4)] + [
+        sp.Integer(2), sp.Integer(-1), sp.Rational(1, 2), sp.I, sp.oo, sp.pi, sp.E, sp.zoo]
+    if depth == 0 or rng.random() < 0.25:
+        return rng.choice(leaves)
+    kind = rng.randrange(9)
+    sub = lambda: _random_canonical_expr(rng, depth - 1)
+    if kind == 0:
+        return sp.Add(*[sub() for _ in range(rng.randint(2, 3))], evaluate=False)
+    if kind == 1:
+        return sp.Mul(*[sub() for _ in range(rng.randint(2, 3))], evaluate=False)
+    if kind == 2:
+        return sp.Pow(sub(), sub(), evaluate=False)
+    if kind == 3:
+        fn = rng.choice([sp.sin, sp.cos, sp.tan, sp.asin, sp.exp, sp.log, sp.Abs, sp.floor, sp.sqrt])
+        return fn(sub(), evaluate=False)
+    if kind == 4:
+        return sp.Function(f'f{rng.randrange(12)}')(sub())
+    if kind == 5:
+        return sp.Derivative(sub(), rng.choice(leaves[:4]))
+    if kind == 6:
+        rel = rng.choice([sp.Lt, sp.Le, sp.Gt, sp.Ge, sp.Eq])
+        return rel(rng.choice(leaves[:4]), rng.choice(leaves[:4]), evaluate=False)
+    if kind == 7:
+        return sp.Limit(sub(), leaves[0], 0)
+    cls = rng.choice([sp.Sum, sp.Product, sp.Integral])
+    return cls(sub(), (rng.choice(leaves[:4]), 0, sub()))
+
+
 def run_tests():
     """Run all tests and report results."""
     tests = []
@@ -217,6 +292,196 @@ def run_tests():
         'ODE vs simple product: MUST NOT match'
     )
 
+    # ── Batch API: process pool must not change results or order ────────────
+    print('\n── Batch normalization (normalize_many) ──')
+
+    batch = [
+        r'\frac{dx}{dt} = \alpha x - \beta x y',
+        r'E = m c^2',
+        r'\theta \leftarrow \theta - \eta \nabla_\theta \mathcal{L}',
+        r'x \in \mathbb{R}',
+    ] * 4
+    serial = [normalize_latex(latex) for latex in batch]
+    parallel = normalize_many(batch, workers=2, chunksize=3)
+    ok = parallel == serial
+    tests.append(('normalize_many matches normalize_latex, in input order', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] normalize_many matches normalize_latex, in input order')
+    else:
+        failed += 1
+        print(f'  [FAIL] normalize_many results differ from serial normalize_latex')
+
+    # Workers must fork from a single-threaded parent: start() refuses
+    # once another thread (prefetcher, embedder) is running.
+    stop = threading.Event()
+    other = threading.Thread(target=stop.wait, daemon=True)
+    other.start()
+    try:
+        NormalizerPool(2).start().close()
+        refused = False
+    except RuntimeError:
+        refused = True
+    finally:
+        stop.set()
+        other.join()
+    single = threading.active_count() == 1
+    tests.append(('NormalizerPool.start refuses a multi-threaded parent', refused and single))
+    if refused and single:
+        passed += 1
+        print(f'  [PASS] NormalizerPool.start refuses a multi-threaded parent')
+    else:
+        failed += 1
+        print(f'  [FAIL] NormalizerPool.start: refused={refused}, '
+              f'threads after={threading.active_count()}')
+
+    # ── Bounded mode: pathological input is abandoned, not waited out ───────
+    print('\n── Bounded normalization (timeout) ──')
+
+    slow = '+'.join(f'(a_{i}+b_{i})^{{{i}}}' for i in range(400))
+    r_slow = normalize_latex_bounded(slow, timeout=0.2)
+    r_fast = normalize_latex_bounded(r'E = m c^2', timeout=0.2)
+    ok = (not r_slow.success and r_slow.aborted == 'timeout'
+          and r_slow.error == TIMEOUT_ERROR and r_fast == normalize_latex(r'E = m c^2'))
+    tests.append(('Bounded mode times out pathological input only', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] Bounded mode times out pathological input only')
+    else:
+        failed += 1
+        print(f'  [FAIL] Bounded mode: slow={r_slow.aborted!r} ({r_slow.error}), fast ok={r_fast.success}')
+
+    # A MemoryError is a budget abort under the watchdog, a plain failed
+    # parse everywhere else.
+    def _exhausted(*args, **kwargs):
+        raise MemoryError()
+    saved_get_parser = norm._get_parser
+    norm._get_parser = lambda: _exhausted
+    try:
+        r_plain = normalize_latex(r'E = m c^2')
+        r_bounded = normalize_latex_bounded(r'E = m c^2')
+    except MemoryError:
+        r_plain = r_bounded = None
+    finally:
+        norm._get_parser = saved_get_parser
+    ok = (r_plain is not None and not r_plain.success and r_plain.aborted is None
+          and not r_bounded.success and r_bounded.aborted == 'memory')
+    tests.append(('MemoryError fails softly unbounded, aborts when bounded', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] MemoryError fails softly unbounded, aborts when bounded')
+    else:
+        failed += 1
+        print(f'  [FAIL] MemoryError: unbounded={r_plain!r}, bounded={r_bounded!r}')
+
+    # ── Normalization cache: hits must be indistinguishable from fresh runs ─
+    print('\n── Normalization cache ──')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'norm.sqlite')
+        first = NormalizationCache(path)
+        fresh = normalize_many(batch, workers=1, cache=first)
+        first.close()
+        second = NormalizationCache(path)   # new process-equivalent: disk tier only
+        cached = normalize_many(batch, workers=1, cache=second)
+        ok = cached == fresh == serial and second.disk_hits == len(set(batch)) and second.misses == 0
+        second.close()
+    tests.append(('Cached results equal fresh results (disk tier)', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] Cached results equal fresh results (disk tier)')
+    else:
+        failed += 1
+        print(f'  [FAIL] Cached results differ from fresh results')
+
+    # ── Preprocess fingerprint ───────────────────────────────────────────────
+    # renormalize.py skips rows whose stored preprocess_hash still matches, so
+    # the fingerprint on a result must be the one computed from its input, and
+    # notation that preprocesses identically must share it.
+    r = normalize_latex(r'\frac{dx}{dt} := a x')
+    ok = (r.preprocess_hash == preprocess_fingerprint(r'\frac{dx}{dt} := a x')
+          and preprocess_fingerprint(r'x := y') == preprocess_fingerprint(r'x \gets y')
+          and preprocess_fingerprint(r'x = y') != preprocess_fingerprint(r'x = z'))
+    tests.append(('Preprocess fingerprint is stable', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] Preprocess fingerprint is stable')
+    else:
+        failed += 1
+        print(f'  [FAIL] Preprocess fingerprint mismatch')
+
+    # ── Preprocessing rule triggers ──────────────────────────────────────────
+    # _preprocess_latex skips a rule when none of its trigger substrings is
+    # present. Skipping must never change the output.
+    rng = random.Random(15)
+    mismatches = []
+    for _ in range(5000):
+        latex = ''.join(rng.choice(_PREPROCESS_PIECES) for _ in range(rng.randint(0, 12)))
+        if norm._preprocess_latex(latex) != _preprocess_unfiltered(latex):
+            mismatches.append(latex)
+    ok = not mismatches
+    tests.append(('Preprocess rule triggers are sound', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] Preprocess rule triggers are sound')
+    else:
+        failed += 1
+        print(f'  [FAIL] Trigger prefilter changed the output for {mismatches[0]!r}')
+
+    # ── Structure walk ───────────────────────────────────────────────────────
+    # normalize_latex scores by walking the expression tree; the walk must give
+    # exactly what scanning the srepr text gives, and its subtree digests must
+    # not depend on the order of commutative operands.
+    import sympy as sp
+    from sympy import srepr
+    rng = random.Random(17)
+    mismatches = []
+    for _ in range(400):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')    # relationals inside Add/Mul
+                parts = [_random_canonical_expr(rng, 3) for _ in range(rng.randint(1, 2))]
+                form = ' = '.join(srepr(p) for p in parts)
+        except Exception:
+            continue    # SymPy refused the random combination
+        if norm._walk_structure(parts).score != norm._compute_structure_score(form):
+            mismatches.append(form)
+    x0, x1 = sp.symbols('x0 x1')
+    forward = sp.Add(x0, sp.Pow(x1, 2, evaluate=False), evaluate=False)
+    backward = sp.Add(sp.Pow(x1, 2, evaluate=False), x0, evaluate=False)
+    other = sp.Add(x0, sp.Pow(x1, 3, evaluate=False), evaluate=False)
+    digest = lambda e: norm._walk_structure([e]).subtrees[-1].digest     # the root node
+    ok = (not mismatches and digest(forward) == digest(backward)
+          and digest(forward) != digest(other))
+    tests.append(('Structure walk matches the srepr score', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] Structure walk matches the srepr score')
+    else:
+        failed += 1
+        print(f'  [FAIL] Structure walk: score differs for {mismatches[:1]!r} '
+              f'or digests depend on operand order')
+
+    # ── Subtree hashes ───────────────────────────────────────────────────────
+    # A shared right-hand side must produce a shared subtree hash whatever the
+    # symbol names and whatever sits on the left; trivial equations index nothing.
+    lv = normalize_latex(r'\frac{dx}{dt} = \alpha x - \beta x y')
+    lv_renamed = normalize_latex(r'q = a u - b u v')
+    logistic = normalize_latex(r'\frac{dN}{dt} = r N (1 - N/K)')
+    trivial = normalize_latex(r'E = m c^2')
+    ok = (bool(set(lv.subtrees) & set(lv_renamed.subtrees))
+          and not set(lv.subtrees) & set(logistic.subtrees)
+          and trivial.subtrees == {}
+          and all(n >= norm.MIN_SUBTREE_NODES for n in logistic.subtrees.values())
+          and max(logistic.subtrees.values()) < logistic.structure_size)
+    tests.append(('Subtree hashes are name- and context-independent', ok))
+    if ok:
+        passed += 1
+        print(f'  [PASS] Subtree hashes are name- and context-independent')
+    else:
+        failed += 1
+        print(f'  [FAIL] Subtree hashes: {lv.subtrees} / {lv_renamed.subtrees} / {trivial.subtrees}')
+
     # ── Summary ──────────────────────────────────────────────────────────────
     print(f'\n── Results: {passed} passed, {failed} failed out of {passed + failed} total ──')
     if failed == 0:
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+test_renormalize.py — Each renormalize chunk commits once, with its match delta.
+
+No database is needed: a stand-in connection records statements, commits and
+rollbacks, and can fail on any statement. The chunk's row writes
+(_write_chunk, which needs psycopg2) are stubbed out; the match helpers run
+as written. A failure anywhere after the rows are stamped must leave nothing
+committed, so the next run still sees those rows as stale.
+
+Run from the scripts/ directory:
+    python3 tests/test_renormalize.py
+"""
+
+import sys
+import os
+from contextlib import contextmanager
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import renormalize
+from pipeline.config import ConnectionManager
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.conn.fail_on and self.conn.fail_on in sql:
+            raise RuntimeError(f'injected failure on {self.conn.fail_on!r}')
+        self.conn.log.append(' '.join(sql.split()))
+        self.rowcount = 1
+
+
+class FakeConn:
+    """Records what happens to it; raises on the first statement containing fail_on."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.closed = False
+        self.log = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class _DB(ConnectionManager):
+    """ConnectionManager.run over one FakeConn."""
+
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            yield self.conn
+        finally:
+            self.conn.rollback()
+
+
+def _apply(db, near_structural=False, touched=('h1', 'h2')):
+    def write(conn):
+        return renormalize._apply_chunk(
+            conn, [(1, 'form', 'h1', 'ode', 'p')], [], [], [1, 2], [], [1, 2],
+            None if touched is None else list(touched), near_structural)
+    return db.run(write)
+
+
+def _with_stub_write(fn):
+    saved = renormalize._write_chunk
+
+    def fake_write(conn, *args):
+        conn.log.append('write rows')
+    renormalize._write_chunk = fake_write
+    try:
+        fn()
+    finally:
+        renormalize._write_chunk = saved
+
+
+def _run(tests):
+    passed = 0
+    failed = 0
+    for label, fn in tests:
+        try:
+            _with_stub_write(fn)
+            print(f'  [PASS] {label}')
+            passed += 1
+        except AssertionError as e:
+            print(f'  [FAIL] {label}')
+            print(f'         {e}')
+            failed += 1
+        except Exception as e:
+            print(f'  [FAIL] {label} — unexpected {type(e).__name__}: {e}')
+            failed += 1
+    print(f'\n── Results: {passed} passed, {failed} failed out of {passed + failed} total ──')
+    return failed == 0
+
+
+def assert_eq(actual, expected, label=''):
+    assert actual == expected, f'{label}\n           expected: {expected!r}\n           got:      {actual!r}'
+
+
+# ─── Tests ───────────────────────────────────────────────────────────────────
+
+def t_chunk_commits_once():
+    conn = FakeConn()
+    removed, added = _apply(_DB(conn), near_structural=True)
+    assert_eq(conn.commits, 1, 'commits')
+    assert_eq(conn.log[0], 'write rows', 'rows written first')
+    assert any(s.startswith('DELETE FROM equation_matches') for s in conn.log), conn.log
+    assert any('INSERT INTO equation_matches' in s for s in conn.log), conn.log
+    assert_eq((removed, added), (2, 3), '(removed, added) rowcounts')
+
+
+def _assert_nothing_committed(fail_on, near_structural=False):
+    conn = FakeConn(fail_on=fail_on)
+    try:
+        _apply(_DB(conn), near_structural=near_structural)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError(f'expected the injected failure on {fail_on!r}')
+    assert_eq(conn.log[0], 'write rows', 'rows were written before the failure')
+    assert_eq(conn.commits, 0, f'commits after a failure on {fail_on!r}')
+    assert conn.rollbacks >= 1, 'transaction rolled back'
+
+
+def t_failure_after_stale_delete_commits_nothing():
+    # The rows are stamped and their stale matches deleted; re-matching fails.
+    _assert_nothing_committed('INSERT INTO equation_matches')
+
+
+def t_failure_in_bucket_refresh_commits_nothing():
+    _assert_nothing_committed('structure_buckets')
+
+
+def t_failure_in_near_delta_commits_nothing():
+    _assert_nothing_committed("match_type = 'near_structural'", near_structural=True)
+
+
+def t_full_run_writes_rows_only():
+    conn = FakeConn()
+    assert_eq(_apply(_DB(conn), near_structural=True, touched=None), (0, 0))
+    assert_eq(conn.log, ['write rows'], 'no per-chunk match delta under --full')
+    assert_eq(conn.commits, 1, 'commits')
+
+
+def main():
+    print('\n── Renormalize chunk transactions ──')
+    return _run([
+        ('Rows and match delta commit once, together', t_chunk_commits_once),
+        ('Failure re-matching hashes commits nothing', t_failure_after_stale_delete_commits_nothing),
+        ('Failure refreshing buckets commits nothing', t_failure_in_bucket_refresh_commits_nothing),
+        ('Failure in the near-structural delta commits nothing', t_failure_in_near_delta_commits_nothing),
+        ('--full chunks write rows only', t_full_run_writes_rows_only),
+    ])
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -22,10 +22,10 @@ Usage:
 from __future__ import annotations
 
 import argparse
-import time
 
 from pipeline.config import get_connection
-from pipeline.extract import extract_paper, ARXIV_DELAY
+from pipeline.extract import extract_paper
+from pipeline.match import guard_equation_inserts
 
 
 def main():
@@ -87,30 +87,38 @@ def main():
             if not args.dry_run:
                 # Remove sentinel row
                 with conn.cursor() as cur:
+                    guard_equation_inserts(cur)
                     cur.execute("""
                         DELETE FROM equations
                         WHERE paper_id = %s AND position = -1
                     """, (paper_id,))
 
                     # Insert the new equations
-                    from pipeline.normalize import normalize_latex
+                    from pipeline.normalize import NORMALIZER_VERSION, normalize_latex
+                    from pipeline.store import subtree_rows
                     for eq in result.equations:
                         norm = normalize_latex(eq.latex)
                         cur.execute("""
                             INSERT INTO equations
                                 (paper_id, latex, source_env, position,
                                  sympy_parsed, normalized_form, structure_hash,
-                                 equation_type)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                                 equation_type, normalizer_version, preprocess_hash)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                            RETURNING id
                         """, (paper_id, eq.latex.replace('\x00', ''), eq.source_env,
                               eq.position, norm.success,
                               (norm.normalized_form or '').replace('\x00', '') or None,
-                              norm.structure_hash, norm.equation_type))
+                              norm.structure_hash, norm.equation_type,
+                              NORMALIZER_VERSION, norm.preprocess_hash))
+                        eq_id = cur.fetchone()[0]
+                        for subtree_hash, nodes, share in subtree_rows(norm):
+                            cur.execute("""
+                                INSERT INTO equation_subtrees (subtree_hash, equation_id, nodes, share)
+                                VALUES (%s, %s, %s, %s)
+                                ON CONFLICT DO NOTHING
+                            """, (subtree_hash, eq_id, nodes, share))
                 conn.commit()
 
-        if i < len(retry_candidates) - 1:
-            time.sleep(ARXIV_DELAY)
-
     print(f'\nRe-extraction done.')
     print(f'  Recovered:   {recovered}')
     print(f'  Still empty: {still_empty}')